@@ -0,0 +1,276 @@
+"""
+Admission control for upstream LLM calls: per-provider/per-model concurrency
+limits, a priority wait queue and adaptive (AIMD) limits.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .config import config
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# 数值越小优先级越高；未知优先级按 interactive 处理
+PRIORITIES: Dict[str, int] = {
+    "interactive": 0,
+    "batch": 10,
+}
+
+QueueCallback = Callable[[int], None]
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """Whether an exception represents an upstream 429 / rate limit."""
+    for candidate in (exc, getattr(exc, "response", None)):
+        if candidate is None:
+            continue
+        for attr in ("status_code", "code", "status"):
+            if getattr(candidate, attr, None) == 429:
+                return True
+    return False
+
+
+class AdaptiveLimit:
+    """Concurrency limit for one lane, adjusted with additive-increase / multiplicative-decrease."""
+
+    SPIKE_FACTOR = 2.0
+    SPIKE_MIN_SECONDS = 1.0
+    EWMA_ALPHA = 0.2
+    DECREASE_COOLDOWN = 1.0
+
+    def __init__(self, name: str, max_limit: int, min_limit: int = 1, adaptive: bool = True):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.adaptive = adaptive
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.ewma_latency: Optional[float] = None
+        self._last_decrease = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(math.floor(self.limit)))
+
+    def has_room(self) -> bool:
+        return self.in_flight < self.capacity
+
+    def record_success(self, latency: float) -> None:
+        if self.adaptive:
+            if (
+                self.ewma_latency is not None
+                and latency > self.SPIKE_MIN_SECONDS
+                and latency > self.ewma_latency * self.SPIKE_FACTOR
+            ):
+                self._decrease(0.8, reason=f"延迟突增 {latency:.2f}s")
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += self.EWMA_ALPHA * (latency - self.ewma_latency)
+
+    def record_throttle(self) -> None:
+        if self.adaptive:
+            self._decrease(0.5, reason="上游限流 429")
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        previous = self.capacity
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        if self.capacity != previous:
+            logger.warning("并发上限收缩: lane=%s %s -> %s (%s)", self.name, previous, self.capacity, reason)
+
+
+class AdmissionTicket:
+    """Handle for an admitted call; used to report time-to-first-token for streams."""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+    def mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    @property
+    def latency(self) -> float:
+        end = self.first_token_at if self.first_token_at is not None else time.monotonic()
+        return end - self.started_at
+
+
+class _Waiter:
+    __slots__ = ("lanes", "future", "on_queued", "position")
+
+    def __init__(self, lanes: List[AdaptiveLimit], future: "asyncio.Future[None]", on_queued: Optional[QueueCallback]):
+        self.lanes = lanes
+        self.future = future
+        self.on_queued = on_queued
+        self.position = 0
+
+
+class AdmissionController:
+    """Bounds in-flight upstream calls per provider and per model.
+
+    Waiting calls are admitted in priority order (then FIFO). A waiter is
+    only admitted when every lane it needs has room, and waiters blocked on a
+    saturated lane do not hold back waiters for other lanes.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        provider_limit: int,
+        model_limit: int,
+        adaptive: bool = True,
+        min_limit: int = 1,
+        max_lanes: int = 256,
+    ):
+        self.enabled = enabled
+        self.provider_limit = provider_limit
+        self.model_limit = model_limit
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_lanes = max(2, max_lanes)
+        # 按最近使用排序；模型名来自请求，超出上限时淘汰最久未用的空闲车道
+        self._lanes: Dict[str, AdaptiveLimit] = {}
+        self._waiters: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+
+    def _lane(self, name: str, max_limit: int) -> AdaptiveLimit:
+        lane = self._lanes.pop(name, None)
+        if lane is None:
+            if len(self._lanes) >= self.max_lanes:
+                self._evict_idle()
+            lane = AdaptiveLimit(name, max_limit, min_limit=self.min_limit, adaptive=self.adaptive)
+        self._lanes[name] = lane
+        return lane
+
+    def _evict_idle(self) -> None:
+        """Drop least recently used lanes with nothing in flight or queued until under ``max_lanes``."""
+        waiting = {id(lane) for _, _, waiter in self._waiters for lane in waiter.lanes}
+        excess = len(self._lanes) - self.max_lanes + 1
+        for name, lane in list(self._lanes.items()):
+            if excess <= 0:
+                break
+            if lane.in_flight == 0 and id(lane) not in waiting:
+                del self._lanes[name]
+                excess -= 1
+
+    def _lanes_for(self, provider: str, model: str) -> List[AdaptiveLimit]:
+        return [
+            self._lane(f"provider:{provider}", self.provider_limit),
+            self._lane(f"model:{provider}/{model}", self.model_limit),
+        ]
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        model: str,
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
+    ) -> AsyncIterator[AdmissionTicket]:
+        """Hold one in-flight slot for ``provider``/``model`` for the duration of the block."""
+        if not self.enabled:
+            yield AdmissionTicket()
+            return
+
+        lanes = self._lanes_for(provider, model)
+        await self._acquire(lanes, PRIORITIES.get(priority or "interactive", 0), on_queued)
+        ticket = AdmissionTicket()
+        try:
+            yield ticket
+        except Exception as exc:
+            if is_throttle_error(exc):
+                for lane in lanes:
+                    lane.record_throttle()
+            raise
+        else:
+            latency = ticket.latency
+            for lane in lanes:
+                lane.record_success(latency)
+        finally:
+            self._release(lanes)
+
+    async def _acquire(self, lanes: List[AdaptiveLimit], rank: int, on_queued: Optional[QueueCallback]) -> None:
+        waiter = _Waiter(lanes, asyncio.get_running_loop().create_future(), on_queued)
+        entry = (rank, next(self._seq), waiter)
+        bisect.insort(self._waiters, entry)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已获准入但调用方被取消，归还名额
+                self._release(lanes)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                self._dispatch()
+            raise
+
+        if waiter.position and on_queued is not None:
+            on_queued(0)
+
+    def _release(self, lanes: List[AdaptiveLimit]) -> None:
+        for lane in lanes:
+            lane.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        remaining: List[Tuple[int, int, _Waiter]] = []
+        for entry in self._waiters:
+            waiter = entry[2]
+            if waiter.future.done():
+                continue
+            if all(lane.has_room() for lane in waiter.lanes):
+                for lane in waiter.lanes:
+                    lane.in_flight += 1
+                waiter.future.set_result(None)
+            else:
+                remaining.append(entry)
+        self._waiters = remaining
+
+        for position, (_, _, waiter) in enumerate(remaining, 1):
+            if waiter.position != position:
+                waiter.position = position
+                if waiter.on_queued is not None:
+                    waiter.on_queued(position)
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            "queued": len(self._waiters),
+            "lanes": {
+                name: {
+                    "in_flight": lane.in_flight,
+                    "limit": lane.capacity,
+                    "ewma_latency": lane.ewma_latency,
+                }
+                for name, lane in self._lanes.items()
+            },
+        }
+
+
+# Global admission controller
+admission = AdmissionController(
+    enabled=config.admission_enabled,
+    provider_limit=config.llm_max_in_flight_per_provider,
+    model_limit=config.llm_max_in_flight_per_model,
+    adaptive=config.admission_adaptive,
+    min_limit=config.admission_min_limit,
+    max_lanes=config.admission_max_lanes,
+)
@@ -2,56 +2,50 @@
 
 import asyncio
 import json
-import re
-from typing import AsyncGenerator, Dict, List, Optional, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set, Tuple
 
+from .admission import QueueCallback
 from .config import config
-from .clients import client_manager
+from .context import build_user_prompt, estimate_tokens
+from .html_stream import IncrementalHTMLExtractor
+from .llm_router import Endpoint, llm_router
+from .logging_config import get_logger
+from .metrics import GENERATION_SECONDS, GENERATION_TOKENS_PER_SECOND, GENERATION_TTFT_SECONDS, model_label
+from .tracing import start_span
+from .usage import estimate_usage, from_gemini, from_openai, record_usage
 from .prompts import (
     SCIENCE_PLANNER_PROMPT,
     SCIENCE_PAGE_GENERATION_PROMPT,
+    HISTORY_SUMMARY_PROMPT,
 )
 
 
+logger = get_logger(__name__)
+
+# 拒绝过 stream_options 的 OpenAI 兼容端点（按 base_url），之后的流式请求不再携带
+_NO_STREAM_USAGE: Set[str] = set()
+
+
 class SciencePlannerAgent:
     """Planner agent orchestrating search decisions and prompt blueprints."""
     
     @staticmethod
-    async def plan(
+    def _prepare_planner_context(
         topic: str,
-        search_results: Optional[List[dict]] = None,
-        history: Optional[List[dict]] = None,
-        model: Optional[str] = None,
-    ) -> str:
-        if not client_manager.is_ready():
+        search_results: Optional[List[dict]],
+        history: Optional[List[dict]],
+        model: Optional[str],
+    ) -> Tuple[str, str, str, List[dict]]:
+        if not llm_router.is_ready():
             raise RuntimeError("未配置 API，请检查 API_KEY")
         
         model = model or config.science_planner_model
         history = history or []
         
         system_prompt = SCIENCE_PLANNER_PROMPT
-        payload = {
-            "topic": topic,
-            "search_results": search_results or [],
-        }
-        user_prompt = json.dumps(payload, ensure_ascii=False, indent=2)
-        
-        if client_manager.use_gemini:
-            if history:
-                history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-                full_prompt = f"{history_text}\n\n系统: {system_prompt}\n\n用户: {user_prompt}"
-            else:
-                full_prompt = f"系统: {system_prompt}\n\n用户: {user_prompt}"
-            
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: client_manager.gemini_client.models.generate_content(
-                    model=model,
-                    contents=full_prompt
-                )
-            )
-            
-            return response.text.strip()
+        user_prompt = build_user_prompt("planner", {"topic": topic}, search_results)
         
         messages = [
             {"role": "system", "content": system_prompt},
@@ -59,18 +53,60 @@ class SciencePlannerAgent:
             {"role": "user", "content": user_prompt},
         ]
         
-        response = await client_manager.openai_client.chat.completions.create(
+        return model, system_prompt, user_prompt, messages
+    
+    @staticmethod
+    async def plan(
+        topic: str,
+        search_results: Optional[List[dict]] = None,
+        history: Optional[List[dict]] = None,
+        model: Optional[str] = None,
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
+    ) -> str:
+        model, system_prompt, user_prompt, messages = SciencePlannerAgent._prepare_planner_context(
+            topic=topic,
+            search_results=search_results,
+            history=history,
             model=model,
-            messages=messages,
-            temperature=0.2,
-            stream=False,
         )
         
-        content = response.choices[0].message.content
-        if content is None or not content.strip():
+        content = await llm_router.run(
+            model,
+            lambda endpoint, provider_model: _complete(endpoint, provider_model, messages, 0.2, "planner"),
+            priority,
+            on_queued,
+        )
+        if not content.strip():
             raise ValueError("策划代理返回空响应")
         
         return content.strip()
+    
+    @staticmethod
+    async def stream_plan(
+        topic: str,
+        search_results: Optional[List[dict]] = None,
+        history: Optional[List[dict]] = None,
+        model: Optional[str] = None,
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
+    ) -> AsyncGenerator[str, None]:
+        """Stream the planner's raw JSON output as text deltas."""
+        model, system_prompt, user_prompt, messages = SciencePlannerAgent._prepare_planner_context(
+            topic=topic,
+            search_results=search_results,
+            history=history,
+            model=model,
+        )
+        
+        deltas = llm_router.stream(
+            model,
+            lambda endpoint, provider_model: _stream(endpoint, provider_model, messages, 0.2, "planner"),
+            priority,
+            on_queued,
+        )
+        async for delta in deltas:
+            yield delta
 
 
 class SciencePageGenerator:
@@ -83,8 +119,8 @@ class SciencePageGenerator:
         search_results: Optional[List[dict]],
         history: Optional[List[dict]],
         model: Optional[str],
-    ) -> Tuple[str, str, str, List[dict], bool]:
-        if not client_manager.is_ready():
+    ) -> Tuple[str, str, str, List[dict]]:
+        if not llm_router.is_ready():
             raise RuntimeError("未配置 API，请检查 API_KEY")
         
         planner_payload = planner_payload or {}
@@ -99,7 +135,6 @@ class SciencePageGenerator:
         knowledge_outline = planner_payload.get("knowledge_outline")
         if knowledge_outline is None or not isinstance(knowledge_outline, list):
             knowledge_outline = []
-        search_results = search_results or []
         
         model_name = model or config.science_generation_model
         history = history or []
@@ -110,9 +145,8 @@ class SciencePageGenerator:
             "blueprint": blueprint,
             "json_prompt": json_prompt,
             "knowledge_outline": knowledge_outline,
-            "search_results": search_results,
         }
-        user_prompt = json.dumps(payload, ensure_ascii=False, indent=2)
+        user_prompt = build_user_prompt("generation", payload, search_results)
         
         messages = [
             {"role": "system", "content": system_prompt},
@@ -120,7 +154,7 @@ class SciencePageGenerator:
             {"role": "user", "content": user_prompt},
         ]
         
-        return model_name, system_prompt, user_prompt, messages, client_manager.use_gemini
+        return model_name, system_prompt, user_prompt, messages
     
     @staticmethod
     async def generate(
@@ -129,8 +163,10 @@ class SciencePageGenerator:
         search_results: Optional[List[dict]] = None,
         history: Optional[List[dict]] = None,
         model: Optional[str] = None,
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
     ) -> str:
-        model_name, system_prompt, user_prompt, messages, use_gemini = SciencePageGenerator._prepare_generation_context(
+        model_name, system_prompt, user_prompt, messages = SciencePageGenerator._prepare_generation_context(
             topic=topic,
             planner_payload=planner_payload,
             search_results=search_results,
@@ -138,31 +174,13 @@ class SciencePageGenerator:
             model=model,
         )
         
-        if use_gemini:
-            if history:
-                history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-                full_prompt = f"{history_text}\n\n系统: {system_prompt}\n\n用户: {user_prompt}"
-            else:
-                full_prompt = f"系统: {system_prompt}\n\n用户: {user_prompt}"
-            
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: client_manager.gemini_client.models.generate_content(
-                    model=model_name,
-                    contents=full_prompt
-                )
-            )
-            
-            return _normalize_model_output(response.text)
-        
-        response = await client_manager.openai_client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            temperature=0.25,
-            stream=False,
+        content = await llm_router.run(
+            model_name,
+            lambda endpoint, provider_model: _complete(endpoint, provider_model, messages, 0.25, "generation"),
+            priority,
+            on_queued,
         )
-        
-        return _normalize_model_output(response.choices[0].message.content)
+        return _normalize_model_output(content)
     
     @staticmethod
     async def stream_generate(
@@ -171,8 +189,10 @@ class SciencePageGenerator:
         search_results: Optional[List[dict]] = None,
         history: Optional[List[dict]] = None,
         model: Optional[str] = None,
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
     ) -> AsyncGenerator[Dict[str, Optional[str]], None]:
-        model_name, system_prompt, user_prompt, messages, use_gemini = SciencePageGenerator._prepare_generation_context(
+        model_name, system_prompt, user_prompt, messages = SciencePageGenerator._prepare_generation_context(
             topic=topic,
             planner_payload=planner_payload,
             search_results=search_results,
@@ -180,72 +200,236 @@ class SciencePageGenerator:
             model=model,
         )
         
-        if use_gemini:
-            if history:
-                history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-                full_prompt = f"{history_text}\n\n系统: {system_prompt}\n\n用户: {user_prompt}"
-            else:
-                full_prompt = f"系统: {system_prompt}\n\n用户: {user_prompt}"
-            
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: client_manager.gemini_client.models.generate_content(
-                    model=model_name,
-                    contents=full_prompt
-                )
-            )
+        deltas = llm_router.stream(
+            model_name,
+            lambda endpoint, provider_model: _stream(endpoint, provider_model, messages, 0.25, "generation"),
+            priority,
+            on_queued,
+        )
+        
+        extractor = IncrementalHTMLExtractor()
+        label = model_label(model_name)
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        # 生成器跨 yield，不激活 span，只挂到调用方当前的 span 下
+        ttfb_span = start_span("ttfb", start=started, model=model_name)
+        stream_span = None
+        chunks = 0
+        async for delta in deltas:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                GENERATION_TTFT_SECONDS.observe(first_token_at - started, label)
+                ttfb_span.finish(first_token_at)
+                stream_span = start_span("stream", start=first_token_at)
+            chunks += 1
+            extractor.feed(delta)
             yield {
-                "type": "final",
-                "content": _normalize_model_output(response.text),
+                "type": "delta",
+                "content": delta,
             }
-            return
-        
-        stream = await client_manager.openai_client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            temperature=0.25,
-            stream=True,
-        )
         
-        accumulated_chunks: List[str] = []
-        async for chunk in stream:
-            for choice in chunk.choices:
-                delta = choice.delta.content if choice.delta else None
-                if not delta:
-                    continue
-                accumulated_chunks.append(delta)
-                yield {
-                    "type": "delta",
-                    "content": delta,
-                }
-        
-        raw_text = "".join(accumulated_chunks)
-        if raw_text:
-            final_content = _normalize_model_output(raw_text)
-        else:
-            final_content = ""
+        if stream_span is not None:
+            stream_span.finish(chunks=chunks, chars=len(extractor))
+        normalize_span = start_span("normalize")
+        final_content = extractor.result() if len(extractor) else ""
+        normalize_span.finish()
+        finished = time.perf_counter()
+        GENERATION_SECONDS.observe(finished - started, label)
+        if first_token_at is not None and finished > first_token_at:
+            GENERATION_TOKENS_PER_SECOND.observe(
+                estimate_tokens(final_content) / (finished - first_token_at), label
+            )
         yield {
             "type": "final",
             "content": final_content,
         }
 
 
-def _normalize_model_output(raw: Optional[str]) -> str:
-    """Normalize model text output into clean HTML."""
-    if raw is None:
-        raise ValueError("网页生成代理返回空响应")
+class HistorySummarizerAgent:
+    """Folds older conversation turns into a short rolling summary using a cheap model."""
+    
+    @staticmethod
+    async def summarize(
+        previous_summary: str,
+        messages: List[dict],
+        model: Optional[str] = None,
+        priority: Optional[str] = None,
+    ) -> str:
+        if not llm_router.is_ready():
+            raise RuntimeError("未配置 API，请检查 API_KEY")
+        
+        model = model or config.history_summary_model
+        system_prompt = HISTORY_SUMMARY_PROMPT
+        user_prompt = json.dumps(
+            {"previous_summary": previous_summary, "messages": messages},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        text = await llm_router.run(
+            model,
+            lambda endpoint, provider_model: _complete(endpoint, provider_model, messages, 0.1, "history_summary"),
+            priority,
+        )
+        
+        if not text.strip():
+            raise ValueError("历史摘要代理返回空响应")
+        return text.strip()
 
-    text = raw.strip()
-    if not text:
-        raise ValueError("网页生成代理返回空响应")
 
-    if text.startswith("```"):
-        text = re.sub(r"^```(?:html|json|markdown)?\s*", "", text)
-        text = re.sub(r"\s*```$", "", text).strip()
+async def _complete(endpoint: Endpoint, model: str, messages: List[dict], temperature: float, stage: str) -> str:
+    """Run one non-streaming chat call on ``endpoint`` and record its usage."""
+    if endpoint.kind == "gemini":
+        return await _gemini_generate(endpoint.client, model, _gemini_prompt(messages), stage=stage)
+    response = await endpoint.client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=False,
+    )
+    content = response.choices[0].message.content or ""
+    record_usage(stage, model, from_openai(response.usage) or estimate_usage(messages, content))
+    return content
+
+
+def _stream(
+    endpoint: Endpoint, model: str, messages: List[dict], temperature: float, stage: str
+) -> AsyncGenerator[str, None]:
+    """Open a streaming chat call on ``endpoint``."""
+    if endpoint.kind == "gemini":
+        return _gemini_stream(endpoint.client, model, _gemini_prompt(messages), stage=stage)
+    return _openai_stream(endpoint.client, model, messages, temperature=temperature, stage=stage)
+
+
+async def _openai_stream(
+    client: Any,
+    model: str,
+    messages: List[dict],
+    temperature: float = 0.25,
+    stage: str = "generation",
+) -> AsyncGenerator[str, None]:
+    """Yield text deltas from a streaming OpenAI-compatible chat completion, then record its usage."""
+    endpoint_url = str(getattr(client, "base_url", ""))
+    extra: Dict[str, Any] = {}
+    if config.llm_stream_usage and endpoint_url not in _NO_STREAM_USAGE:
+        # 用量只在最后一个（choices 为空的）分块中返回
+        extra["stream_options"] = {"include_usage": True}
+    try:
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **extra,
+        )
+    except Exception as exc:
+        if not (extra and _rejects_stream_options(exc)):
+            raise
+        # 不支持 stream_options 的服务商返回 400：记住该端点，去掉该参数重试一次，用量改为本地估算
+        logger.warning("端点不支持 stream_options，改为本地估算用量: base_url=%s error=%s", endpoint_url, exc)
+        _NO_STREAM_USAGE.add(endpoint_url)
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+    usage = None
+    parts: List[str] = []
+    async for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        for choice in chunk.choices:
+            delta = choice.delta.content if choice.delta else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    record_usage(stage, model, from_openai(usage) or estimate_usage(messages, "".join(parts)))
+
+
+def _rejects_stream_options(exc: Exception) -> bool:
+    """Whether a provider error is a 400 complaining about ``stream_options``."""
+    if getattr(exc, "status_code", None) != 400:
+        return False
+    message = str(exc).lower()
+    return "stream_options" in message or "include_usage" in message
+
+
+def _build_gemini_prompt(system_prompt: str, user_prompt: str, history: Optional[List[dict]]) -> str:
+    """Flatten system prompt, history and user prompt into a single Gemini prompt."""
+    prompt = f"系统: {system_prompt}\n\n用户: {user_prompt}"
+    if history:
+        history_text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in history)
+        prompt = f"{history_text}\n\n{prompt}"
+    return prompt
+
+
+def _gemini_prompt(messages: List[dict]) -> str:
+    """Gemini prompt for chat messages laid out as system, history..., user."""
+    return _build_gemini_prompt(messages[0]["content"], messages[-1]["content"], messages[1:-1])
+
 
-    match = re.search(r"<html[\s\S]*</html>", text, re.IGNORECASE)
-    if match:
-        return match.group(0).strip()
+# 旧版 SDK 没有异步接口时使用的专用线程池，避免占用事件循环的默认执行器
+_gemini_executor: Optional[ThreadPoolExecutor] = None
 
+
+def _get_gemini_executor() -> ThreadPoolExecutor:
+    global _gemini_executor
+    if _gemini_executor is None:
+        _gemini_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini")
+    return _gemini_executor
+
+
+async def _gemini_generate(gemini_client: Any, model: str, contents: str, stage: str = "generation") -> str:
+    """Run a non-streaming Gemini request, natively async when the SDK supports it."""
+    aio = getattr(gemini_client, "aio", None)
+    if aio is not None:
+        response = await aio.models.generate_content(model=model, contents=contents)
+    else:
+        response = await asyncio.get_running_loop().run_in_executor(
+            _get_gemini_executor(),
+            lambda: gemini_client.models.generate_content(model=model, contents=contents),
+        )
+    text = response.text or ""
+    usage = from_gemini(getattr(response, "usage_metadata", None))
+    record_usage(stage, model, usage or estimate_usage(contents, text))
     return text
 
+
+async def _gemini_stream(
+    gemini_client: Any, model: str, contents: str, stage: str = "generation"
+) -> AsyncGenerator[str, None]:
+    """Yield text deltas from Gemini using the SDK's async streaming API, then record its usage."""
+    aio = getattr(gemini_client, "aio", None)
+    if aio is None:
+        # 旧版 SDK 不支持异步流式，退化为一次性返回
+        text = await _gemini_generate(gemini_client, model, contents, stage=stage)
+        if text:
+            yield text
+        return
+
+    stream = await aio.models.generate_content_stream(model=model, contents=contents)
+    metadata = None
+    parts: List[str] = []
+    async for chunk in stream:
+        # 每个分块都带累计用量，以最后一个为准
+        metadata = getattr(chunk, "usage_metadata", None) or metadata
+        text = getattr(chunk, "text", None)
+        if text:
+            parts.append(text)
+            yield text
+    record_usage(stage, model, from_gemini(metadata) or estimate_usage(contents, "".join(parts)))
+
+
+def _normalize_model_output(raw: Optional[str]) -> str:
+    """Normalize model text output into clean HTML."""
+    if raw is None:
+        raise ValueError("网页生成代理返回空响应")
+
+    extractor = IncrementalHTMLExtractor()
+    extractor.feed(raw)
+    return extractor.result()
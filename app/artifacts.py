@@ -0,0 +1,137 @@
+"""
+Generated page artifacts and compaction of the events sent to clients.
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
+
+from .cache import LRUCache
+from .config import config
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+# compact: 最终事件只带 artifact 引用；verbose: 附带蓝图与检索摘要；full: 原样输出（含原始载荷）
+DETAIL_LEVELS = ("compact", "verbose", "full")
+
+
+def artifact_url(artifact_id: str) -> str:
+    return f"/artifacts/{artifact_id}"
+
+
+class ArtifactStore:
+    """Content-addressed, in-memory store of generated pages served by ``/artifacts/{id}``."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+
+    @staticmethod
+    def describe(html: str) -> Dict[str, Any]:
+        """Artifact metadata: id, UTF-8 byte length, SHA-256 checksum and URL."""
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        return {
+            "id": digest[:32],
+            "length": len(data),
+            "checksum": f"sha256:{digest}",
+            "url": artifact_url(digest[:32]),
+        }
+
+    def put(self, html: str, artifact: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Store html and return its metadata; pass known metadata to skip re-hashing."""
+        artifact = artifact or self.describe(html)
+        if self._cache.get(artifact["id"], count=False) is None:
+            self._cache.set(artifact["id"], html, size=artifact["length"])
+        return artifact
+
+    def get(self, artifact_id: str) -> Optional[str]:
+        return self._cache.get(artifact_id)
+
+
+def _strip_raw(result: Any) -> Any:
+    """Copy a search result without the upstream ``raw`` payloads."""
+    if not isinstance(result, dict):
+        return result
+    stripped = {key: value for key, value in result.items() if key != "raw"}
+    items = stripped.get("results")
+    if isinstance(items, list):
+        stripped["results"] = [
+            {key: value for key, value in item.items() if key != "raw"} if isinstance(item, dict) else item
+            for item in items
+        ]
+    return stripped
+
+
+def _compact_final(event: Dict[str, Any], detail: str, streamed: bool) -> Dict[str, Any]:
+    compact: Dict[str, Any] = {"event": "generation", "final": True}
+    if event.get("cached"):
+        compact["cached"] = True
+
+    artifact = event.get("artifact")
+    if artifact:
+        compact["artifact"] = artifact
+
+    # 客户端已通过增量拿到整页时不再重复发送 html（缓存回放等无增量场景仍需携带）
+    if detail == "verbose" or not streamed or not artifact:
+        compact["html"] = event.get("html")
+
+    if event.get("usage") is not None:
+        compact["usage"] = event["usage"]
+
+    if detail == "verbose":
+        compact["planner_output"] = event.get("planner_output")
+        compact["planner_output_raw"] = event.get("planner_output_raw")
+        compact["search_results"] = [_strip_raw(result) for result in event.get("search_results") or []]
+    return compact
+
+
+def compact_event(event: Dict[str, Any], detail: str, streamed: bool) -> Dict[str, Any]:
+    """Return the client-facing form of ``event``; the input is never mutated."""
+    name = event.get("event")
+    if name == "generation" and event.get("final"):
+        return _compact_final(event, detail, streamed)
+    if name == "search" and "result" in event:
+        return {**event, "result": _strip_raw(event["result"])}
+    if name == "planner" and detail == "compact" and "raw" in event:
+        return {key: value for key, value in event.items() if key != "raw"}
+    return event
+
+
+async def compact_events(
+    events: AsyncIterator[Dict[str, Any]],
+    detail: Optional[str] = None,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Apply the requested detail level to an event stream at the output layer.
+
+    Events coming out of the service are shared with the page cache and
+    coalesced subscribers, so they are copied rather than modified here.
+    """
+    level = (detail or config.event_detail).strip().lower()
+    if level not in DETAIL_LEVELS:
+        logger.warning("未知的事件详细程度: %s，使用 %s", detail, config.event_detail)
+        level = config.event_detail if config.event_detail in DETAIL_LEVELS else "compact"
+
+    streamed = False
+    try:
+        async for event in events:
+            if level == "full":
+                yield event
+                continue
+            if not streamed and event.get("event") == "generation" and event.get("delta"):
+                streamed = True
+            yield compact_event(event, level, streamed)
+    finally:
+        # 客户端断开时立即关闭上游，使合并中的请求能及时感知订阅者离开
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+# Global artifact store
+artifact_store = ArtifactStore(
+    max_entries=config.artifact_store_max_entries,
+    max_bytes=config.artifact_store_max_bytes,
+    ttl=config.artifact_ttl,
+)
@@ -0,0 +1,641 @@
+"""
+Result caches used to short-circuit the science education pipeline.
+"""
+from __future__ import annotations
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .config import config
+from .logging_config import get_logger
+from .prompts import SCIENCE_PLANNER_PROMPT, SCIENCE_PAGE_GENERATION_PROMPT
+
+
+logger = get_logger(__name__)
+
+
+# 提示词变更后自动失效旧缓存
+PROMPT_VERSION = hashlib.sha256(
+    f"{SCIENCE_PLANNER_PROMPT}\0{SCIENCE_PAGE_GENERATION_PROMPT}".encode("utf-8")
+).hexdigest()[:16]
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = " \t\r\n?？!！。.,，;；:：~～"
+
+
+def normalize_topic(topic: Optional[str]) -> str:
+    """Canonicalize a topic so trivially different spellings share a cache key."""
+    text = unicodedata.normalize("NFKC", topic or "")
+    text = _WHITESPACE_RE.sub(" ", text).strip().lower()
+    return text.strip(_TRAILING_PUNCT)
+
+
+def history_digest(history: Optional[List[dict]]) -> str:
+    """Stable digest of the conversation history."""
+    if not history:
+        return ""
+    blob = json.dumps(history, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def search_results_digest(search_results: Optional[List[dict]]) -> str:
+    """Stable digest of the search results a prompt is built from (raw provider payloads ignored)."""
+    if not search_results:
+        return ""
+    material = [
+        {
+            "query": block.get("query"),
+            "results": [
+                {key: value for key, value in item.items() if key != "raw"}
+                for item in block.get("results") or []
+                if isinstance(item, dict)
+            ],
+        }
+        for block in search_results
+        if isinstance(block, dict)
+    ]
+    return make_cache_key(material)
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Hash the canonical JSON encoding of the given key parts."""
+    blob = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-memory LRU cache with per-entry TTL and an optional size budget."""
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int = 0,
+        ttl: float = 0.0,
+        on_evict: Optional[Callable[[str], None]] = None,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        # key -> (value, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not None
+
+    def get(self, key: str, count: bool = True) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+
+        value, expires_at, _ = entry
+        if expires_at and expires_at <= time.time():
+            self.delete(key)
+            if count:
+                self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, size: int = 0, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if self.max_bytes and size > self.max_bytes:
+            # 单条超过总预算时不缓存，避免清空整个缓存
+            return
+
+        self.delete(key)
+        expires_at = time.time() + ttl if ttl and ttl > 0 else 0.0
+        self._entries[key] = (value, expires_at, size)
+        self._size += size
+        self._evict()
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+            if self.on_evict is not None:
+                self.on_evict(key)
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            self.delete(key)
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes and self._size > self.max_bytes)
+        ):
+            self.delete(next(iter(self._entries)))
+
+
+class DiskCache:
+    """JSON-file cache tier that survives restarts.
+
+    Each entry is one file: a metadata line followed by the JSON value.
+    Methods are blocking and are meant to be called via ``asyncio.to_thread``.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = 0, ttl: float = 0.0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._approx_size: Optional[int] = None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Any]:
+        blob = self.load_blob(key)
+        return json.loads(blob) if blob is not None else None
+
+    def load_blob(self, key: str) -> Optional[str]:
+        """Return the raw JSON text of an unexpired entry."""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                meta = json.loads(f.readline())
+                expires_at = meta.get("expires_at") or 0
+                if expires_at and expires_at <= time.time():
+                    f.close()
+                    self._remove(path)
+                    return None
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.warning("磁盘缓存条目损坏，已丢弃: %s (%s)", path, exc)
+            self._remove(path)
+            return None
+
+    def store(self, key: str, blob: str, ttl: Optional[float] = None) -> None:
+        """Persist an already JSON-encoded value."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl and ttl > 0 else 0
+        path = self._path(key)
+        data = (json.dumps({"key": key, "expires_at": expires_at}) + "\n" + blob).encode("utf-8")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logger.warning("写入磁盘缓存失败: %s (%s)", path, exc)
+            return
+
+        if self.max_bytes:
+            if self._approx_size is None:
+                self._approx_size = self._scan_size()
+            else:
+                self._approx_size += len(data)
+            if self._approx_size > self.max_bytes:
+                self.prune()
+
+    def delete(self, key: str) -> None:
+        self._remove(self._path(key))
+
+    def prune(self) -> None:
+        """Drop expired entries, then the oldest ones until under the size budget."""
+        now = time.time()
+        files: List[Tuple[float, int, Path]] = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+                with open(path, encoding="utf-8") as f:
+                    expires_at = json.loads(f.readline()).get("expires_at") or 0
+            except (OSError, ValueError):
+                self._remove(path)
+                continue
+            if expires_at and expires_at <= now:
+                self._remove(path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        # 预留 10% 余量，避免每次写入都触发全量扫描
+        target = int(self.max_bytes * 0.9) if self.max_bytes else total
+        files.sort()
+        for _, size, path in files:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._approx_size = total
+
+    def _scan_size(self) -> int:
+        total = 0
+        for path in self.directory.glob("*/*.json"):
+            try:
+                total += path.stat().st_size
+            except OSError:
+                continue
+        return total
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+class PageCache:
+    """Two-tier cache of replayable SSE events for complete generated pages."""
+
+    def __init__(
+        self,
+        enabled: bool,
+        directory: Optional[Path],
+        ttl: float,
+        max_entries: int,
+        max_bytes: int,
+        disk_max_bytes: int,
+    ):
+        self.enabled = enabled
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self.disk = DiskCache(directory, max_bytes=disk_max_bytes, ttl=ttl) if directory else None
+
+    @staticmethod
+    def key_for(topic: str, model: Optional[str], history: Optional[List[dict]]) -> str:
+        model_key = model or f"{config.science_planner_model}|{config.science_generation_model}"
+        return make_cache_key(
+            "page",
+            PROMPT_VERSION,
+            normalize_topic(topic),
+            model_key,
+            history_digest(history),
+        )
+
+    async def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        if not self.enabled:
+            return None
+
+        events = self.memory.get(key)
+        if events is not None:
+            return events
+
+        if self.disk is None:
+            return None
+
+        loaded = await asyncio.to_thread(self._load_from_disk, key)
+        if loaded is None:
+            return None
+
+        # 磁盘命中后回填内存层
+        events, size = loaded
+        self.memory.set(key, events, size=size)
+        return events
+
+    async def set(self, key: str, events: List[Dict[str, Any]]) -> None:
+        if not self.enabled or not events:
+            return
+
+        blob = json.dumps(events, ensure_ascii=False, separators=(",", ":"))
+        self.memory.set(key, events, size=len(blob))
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.store, key, blob)
+
+    def _load_from_disk(self, key: str) -> Optional[Tuple[Any, int]]:
+        blob = self.disk.load_blob(key)
+        if blob is None:
+            return None
+        try:
+            return json.loads(blob), len(blob)
+        except ValueError:
+            self.disk.delete(key)
+            return None
+
+    async def invalidate(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.delete, key)
+
+
+class SearchCache:
+    """Query-normalized cache for web search results.
+
+    Successful results stay fresh for ``ttl`` and may then be served stale
+    for another ``stale_ttl`` while the caller refreshes them in the
+    background. Errors are cached only for ``error_ttl`` and never persisted.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        ttl: float,
+        error_ttl: float,
+        stale_ttl: float,
+        max_entries: int,
+        directory: Optional[Path] = None,
+        disk_max_bytes: int = 0,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.stale_ttl = stale_ttl
+        self.memory = LRUCache(max_entries=max_entries)
+        self.disk = (
+            DiskCache(directory, max_bytes=disk_max_bytes, ttl=ttl + stale_ttl) if directory else None
+        )
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(query: str, max_results: int) -> str:
+        return make_cache_key("search", normalize_topic(query), max_results)
+
+    async def get(self, key: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Return ``(result, is_fresh)`` or None when nothing usable is cached."""
+        if not self.enabled:
+            return None
+
+        entry = self.memory.get(key, count=False)
+        if entry is None and self.disk is not None:
+            entry = await asyncio.to_thread(self.disk.load, key)
+            if entry is not None:
+                self.memory.set(key, entry, ttl=max(entry["stale_until"] - time.time(), 0.001))
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        fresh = entry["fresh_until"] > time.time()
+        if fresh:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return entry["result"], fresh
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+
+        now = time.time()
+        if result.get("error"):
+            # 错误结果短期缓存，避免上游故障时被反复请求
+            entry = {"result": result, "fresh_until": now + self.error_ttl, "stale_until": now + self.error_ttl}
+            self.memory.set(key, entry, ttl=self.error_ttl)
+            return
+
+        entry = {
+            "result": result,
+            "fresh_until": now + self.ttl,
+            "stale_until": now + self.ttl + self.stale_ttl,
+        }
+        self.memory.set(key, entry, ttl=self.ttl + self.stale_ttl)
+        if self.disk is not None:
+            blob = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+            await asyncio.to_thread(self.disk.store, key, blob, self.ttl + self.stale_ttl)
+
+    def defer_refresh(self, key: str) -> None:
+        """Keep serving a stale entry without retrying for ``error_ttl`` seconds."""
+        entry = self.memory.get(key, count=False)
+        if entry is not None:
+            entry["fresh_until"] = min(time.time() + self.error_ttl, entry["stale_until"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+# 近似匹配前剥离的常见提问套话
+_TOPIC_FILLERS = (
+    "请介绍一下", "介绍一下", "请讲讲", "讲一讲", "讲讲", "什么是", "是什么",
+    "为什么", "的原理", "原理是", "的知识", "关于", "科普", "介绍",
+    "what is", "what are", "how does", "explain",
+)
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def topic_shingles(topic: str, size: int = 2) -> FrozenSet[str]:
+    """Character n-grams of a topic with question boilerplate removed."""
+    text = normalize_topic(topic)
+    stripped = text
+    for filler in _TOPIC_FILLERS:
+        stripped = stripped.replace(filler, "")
+    stripped = _WHITESPACE_RE.sub("", stripped).strip(_TRAILING_PUNCT + "的")
+    text = stripped or _WHITESPACE_RE.sub("", text)
+    if len(text) <= size:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    # 并集大小由交集推出，不必构建并集
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+class MinHashIndex:
+    """MinHash signatures bucketed with banded LSH for near-duplicate lookup.
+
+    Candidates from the LSH buckets are confirmed with exact Jaccard
+    similarity, so false positives never leak out of ``query``.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[str]] = {}
+        # key -> (namespace, shingles, band keys)
+        self._items: Dict[str, Tuple[str, FrozenSet[str], List[Tuple[str, int, Tuple[int, ...]]]]] = {}
+
+    def signature(self, shingles: FrozenSet[str]) -> List[int]:
+        hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+        return [
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._perms
+        ]
+
+    def _band_keys(self, namespace: str, shingles: FrozenSet[str]) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        sig = self.signature(shingles)
+        return [
+            (namespace, band, tuple(sig[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: str, namespace: str, shingles: FrozenSet[str]) -> None:
+        if not shingles:
+            return
+        self.remove(key)
+        band_keys = self._band_keys(namespace, shingles)
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, set()).add(key)
+        self._items[key] = (namespace, shingles, band_keys)
+
+    def remove(self, key: str) -> None:
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        for band_key in item[2]:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def query(self, namespace: str, shingles: FrozenSet[str], threshold: float) -> Optional[Tuple[str, float]]:
+        """Return the most similar indexed key at or above threshold."""
+        if not shingles or not self._items:
+            return None
+        candidates: Set[str] = set()
+        for band_key in self._band_keys(namespace, shingles):
+            candidates.update(self._buckets.get(band_key, ()))
+
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            score = jaccard(shingles, self._items[key][1])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+
+class PlannerCache:
+    """Cache of parsed planner blueprints with near-duplicate topic matching.
+
+    Near-duplicate matching is meant for the initial stage, whose blueprint
+    depends only on the topic; refined blueprints are built from one
+    topic's search results, are keyed on their digest and match exactly.
+    """
+
+    def __init__(self, enabled: bool, ttl: float, max_entries: int, similarity: float):
+        self.enabled = enabled
+        self.similarity = similarity
+        self.index = MinHashIndex()
+        self.entries = LRUCache(max_entries=max_entries, ttl=ttl, on_evict=self.index.remove)
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def namespace_for(
+        stage: str,
+        model: Optional[str],
+        history: Optional[List[dict]],
+        search_results: Optional[List[dict]] = None,
+    ) -> str:
+        return make_cache_key(
+            "planner",
+            PROMPT_VERSION,
+            stage,
+            model or config.science_planner_model,
+            history_digest(history),
+            search_results_digest(search_results),
+        )
+
+    def get(self, namespace: str, topic: str, similar: bool = True) -> Optional[Dict[str, Any]]:
+        """Return a copy of ``{"raw", "parsed", "match", "similarity"}`` or None.
+
+        ``similar=False`` disables near-duplicate topic matching.
+        """
+        if not self.enabled:
+            return None
+
+        exact_key = make_cache_key(namespace, normalize_topic(topic))
+        entry = self.entries.get(exact_key, count=False)
+        match = "exact"
+        score = 1.0
+        if entry is None and similar:
+            found = self.index.query(namespace, topic_shingles(topic), self.similarity)
+            if found is not None:
+                entry = self.entries.get(found[0], count=False)
+                match, score = "similar", found[1]
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if match == "exact":
+            self.exact_hits += 1
+        else:
+            self.similar_hits += 1
+        return {
+            "raw": entry["raw"],
+            "parsed": copy.deepcopy(entry["parsed"]),
+            "topic": entry["topic"],
+            "match": match,
+            "similarity": score,
+        }
+
+    def set(self, namespace: str, topic: str, raw: str, parsed: Dict[str, Any], similar: bool = True) -> None:
+        if not self.enabled:
+            return
+        key = make_cache_key(namespace, normalize_topic(topic))
+        self.entries.set(key, {"raw": raw, "parsed": copy.deepcopy(parsed), "topic": topic})
+        if similar:
+            self.index.add(key, namespace, topic_shingles(topic))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+        }
+
+
+# Global page cache
+page_cache = PageCache(
+    enabled=config.page_cache_enabled,
+    directory=config.page_cache_dir,
+    ttl=config.page_cache_ttl,
+    max_entries=config.page_cache_max_entries,
+    max_bytes=config.page_cache_max_bytes,
+    disk_max_bytes=config.page_cache_disk_max_bytes,
+)
+
+# Global planner blueprint cache
+planner_cache = PlannerCache(
+    enabled=config.planner_cache_enabled,
+    ttl=config.planner_cache_ttl,
+    max_entries=config.planner_cache_max_entries,
+    similarity=config.planner_cache_similarity,
+)
+
+# Global search result cache
+search_cache = SearchCache(
+    enabled=config.search_cache_enabled,
+    ttl=config.search_cache_ttl,
+    error_ttl=config.search_cache_error_ttl,
+    stale_ttl=config.search_cache_stale_ttl,
+    max_entries=config.search_cache_max_entries,
+    directory=config.search_cache_dir if config.search_cache_persist else None,
+    disk_max_bytes=config.search_cache_disk_max_bytes,
+)
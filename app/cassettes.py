@@ -0,0 +1,257 @@
+"""
+Record and replay of upstream HTTP traffic (LLM providers, Tailiy search) as cassette files.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+MODES = ("off", "record", "replay")
+
+# 只保存影响解析的响应头；不保存 set-cookie、组织 ID 等账号信息
+_RECORDED_HEADERS = ("content-type", "content-encoding", "retry-after")
+# 请求体中可能携带凭据的字段，写入磁带前替换
+_REDACTED_FIELDS = ("api_key", "apiKey", "key", "token")
+# 关闭未读完的响应时，等待剩余内容（通常只有 EOF）的最长秒数
+_DRAIN_TIMEOUT = 1.0
+
+
+class CassetteMissError(httpx.TransportError):
+    """Replay mode found no recorded interaction for a request."""
+
+
+def _canonical_body(content: bytes) -> Any:
+    """Parse a JSON body (key order ignored); fall back to the raw text."""
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode("utf-8", errors="replace")
+
+
+def _redact(body: Any) -> Any:
+    if isinstance(body, dict):
+        return {key: ("[REDACTED]" if key in _REDACTED_FIELDS else value) for key, value in body.items()}
+    return body
+
+
+def request_key(request: httpx.Request) -> str:
+    """Stable key of a request: method, URL and canonical body; headers (credentials) are ignored."""
+    body = _canonical_body(request.content)
+    material = json.dumps(
+        [request.method, str(request.url), _redact(body)],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:24]
+
+
+def _encode_chunk(offset: float, data: bytes) -> Dict[str, Any]:
+    chunk: Dict[str, Any] = {"ms": round(offset * 1000.0, 2)}
+    try:
+        chunk["text"] = data.decode("utf-8")
+    except UnicodeDecodeError:
+        # 分块可能切断多字节字符或为压缩数据，按原样保存
+        chunk["b64"] = base64.b64encode(data).decode("ascii")
+    return chunk
+
+
+def _decode_chunk(chunk: Dict[str, Any]) -> bytes:
+    if "text" in chunk:
+        return chunk["text"].encode("utf-8")
+    return base64.b64decode(chunk.get("b64") or "")
+
+
+class CassetteStore:
+    """One JSON file per request key holding every recorded interaction, in order.
+
+    Methods are blocking and are meant to be called via ``asyncio.to_thread``.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.json"
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.warning("磁带文件损坏，已忽略: %s (%s)", self._path(name), exc)
+            return None
+
+    def append(self, name: str, request: Dict[str, Any], interaction: Dict[str, Any]) -> int:
+        """Add an interaction to the cassette; return how many it now holds."""
+        cassette = self.load(name) or {"request": request, "interactions": []}
+        cassette["interactions"].append(interaction)
+        path = self._path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cassette, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+        return len(cassette["interactions"])
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes the upstream body through while noting each chunk and its arrival time."""
+
+    def __init__(self, inner: httpx.AsyncByteStream, started: float, on_complete: Any):
+        self._inner = inner
+        self._started = started
+        self._on_complete = on_complete
+        self._chunks: List[Dict[str, Any]] = []
+        self._complete = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for data in self._inner:
+            self._chunks.append(_encode_chunk(time.perf_counter() - self._started, data))
+            yield data
+        self._complete = True
+
+    async def _drain(self) -> None:
+        async for data in self:
+            pass
+
+    async def aclose(self) -> None:
+        if not self._complete:
+            # SDK 读到 [DONE] 即关闭响应，此时上游通常只剩 EOF；短时间内读完才算完整，
+            # 客户端中途断开的响应不会等待上游生成结束，也不写入磁带
+            try:
+                await asyncio.wait_for(self._drain(), _DRAIN_TIMEOUT)
+            except (asyncio.TimeoutError, httpx.HTTPError):
+                pass
+        await self._inner.aclose()
+        if self._complete:
+            await self._on_complete(self._chunks)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """Yields recorded chunks with their original spacing divided by ``speed`` (0 = no delay)."""
+
+    def __init__(self, chunks: List[Dict[str, Any]], started: float, speed: float):
+        self._chunks = chunks
+        self._started = started
+        self._speed = speed
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for chunk in self._chunks:
+            if self._speed > 0:
+                # 按绝对时间排程，长流不会累积 sleep 误差
+                delay = self._started + chunk["ms"] / 1000.0 / self._speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield _decode_chunk(chunk)
+
+    async def aclose(self) -> None:
+        return None
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """Wraps an httpx transport to record upstream traffic to cassettes or replay it from them.
+
+    In ``record`` mode requests go to the network and each completed
+    response is appended to the cassette for its request key, with the
+    time to headers and every body chunk exactly as received (boundaries
+    and arrival offsets). In ``replay`` mode nothing leaves the process:
+    interactions are served in recorded order per key (cycling when
+    exhausted) with the original timing scaled by ``speed``; a request
+    with no cassette fails with :class:`CassetteMissError`.
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, upstream: str, mode: str, directory: Path, speed: float = 1.0):
+        self.inner = inner
+        self.upstream = upstream
+        self.mode = mode
+        self.speed = max(0.0, speed)
+        self.store = CassetteStore(directory)
+        self._loaded: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._write_lock = asyncio.Lock()
+
+    def _name(self, request: httpx.Request) -> str:
+        return f"{self.upstream}-{request_key(request)}"
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self.mode == "replay":
+            return await self._replay(request)
+        if self.mode == "record":
+            return await self._record(request)
+        return await self.inner.handle_async_request(request)
+
+    async def _record(self, request: httpx.Request) -> httpx.Response:
+        name = self._name(request)
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        head_ms = round((time.perf_counter() - started) * 1000.0, 2)
+        headers = {key: value for key, value in response.headers.items() if key.lower() in _RECORDED_HEADERS}
+        meta = {
+            "method": request.method,
+            "url": str(request.url),
+            "body": _redact(_canonical_body(request.content)),
+        }
+
+        async def on_complete(chunks: List[Dict[str, Any]]) -> None:
+            interaction = {"status": response.status_code, "headers": headers, "head_ms": head_ms, "chunks": chunks}
+            try:
+                async with self._write_lock:
+                    count = await asyncio.to_thread(self.store.append, name, meta, interaction)
+            except OSError as exc:
+                logger.warning("写入磁带失败: %s (%s)", name, exc)
+                return
+            self._loaded.pop(name, None)
+            logger.info("已录制上游交互: cassette=%s status=%s chunks=%s total=%s", name, response.status_code, len(chunks), count)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, started, on_complete),
+            extensions=response.extensions,
+        )
+
+    async def _replay(self, request: httpx.Request) -> httpx.Response:
+        name = self._name(request)
+        if name not in self._loaded:
+            self._loaded[name] = await asyncio.to_thread(self.store.load, name)
+        cassette = self._loaded[name]
+        interactions = (cassette or {}).get("interactions") or []
+        if not interactions:
+            logger.warning("回放模式下没有匹配的磁带: %s %s cassette=%s", request.method, request.url, name)
+            raise CassetteMissError(f"no cassette for {request.method} {request.url} ({name})", request=request)
+
+        cursor = self._cursors.get(name, 0)
+        self._cursors[name] = cursor + 1
+        interaction = interactions[cursor % len(interactions)]
+
+        started = time.perf_counter()
+        if self.speed > 0 and interaction.get("head_ms"):
+            await asyncio.sleep(interaction["head_ms"] / 1000.0 / self.speed)
+        return httpx.Response(
+            status_code=interaction["status"],
+            headers=interaction.get("headers") or {},
+            stream=_ReplayStream(interaction.get("chunks") or [], started, self.speed),
+            request=request,
+        )
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
@@ -3,6 +3,7 @@ Client initialization for OpenAI and Gemini APIs.
 """
 import os
 from typing import Optional
+from urllib.parse import urlparse
 from openai import AsyncOpenAI
 
 try:
@@ -14,6 +15,7 @@ except ModuleNotFoundError:
         genai = None
 
 from .config import config
+from .transport import http_transport
 
 
 class ClientManager:
@@ -23,6 +25,7 @@ class ClientManager:
         self.openai_client: Optional[AsyncOpenAI] = None
         self.gemini_client: Optional[genai.Client] = None
         self.use_gemini: bool = False
+        self._http_client = None
         
         self._initialize_clients()
     
@@ -40,33 +43,66 @@ class ClientManager:
             
             try:
                 os.environ["GEMINI_API_KEY"] = config.api_key
-                self.gemini_client = genai.Client()
+                self.gemini_client = self.create_gemini_client(config.api_key)
                 self.use_gemini = True
                 print("✓ Gemini 客户端初始化成功")
+                if config.cassette_mode in ("record", "replay"):
+                    print("⚠ 提示: Gemini SDK 不经过共享 HTTP 连接池，磁带录制 / 回放只覆盖 Tailiy 检索")
             except Exception as e:
                 print(f"⚠ 警告: Gemini 客户端初始化失败: {e}")
                 return
         else:
             # Initialize OpenAI client
-            extra_headers = {}
-            if config.base_url and "openrouter.ai" in config.base_url.lower():
-                extra_headers = {
-                    "HTTP-Referer": "https://github.com/fogsightai/fogsight",
-                    "X-Title": "Fogsight - AI Animation Generator"
-                }
-            
             try:
-                self.openai_client = AsyncOpenAI(
-                    api_key=config.api_key,
-                    base_url=config.base_url if config.base_url else None,
-                    default_headers=extra_headers
-                )
+                self._http_client = http_transport.get_client("llm")
+                self.openai_client = self.create_openai_client(config.api_key, config.base_url)
                 self.use_gemini = False
                 print("✓ OpenAI 客户端初始化成功")
             except Exception as e:
                 print(f"⚠ 警告: OpenAI 客户端初始化失败: {e}")
                 return
     
+    @staticmethod
+    def create_openai_client(api_key: str, base_url: str, max_retries: Optional[int] = None) -> AsyncOpenAI:
+        """Build an OpenAI-compatible client on the shared LLM connection pool."""
+        extra_headers = {}
+        if base_url and "openrouter.ai" in base_url.lower():
+            extra_headers = {
+                "HTTP-Referer": "https://github.com/fogsightai/fogsight",
+                "X-Title": "Fogsight - AI Animation Generator"
+            }
+        kwargs = {} if max_retries is None else {"max_retries": max_retries}
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url if base_url else None,
+            default_headers=extra_headers,
+            http_client=http_transport.get_client("llm"),
+            **kwargs,
+        )
+    
+    @staticmethod
+    def create_gemini_client(api_key: str):
+        """Build a Gemini client for the given key."""
+        if genai is None:
+            raise RuntimeError("Google Generative AI SDK 未安装，请运行: pip install google-generativeai")
+        return genai.Client(api_key=api_key)
+    
+    def bind_transport(self):
+        """Rebuild the OpenAI client if the shared connection pool was recreated."""
+        if self.use_gemini or self.openai_client is None:
+            return
+        if self._http_client is not http_transport.get_client("llm"):
+            self._initialize_clients()
+    
+    @property
+    def provider_name(self) -> str:
+        """Identifier of the active upstream provider, used for admission control."""
+        if self.use_gemini:
+            return "gemini"
+        if config.base_url:
+            return urlparse(config.base_url).hostname or "openai"
+        return "openai"
+    
     def get_client(self):
         """Get the active client."""
         if self.use_gemini:
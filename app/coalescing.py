@@ -0,0 +1,134 @@
+"""
+Single-flight coalescing of identical in-flight event streams.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class Flight:
+    """One in-flight event stream shared by any number of subscribers.
+
+    Events are kept for the lifetime of the flight so late subscribers can
+    replay what they missed before following the live stream.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional["asyncio.Task[None]"] = None
+        self._signal: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+
+    def publish(self, event: Any) -> None:
+        self.events.append(event)
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.finished = True
+        self.error = error
+        self._wake()
+
+    def _wake(self) -> None:
+        if not self._signal.done():
+            self._signal.set_result(None)
+            self._signal = asyncio.get_running_loop().create_future()
+
+    async def subscribe(self, on_abandoned: Callable[["Flight"], None]) -> AsyncGenerator[Any, None]:
+        """Replay buffered events, then follow the live stream until it finishes."""
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    event = self.events[index]
+                    index += 1
+                    yield event
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                # shield：单个订阅者断开时不能取消共享的信号
+                await asyncio.shield(self._signal)
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                on_abandoned(self)
+
+
+class SingleFlight:
+    """Coalesces concurrent requests with the same key onto one producer.
+
+    The first caller for a key starts the producer in its own task; later
+    callers attach as subscribers. Any subscriber may disconnect without
+    affecting the others. The producer is cancelled only once every
+    subscriber has gone.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def join(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[Any]],
+    ) -> Tuple[Flight, bool]:
+        """Return ``(flight, is_leader)`` for key, starting the producer if needed."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            return flight, False
+
+        flight = Flight(key)
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._drive(flight, factory()))
+        return flight, True
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[Any]],
+    ) -> AsyncGenerator[Any, None]:
+        """Subscribe to the flight for key, starting it if this caller is first."""
+        flight, is_leader = self.join(key, factory)
+        if not is_leader:
+            logger.info("合并进行中的相同请求: key=%s 已回放事件数=%s", key[:12], len(flight.events))
+        async for event in flight.subscribe(self._abandon):
+            yield event
+
+    async def _drive(self, flight: Flight, source: AsyncIterator[Any]) -> None:
+        try:
+            async for event in source:
+                flight.publish(event)
+        except asyncio.CancelledError:
+            flight.finish(asyncio.CancelledError())
+            raise
+        except Exception as exc:
+            flight.finish(exc)
+        else:
+            flight.finish()
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def _abandon(self, flight: Flight) -> None:
+        """Cancel a producer nobody is listening to any more."""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if flight.task is not None and not flight.task.done():
+            logger.info("所有订阅者均已断开，取消请求: key=%s", flight.key[:12])
+            flight.task.cancel()
+
+
+# Global single-flight registry for /generate
+generation_flights = SingleFlight()
@@ -8,6 +8,59 @@ from pathlib import Path
 from dotenv import load_dotenv
 
 
+def _env_int(name: str, default: int) -> int:
+    """Read an integer environment variable, falling back to default."""
+    value = os.environ.get(name, "").strip()
+    try:
+        return int(value) if value else default
+    except ValueError:
+        print(f"⚠ 环境变量 {name} 不是有效整数: {value}，使用默认值 {default}")
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float environment variable, falling back to default."""
+    value = os.environ.get(name, "").strip()
+    try:
+        return float(value) if value else default
+    except ValueError:
+        print(f"⚠ 环境变量 {name} 不是有效数字: {value}，使用默认值 {default}")
+        return default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean environment variable (1/true/yes/on)."""
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    return value in ("1", "true", "yes", "on")
+
+
+def _env_json(name: str, default: dict) -> dict:
+    """Read a JSON object environment variable, falling back to default."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        parsed = None
+    if not isinstance(parsed, dict):
+        print(f"⚠ 环境变量 {name} 不是有效的 JSON 对象，使用默认值")
+        return default
+    return parsed
+
+
+def _upstream_http_settings(prefix: str, max_connections: int, max_keepalive: int) -> dict:
+    """Connection pool settings for one upstream, read from ``<PREFIX>_HTTP_*``."""
+    return {
+        "max_connections": _env_int(f"{prefix}_HTTP_MAX_CONNECTIONS", max_connections),
+        "max_keepalive_connections": _env_int(f"{prefix}_HTTP_MAX_KEEPALIVE", max_keepalive),
+        "keepalive_expiry": _env_float(f"{prefix}_HTTP_KEEPALIVE_EXPIRY", 30.0),
+        "http2": _env_bool(f"{prefix}_HTTP2", False),
+    }
+
+
 class Config:
     """Application configuration."""
     
@@ -104,6 +157,130 @@ class Config:
             print("ℹ 提示: Taily 网络搜索 API 地址未配置，默认禁用网络搜索。")
         if not self.tailiy_api_key:
             print("ℹ 提示: Taily 网络搜索 API Key 未配置，默认禁用网络搜索。")
+        
+        # 整页结果缓存：内存 LRU + 磁盘持久层
+        self.page_cache_enabled: bool = _env_bool("PAGE_CACHE_ENABLED", True)
+        self.page_cache_dir: Path = Path(
+            os.environ.get("PAGE_CACHE_DIR", "") or project_root / ".cache" / "pages"
+        )
+        self.page_cache_ttl: float = _env_float("PAGE_CACHE_TTL", 24 * 3600)
+        self.page_cache_max_entries: int = _env_int("PAGE_CACHE_MAX_ENTRIES", 256)
+        self.page_cache_max_bytes: int = _env_int("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.page_cache_disk_max_bytes: int = _env_int("PAGE_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024)
+        
+        # 策划蓝图缓存：精确命中 + 近似主题匹配
+        self.planner_cache_enabled: bool = _env_bool("PLANNER_CACHE_ENABLED", True)
+        self.planner_cache_ttl: float = _env_float("PLANNER_CACHE_TTL", 6 * 3600)
+        self.planner_cache_max_entries: int = _env_int("PLANNER_CACHE_MAX_ENTRIES", 512)
+        self.planner_cache_similarity: float = _env_float("PLANNER_CACHE_SIMILARITY", 0.6)
+        
+        # Tailiy 检索结果缓存：TTL、错误短期缓存、过期后台刷新
+        self.search_cache_enabled: bool = _env_bool("SEARCH_CACHE_ENABLED", True)
+        self.search_cache_ttl: float = _env_float("SEARCH_CACHE_TTL", 3600)
+        self.search_cache_error_ttl: float = _env_float("SEARCH_CACHE_ERROR_TTL", 30)
+        self.search_cache_stale_ttl: float = _env_float("SEARCH_CACHE_STALE_TTL", 6 * 3600)
+        self.search_cache_max_entries: int = _env_int("SEARCH_CACHE_MAX_ENTRIES", 1024)
+        self.search_cache_persist: bool = _env_bool("SEARCH_CACHE_PERSIST", False)
+        self.search_cache_dir: Path = Path(
+            os.environ.get("SEARCH_CACHE_DIR", "") or project_root / ".cache" / "search"
+        )
+        self.search_cache_disk_max_bytes: int = _env_int("SEARCH_CACHE_DISK_MAX_BYTES", 128 * 1024 * 1024)
+        
+        # 并发检索：并发上限、单条查询超时与检索阶段总预算（秒）
+        self.search_concurrency: int = _env_int("SEARCH_CONCURRENCY", 3)
+        self.search_query_timeout: float = _env_float("SEARCH_QUERY_TIMEOUT", 10.0)
+        self.search_stage_budget: float = _env_float("SEARCH_STAGE_BUDGET", 12.0)
+        
+        # 检索结果整理：跨查询 URL 去重、近似摘要去重、BM25 排序后取前 N 条
+        self.search_rank_enabled: bool = _env_bool("SEARCH_RANK_ENABLED", True)
+        self.search_rank_top_n: int = _env_int("SEARCH_RANK_TOP_N", 8)
+        self.search_rank_max_chars: int = _env_int("SEARCH_RANK_MAX_CHARS", 6000)
+        self.search_dedupe_similarity: float = _env_float("SEARCH_DEDUPE_SIMILARITY", 0.7)
+
+        # 合并进行中的相同 /generate 请求（single-flight）
+        self.coalesce_enabled: bool = _env_bool("COALESCE_ENABLED", True)
+        
+        # 上游调用准入控制：按服务商 / 模型限制并发，遇到 429 或延迟突增时自适应收缩
+        self.admission_enabled: bool = _env_bool("ADMISSION_ENABLED", True)
+        self.llm_max_in_flight_per_provider: int = _env_int("LLM_MAX_IN_FLIGHT_PER_PROVIDER", 16)
+        self.llm_max_in_flight_per_model: int = _env_int("LLM_MAX_IN_FLIGHT_PER_MODEL", 8)
+        self.admission_adaptive: bool = _env_bool("ADMISSION_ADAPTIVE", True)
+        self.admission_min_limit: int = _env_int("ADMISSION_MIN_LIMIT", 1)
+        self.admission_max_lanes: int = _env_int("ADMISSION_MAX_LANES", 256)
+
+        # 多端点 LLM 路由：LLM_ENDPOINTS 为 JSON，名称 -> {base_url, api_key, kind, weight, models}；
+        # 为空时只使用 API_KEY / BASE_URL。连续失败达到阈值的端点被剔除，剔除时长按次数指数增长
+        self.llm_endpoints: dict = _env_json("LLM_ENDPOINTS", {})
+        self.llm_router_max_attempts: int = _env_int("LLM_ROUTER_MAX_ATTEMPTS", 3)
+        self.llm_router_eject_after: int = _env_int("LLM_ROUTER_EJECT_AFTER", 3)
+        self.llm_router_eject_seconds: float = _env_float("LLM_ROUTER_EJECT_SECONDS", 15.0)
+        self.llm_router_max_eject_seconds: float = _env_float("LLM_ROUTER_MAX_EJECT_SECONDS", 300.0)
+        self.llm_router_probe_interval: float = _env_float("LLM_ROUTER_PROBE_INTERVAL", 5.0)
+        self.llm_router_ewma_alpha: float = _env_float("LLM_ROUTER_EWMA_ALPHA", 0.3)
+
+        # SSE 合帧：按时间窗口 / 字符阈值合并生成增量；请求可选择 latency 或 throughput 策略
+        self.sse_flush_policy: str = os.environ.get("SSE_FLUSH_POLICY", "").strip().lower() or "latency"
+        self.sse_flush_policies: dict = {
+            "latency": {
+                "window": _env_float("SSE_LATENCY_WINDOW_MS", 15.0) / 1000.0,
+                "max_chars": _env_int("SSE_LATENCY_MAX_CHARS", 1024),
+            },
+            "throughput": {
+                "window": _env_float("SSE_THROUGHPUT_WINDOW_MS", 120.0) / 1000.0,
+                "max_chars": _env_int("SSE_THROUGHPUT_MAX_CHARS", 16384),
+            },
+        }
+
+        # 生成结果（artifact）存储与最终事件的详细程度：compact / verbose / full
+        self.artifact_store_max_entries: int = _env_int("ARTIFACT_STORE_MAX_ENTRIES", 256)
+        self.artifact_store_max_bytes: int = _env_int("ARTIFACT_STORE_MAX_BYTES", 64 * 1024 * 1024)
+        self.artifact_ttl: float = _env_float("ARTIFACT_TTL", 6 * 3600)
+        self.event_detail: str = os.environ.get("EVENT_DETAIL", "").strip().lower() or "compact"
+
+        # 服务端会话：历史保存在服务端，过往生成的网页以 artifact 引用代替
+        self.session_max_entries: int = _env_int("SESSION_MAX_ENTRIES", 1024)
+        self.session_ttl: float = _env_float("SESSION_TTL", 6 * 3600)
+        self.session_max_turns: int = _env_int("SESSION_MAX_TURNS", 20)
+
+        # 历史摘要：保留最近若干轮原文，更早的轮次由轻量模型滚动摘要并按前缀缓存
+        self.history_summary_enabled: bool = _env_bool("HISTORY_SUMMARY_ENABLED", True)
+        self.history_keep_turns: int = _env_int("HISTORY_KEEP_TURNS", 2)
+        self.history_summary_model: str = os.environ.get("HISTORY_SUMMARY_MODEL", "") or self.science_planner_model
+        self.history_summary_cache_entries: int = _env_int("HISTORY_SUMMARY_CACHE_ENTRIES", 1024)
+
+        # 提示词上下文 token 预算（按阶段，估算值，0 表示不限制）
+        self.context_token_budgets: dict = {
+            "planner": _env_int("PLANNER_CONTEXT_TOKENS", 6000),
+            "generation": _env_int("GENERATION_CONTEXT_TOKENS", 10000),
+        }
+
+        # Token 用量与成本估算：价格表为 JSON，单位为每百万 token 的价格，"*" 为未列出模型的默认价格
+        # 例：{"gpt-4o-mini": {"prompt": 0.15, "completion": 0.6, "cached_prompt": 0.075}}
+        # 流式请求携带 stream_options 以取得用量；不支持的端点返回 400 后自动去掉该参数重试
+        self.llm_stream_usage: bool = _env_bool("LLM_STREAM_USAGE", True)
+        self.llm_prices: dict = _env_json("LLM_PRICES", {})
+        self.llm_price_currency: str = os.environ.get("LLM_PRICE_CURRENCY", "").strip() or "USD"
+
+        # 请求级耗时追踪：在 done 之前发送 timing 事件（日志始终记录）
+        self.trace_timing_event: bool = _env_bool("TRACE_TIMING_EVENT", True)
+
+        # 进程内指标：/metrics 以 Prometheus 文本格式暴露；事件循环延迟采样间隔（秒，0 为关闭）
+        self.metrics_enabled: bool = _env_bool("METRICS_ENABLED", True)
+        self.metrics_loop_lag_interval: float = _env_float("METRICS_LOOP_LAG_INTERVAL", 0.5)
+
+        # 上游流量录制 / 回放：record 将 LLM 与 Tailiy 的请求响应（含分块边界与时间）写入磁带，
+        # replay 从磁带回放而不访问上游；CASSETTE_SPEED 为回放加速倍数（1 为原始节奏，0 为不等待）
+        self.cassette_mode: str = os.environ.get("CASSETTE_MODE", "").strip().lower() or "off"
+        self.cassette_dir: Path = Path(
+            os.environ.get("CASSETTE_DIR", "") or project_root / ".cache" / "cassettes"
+        )
+        self.cassette_speed: float = _env_float("CASSETTE_SPEED", 1.0)
+
+        # 共享 HTTP 连接池（按上游分别配置）
+        self.http_upstreams: dict = {
+            "llm": _upstream_http_settings("LLM", max_connections=100, max_keepalive=20),
+            "search": _upstream_http_settings("SEARCH", max_connections=20, max_keepalive=10),
+        }
     
     def is_valid(self) -> bool:
         """Check if api_key and model are configured and valid.
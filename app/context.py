@@ -0,0 +1,185 @@
+"""
+Token-budgeted prompt context for the planner and generator agents.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+from typing import Any, Dict, List, Optional
+
+from .config import config
+from .logging_config import get_logger
+from .tracing import span
+
+
+logger = get_logger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 提示词中实际用到的检索字段；其余字段（raw 等）一律不进入上下文
+_ITEM_FIELDS = ("title", "summary", "highlights", "source_url")
+_SUMMARY_CHARS = 600
+_HIGHLIGHT_CHARS = 240
+_MAX_HIGHLIGHTS = 3
+
+_encoding: Any = None
+_encoding_failed = False
+
+
+def _get_encoding() -> Any:
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as exc:
+            # 编码表可能需要联网下载，失败时退回启发式估算
+            _encoding_failed = True
+            logger.warning("tiktoken 编码表加载失败，使用启发式 token 估算: %s", exc)
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text, exactly if tiktoken is available."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 启发式：非 ASCII（中文等）约 1 字符 1 token，ASCII 约 4 字符 1 token
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+def _clip(text: Any, limit: int) -> Any:
+    if isinstance(text, str) and len(text) > limit:
+        return text[:limit] + "…"
+    return text
+
+
+def _project_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    projected: Dict[str, Any] = {}
+    for field in _ITEM_FIELDS:
+        value = item.get(field)
+        if value in (None, "", []):
+            continue
+        if field == "summary":
+            value = _clip(value, _SUMMARY_CHARS)
+        elif field == "highlights":
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list):
+                continue
+            value = [_clip(h, _HIGHLIGHT_CHARS) for h in value[:_MAX_HIGHLIGHTS] if h]
+            if not value:
+                continue
+        projected[field] = value
+    return projected
+
+
+def project_search_results(search_results: Optional[List[dict]]) -> List[dict]:
+    """Keep only the search fields the prompts use.
+
+    Accepts both per-query blocks (``{"query", "results": [...], "error"}``)
+    and flat items (``{"title", "summary", ...}``).
+    """
+    projected: List[dict] = []
+    for entry in search_results or []:
+        if not isinstance(entry, dict):
+            continue
+        if "results" in entry or "error" in entry:
+            block: Dict[str, Any] = {"query": entry.get("query")}
+            if entry.get("error"):
+                block["error"] = entry["error"]
+            block["results"] = [
+                _project_item(item) for item in entry.get("results") or [] if isinstance(item, dict)
+            ]
+            projected.append(block)
+        else:
+            item = _project_item(entry)
+            if entry.get("query"):
+                item = {"query": entry["query"], **item}
+            projected.append(item)
+    return projected
+
+
+def _dumps(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def _trim_to_budget(base_tokens: int, results: List[dict], budget: int) -> int:
+    """Drop search items (largest block first, from its tail) until within budget; return items dropped."""
+    item_tokens: Dict[int, List[int]] = {}
+    total = base_tokens
+    for index, entry in enumerate(results):
+        if "results" in entry:
+            costs = [estimate_tokens(_dumps(item)) for item in entry["results"]]
+            item_tokens[index] = costs
+            total += estimate_tokens(_dumps({**entry, "results": []})) + sum(costs)
+        else:
+            total += estimate_tokens(_dumps(entry))
+
+    dropped = 0
+    while total > budget:
+        candidates = [index for index, costs in item_tokens.items() if costs]
+        if candidates:
+            index = max(candidates, key=lambda i: (len(item_tokens[i]), -i))
+            results[index]["results"].pop()
+            total -= item_tokens[index].pop()
+        elif results and "results" not in results[-1]:
+            total -= estimate_tokens(_dumps(results.pop()))
+        else:
+            break
+        dropped += 1
+    return dropped
+
+
+def build_user_prompt(stage: str, payload: Dict[str, Any], search_results: Optional[List[dict]]) -> str:
+    """Serialize a prompt payload compactly, fitting search results into the stage's token budget.
+
+    ``payload`` holds everything except search results, which are projected,
+    trimmed and appended under ``search_results``. Only search items are
+    trimmed; the blueprint is never cut.
+    """
+    with span("context", stage=stage) as context_span:
+        results = project_search_results(search_results)
+        budget = config.context_token_budgets.get(stage, 0)
+        dropped = 0
+        if budget > 0:
+            base_tokens = estimate_tokens(_dumps({**payload, "search_results": []}))
+            dropped = _trim_to_budget(base_tokens, results, budget)
+
+        user_prompt = _dumps({**payload, "search_results": results})
+
+        tokens = estimate_tokens(user_prompt)
+        context_span.annotate(tokens=tokens, dropped=dropped)
+
+    if budget and tokens > budget:
+        logger.warning("提示词上下文仍超出预算: stage=%s tokens≈%s budget=%s", stage, tokens, budget)
+    if logger.isEnabledFor(logging.DEBUG):
+        # 与旧格式（缩进 JSON + 完整检索载荷）对比需要重新序列化整个载荷，只在 DEBUG 下计算
+        legacy_tokens = estimate_tokens(
+            json.dumps({**payload, "search_results": search_results or []}, ensure_ascii=False, indent=2)
+        )
+        saved = 100.0 * (legacy_tokens - tokens) / legacy_tokens if legacy_tokens else 0.0
+        logger.debug(
+            "提示词上下文: stage=%s tokens≈%s (原格式≈%s，节省 %.0f%%) budget=%s 裁剪检索条目=%s",
+            stage,
+            tokens,
+            legacy_tokens,
+            saved,
+            budget or "∞",
+            dropped,
+        )
+    else:
+        logger.info(
+            "提示词上下文: stage=%s tokens≈%s budget=%s 裁剪检索条目=%s",
+            stage,
+            tokens,
+            budget or "∞",
+            dropped,
+        )
+    return user_prompt
@@ -1,11 +1,11 @@
 """
 LangGraph workflow definitions for orchestrating the science education pipeline.
 """
-import json
 from typing import Any, Dict, List
 
 from langgraph.graph import StateGraph, END
 
+from .json_repair import JSONRepairError, parse_json_object
 from .logging_config import get_logger
 from .schemas import AgentState
 from .agents import SciencePlannerAgent, SciencePageGenerator
@@ -40,9 +40,9 @@ def create_science_education_graph():
 
         parsed: Dict[str, Any] = {}
         try:
-            parsed = json.loads(planner_raw)
-        except json.JSONDecodeError:
-            logger.error("Planner output not JSON: %s", planner_raw)
+            parsed = parse_json_object(planner_raw).value
+        except JSONRepairError as exc:
+            logger.error("Planner output not JSON (%s): %s", exc, (planner_raw or "")[:500])
             return {
                 "error": "策划代理返回内容无法解析为 JSON",
                 "planner_output_raw": planner_raw,
@@ -88,10 +88,10 @@ def create_science_education_graph():
                 "step": "search_skipped",
             }
 
-        search_results = []
-        for query in state.search_queries[:3]:
-            result = await TailiySearchTool.search(query)
-            search_results.append(result)
+        search_results = [
+            result
+            async for result in TailiySearchTool.search_many(state.search_queries[:3])
+        ]
 
         logger.info(
             "Search node complete: queries=%s errors=%s",
@@ -0,0 +1,164 @@
+"""
+Rolling summarization of long conversation histories.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from .agents import HistorySummarizerAgent
+from .cache import LRUCache, make_cache_key
+from .config import config
+from .logging_config import get_logger
+from .metrics import CACHE_LOOKUPS
+
+if TYPE_CHECKING:
+    from .sessions import Session
+
+
+logger = get_logger(__name__)
+
+SUMMARY_PREFIX = "此前对话摘要："
+
+
+def prefix_digests(messages: List[dict]) -> List[str]:
+    """Chained digests: element ``i`` identifies ``messages[: i + 1]``; computed in one pass."""
+    digests: List[str] = []
+    digest = ""
+    for message in messages:
+        blob = json.dumps(message, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.sha256(f"{digest}\0{blob}".encode("utf-8")).hexdigest()
+        digests.append(digest)
+    return digests
+
+
+class HistoryCompactor:
+    """Keeps the last turns verbatim and folds everything older into a cached rolling summary.
+
+    Client-sent histories are cached by the digest of the prefix they
+    cover. A longer history extends the longest cached prefix, so each turn
+    is summarized exactly once however many times the conversation is
+    resent. Server-side sessions keep their summary on the session instead
+    (see :meth:`compact_session`), since trimming old turns would change
+    every prefix digest.
+    """
+
+    def __init__(self, enabled: bool, keep_turns: int, model: str, max_entries: int):
+        self.enabled = enabled
+        self.keep_messages = max(1, keep_turns) * 2
+        self.model = model
+        self._summaries = LRUCache(max_entries=max_entries)
+        self._pending: Dict[str, "asyncio.Task[str]"] = {}
+
+    def _key(self, digest: str) -> str:
+        return make_cache_key("history_summary", self.model, digest)
+
+    async def compact(
+        self,
+        history: Optional[List[dict]],
+        priority: Optional[str] = None,
+        enabled: Optional[bool] = None,
+    ) -> List[dict]:
+        """Return history with older turns replaced by a single summary message."""
+        history = history or []
+        if not (self.enabled if enabled is None else enabled) or len(history) <= self.keep_messages:
+            return history
+
+        older = [
+            {"role": message.get("role"), "content": message.get("content")}
+            for message in history[: -self.keep_messages]
+        ]
+        recent = history[-self.keep_messages:]
+        digests = prefix_digests(older)
+
+        # 从最长的已缓存前缀开始，只把新增的轮次并入摘要
+        summary, start = "", 0
+        for index in range(len(older), 0, -1):
+            cached = self._summaries.get(self._key(digests[index - 1]), count=False)
+            if cached is not None:
+                summary, start = cached, index
+                break
+
+        if start < len(older):
+            try:
+                summary = await self._extend(digests[-1], summary, older[start:], priority)
+            except Exception as exc:
+                logger.warning("历史摘要失败，保留完整历史: %s", exc)
+                return history
+            self._summaries.misses += 1
+            CACHE_LOOKUPS.inc("history", "miss")
+        else:
+            self._summaries.hits += 1
+            CACHE_LOOKUPS.inc("history", "hit")
+
+        logger.info(
+            "历史已压缩: 摘要覆盖 %s 条（新增 %s 条），保留最近 %s 条原文",
+            len(older),
+            len(older) - start,
+            len(recent),
+        )
+        return [{"role": "user", "content": SUMMARY_PREFIX + summary}, *recent]
+
+    async def compact_session(
+        self,
+        session: "Session",
+        priority: Optional[str] = None,
+        enabled: Optional[bool] = None,
+    ) -> List[dict]:
+        """Fold a session's turns older than the kept window into its rolling summary; return the history."""
+        older_count = len(session.turns) - self.keep_messages
+        if (self.enabled if enabled is None else enabled) and older_count > 0:
+            older = [
+                {"role": turn.get("role"), "content": turn.get("content")}
+                for turn in session.turns[:older_count]
+            ]
+            end = session.offset + older_count
+            try:
+                # 以会话 ID 与绝对轮次位置为键：同一会话的并发请求共享一次摘要调用
+                summary = await self._extend(f"{session.id}:{end}", session.summary, older, priority)
+            except Exception as exc:
+                logger.warning("会话历史摘要失败，保留完整历史: %s", exc)
+            else:
+                self._summaries.misses += 1
+                CACHE_LOOKUPS.inc("history", "miss")
+                # 等待期间其他请求可能已经并入了这些轮次
+                if end > session.offset:
+                    del session.turns[: end - session.offset]
+                    session.offset = end
+                    session.summary = summary
+                logger.info(
+                    "会话历史已压缩: session_id=%s 新并入 %s 条，摘要覆盖前 %s 条",
+                    session.id[:8],
+                    older_count,
+                    session.offset,
+                )
+
+        history = [{"role": turn["role"], "content": turn["content"]} for turn in session.turns]
+        if session.summary:
+            return [{"role": "user", "content": SUMMARY_PREFIX + session.summary}, *history]
+        return history
+
+    async def _extend(self, digest: str, previous: str, messages: List[dict], priority: Optional[str]) -> str:
+        key = self._key(digest)
+        task = self._pending.get(key)
+        if task is None:
+            # 相同前缀的并发请求共享同一次摘要调用
+            task = asyncio.create_task(
+                HistorySummarizerAgent.summarize(previous, messages, model=self.model, priority=priority)
+            )
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        summary = await asyncio.shield(task)
+        self._summaries.set(key, summary)
+        return summary
+
+
+# Global history compactor
+history_compactor = HistoryCompactor(
+    enabled=config.history_summary_enabled,
+    keep_turns=config.history_keep_turns,
+    model=config.history_summary_model,
+    max_entries=config.history_summary_cache_entries,
+)
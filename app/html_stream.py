@@ -0,0 +1,106 @@
+"""
+Incremental extraction of the HTML document from a streamed model response.
+"""
+from __future__ import annotations
+
+import re
+from typing import List, Optional
+
+
+_OPEN_RE = re.compile(r"<html", re.IGNORECASE)
+_CLOSE_RE = re.compile(r"</html>", re.IGNORECASE)
+_LEADING_FENCE_RE = re.compile(r"```(?:html|json|markdown)?\s*", re.IGNORECASE)
+# 跨块匹配所需的最大回看长度（len("</html>") - 1）
+_CARRY = 6
+
+
+class IncrementalHTMLExtractor:
+    """Buffers a streamed response once and tracks the ``<html>…</html>`` span as it arrives.
+
+    Equivalent to stripping code fences and taking the greedy
+    ``<html[\\s\\S]*</html>`` match, but only chunks that could end one of
+    the tags are scanned (plus a few carry-over characters), so ``feed()``
+    stays close to a list append and ``result()`` never re-scans the page.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._length = 0
+        self._open: Optional[int] = None
+        self._close_end: Optional[int] = None
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def has_document(self) -> bool:
+        """Whether both ``<html`` and a later ``</html>`` have been seen."""
+        return self._close_end is not None
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+
+        # 找到 <html 之后，只有可能以 "</html>" 结尾的增量才需要匹配：
+        # 结尾的 "l>" 在本块内，或 ">" 恰好是本块首字符
+        if self._open is None or "l>" in chunk or "L>" in chunk or chunk[0] == ">":
+            self._scan(chunk)
+
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+
+    def _scan(self, chunk: str) -> None:
+        """Match the tags ending in ``chunk``, including a few characters carried over from earlier chunks."""
+        carry = ""
+        for previous in reversed(self._chunks):
+            carry = previous[-(_CARRY - len(carry)):] + carry
+            if len(carry) >= _CARRY:
+                break
+        window = carry + chunk
+        base = self._length - len(carry)
+
+        if self._open is None:
+            match = _OPEN_RE.search(window)
+            if match is not None:
+                self._open = base + match.start()
+
+        if self._open is not None:
+            search_from = max(0, self._open - base)
+            for match in _CLOSE_RE.finditer(window, search_from):
+                self._close_end = base + match.end()
+
+    def result(self) -> str:
+        """Return the cleaned HTML; raises ``ValueError`` if nothing usable was received."""
+        if self._open is not None and self._close_end is not None:
+            html = self._slice(self._open, self._close_end)
+        else:
+            html = "".join(self._chunks).strip()
+            if html.startswith("```"):
+                fence = _LEADING_FENCE_RE.match(html)
+                html = html[fence.end():]
+                if html.rstrip().endswith("```"):
+                    html = html.rstrip()[:-3]
+                html = html.strip()
+
+        if not html:
+            raise ValueError("网页生成代理返回空响应")
+
+        # 结果即为唯一副本，释放分块
+        self._chunks = [html]
+        self._length = len(html)
+        self._open = self._close_end = None
+        return html
+
+    def _slice(self, start: int, end: int) -> str:
+        """Join only the chunks overlapping ``[start, end)``, walking in from both ends."""
+        chunks = self._chunks
+        first, head = 0, 0
+        while head + len(chunks[first]) <= start:
+            head += len(chunks[first])
+            first += 1
+        last, tail = len(chunks) - 1, self._length
+        while tail - len(chunks[last]) >= end:
+            tail -= len(chunks[last])
+            last -= 1
+        text = "".join(chunks[first:last + 1])
+        return text[start - head:len(text) - (tail - end)]
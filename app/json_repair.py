@@ -0,0 +1,286 @@
+"""
+Single-pass repair of malformed JSON produced by LLMs.
+
+Handles the failure modes we see from the planner in practice:
+
+- Markdown code fences around the JSON
+- Prose before or after the JSON value
+- Unescaped double quotes inside string values
+- Raw newlines / tabs inside strings
+- Trailing commas before ``}`` or ``]``
+- Output truncated mid-string, mid-escape, mid-literal or mid-number, after a key
+  or with unclosed brackets
+
+The input is scanned once; every repair is recorded by name so callers can
+log and count them.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+
+# 代码块围栏：```json ... ```（结尾围栏可能缺失）
+_FENCE_RE = re.compile(r"```[a-zA-Z]*[ \t]*\r?\n?")
+_OUTSIDE_RE = re.compile(r'[{}\[\]",:`]')
+_INSIDE_RE = re.compile(r'["\\\n\r\t]')
+_WS_RE = re.compile(r"[ \t\r\n]*")
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_CLOSERS = {"{": "}", "[": "]"}
+# 截断字符串末尾不完整的转义：单独的反斜杠或不足四位的 \uXXXX
+_PARTIAL_ESCAPE_RE = re.compile(r"\\(?:u[0-9a-fA-F]{0,3})?$")
+# 截断在字符串外的裸值：字面量前缀或数字的最长合法前缀
+_SCALAR_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+-."
+_NUMBER_PREFIX_RE = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+_LITERALS = ("true", "false", "null")
+
+
+class RepairResult:
+    """Outcome of ``repair_json``: decoded value, repaired text and applied repairs."""
+
+    __slots__ = ("value", "text", "repairs")
+
+    def __init__(self, value: Any, text: str, repairs: List[str]):
+        self.value = value
+        self.text = text
+        self.repairs = repairs
+
+    def __repr__(self) -> str:
+        return f"RepairResult(repairs={self.repairs!r})"
+
+
+class JSONRepairError(ValueError):
+    """Raised when the text cannot be repaired into valid JSON."""
+
+    def __init__(self, message: str, repairs: Optional[List[str]] = None):
+        super().__init__(message)
+        self.repairs = repairs or []
+
+
+def _strip_fences(text: str, repairs: List[str]) -> Tuple[str, bool]:
+    """Drop an opening code fence; only one before the JSON value counts (a fence may appear inside strings)."""
+    start = text.find("```")
+    if start < 0:
+        return text, False
+    containers = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if containers and min(containers) < start:
+        return text, False
+    match = _FENCE_RE.match(text, start)
+    repairs.append("code_fence")
+    if start > 0 and text[:start].strip():
+        repairs.append("leading_prose")
+    # 结尾围栏由扫描在字符串外遇到 ``` 时识别，避免误截字符串中的 ```
+    return text[match.end() if match else start + 3:], True
+
+
+def repair_json(raw: str) -> RepairResult:
+    """Repair and decode LLM JSON output in a single linear scan."""
+    repairs: List[str] = []
+    text, fenced = _strip_fences(raw, repairs)
+
+    # 定位首个 JSON 容器，之前的内容视为说明文字
+    first_obj = text.find("{")
+    first_arr = text.find("[")
+    candidates = [i for i in (first_obj, first_arr) if i >= 0]
+    if not candidates:
+        raise JSONRepairError("未找到 JSON 对象或数组", repairs)
+    begin = min(candidates)
+    if text[:begin].strip() and "leading_prose" not in repairs:
+        repairs.append("leading_prose")
+
+    out: List[str] = []
+    stack: List[str] = []
+    length = len(text)
+    pos = begin
+    seg_start = begin
+    in_string = False
+    string_is_key = False
+    # 字符串外最近一个有效字符，用于判断键/值位置与截断补全
+    last_sig = ""
+    end_of_value = length
+
+    while pos < length:
+        if in_string:
+            match = _INSIDE_RE.search(text, pos)
+            if match is None:
+                pos = length
+                break
+            idx = match.start()
+            ch = text[idx]
+            if ch == "\\":
+                pos = idx + 2
+                continue
+            if ch in _CONTROL_ESCAPES:
+                out.append(text[seg_start:idx])
+                out.append(_CONTROL_ESCAPES[ch])
+                seg_start = pos = idx + 1
+                if "control_chars" not in repairs:
+                    repairs.append("control_chars")
+                continue
+
+            # 引号：看下一个非空白字符判断是否为字符串结尾
+            nxt = _WS_RE.match(text, idx + 1).end()
+            follow = text[nxt] if nxt < length else ""
+            # 键的引号后紧接输入结尾：该引号结束键（截断处理时丢弃这个没有值的键）
+            closes = follow in (":", "") if string_is_key else follow in (",", "}", "]", "")
+            if not closes and not string_is_key and follow == '"' and text[idx + 1:nxt].count("\n"):
+                # 值后换行紧跟下一个键：视为缺失逗号
+                out.append(text[seg_start:idx + 1])
+                out.append(",")
+                seg_start = pos = idx + 1
+                in_string = False
+                last_sig = ","
+                if "missing_comma" not in repairs:
+                    repairs.append("missing_comma")
+                continue
+            if closes:
+                in_string = False
+                last_sig = '"'
+                pos = idx + 1
+            else:
+                out.append(text[seg_start:idx])
+                out.append('\\"')
+                seg_start = pos = idx + 1
+                if "inner_quotes" not in repairs:
+                    repairs.append("inner_quotes")
+            continue
+
+        match = _OUTSIDE_RE.search(text, pos)
+        if match is None:
+            pos = length
+            break
+        idx = match.start()
+        ch = text[idx]
+        pos = idx + 1
+
+        if ch == "`":
+            if text.startswith("```", idx):
+                # 字符串外的代码块围栏：JSON 到此为止
+                end_of_value = idx
+                pos = idx
+                break
+        elif ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and last_sig in ("{", ",")
+        elif ch in "{[":
+            stack.append(ch)
+            last_sig = ch
+        elif ch in "}]":
+            if not stack:
+                end_of_value = idx
+                break
+            expected = _CLOSERS[stack.pop()]
+            if ch != expected:
+                out.append(text[seg_start:idx])
+                out.append(expected)
+                seg_start = pos
+                if "mismatched_bracket" not in repairs:
+                    repairs.append("mismatched_bracket")
+            last_sig = expected
+            if not stack:
+                end_of_value = pos
+                break
+        elif ch == ",":
+            nxt = _WS_RE.match(text, pos).end()
+            if nxt < length and text[nxt] in "}]":
+                out.append(text[seg_start:idx])
+                seg_start = pos
+                if "trailing_comma" not in repairs:
+                    repairs.append("trailing_comma")
+            else:
+                last_sig = ","
+        else:  # ":"
+            last_sig = ":"
+
+    out.append(text[seg_start:min(pos, end_of_value)])
+
+    if stack or in_string:
+        # 输出被截断：补全字符串、丢弃没有值的键，处理悬空的逗号/冒号，再补全括号
+        tail = "".join(out)
+        if in_string and not string_is_key:
+            out = [_close_truncated_string(tail)]
+        else:
+            if in_string:
+                tail = _drop_dangling_key(tail, _key_quote(tail, len(tail)))
+            elif tail.endswith('"') and last_sig == '"' and stack[-1] == "{":
+                tail = _drop_dangling_key(tail, _key_quote(tail, len(tail) - 1))
+            tail = _close_truncated_scalar(tail.rstrip())
+            if tail.endswith(","):
+                tail = tail[:-1]
+            elif tail.endswith(":"):
+                tail += " null"
+            out = [tail]
+        out.extend(_CLOSERS[opener] for opener in reversed(stack))
+        repairs.append("truncated")
+    elif end_of_value < length:
+        rest = text[end_of_value:].strip()
+        if fenced and rest.startswith("```"):
+            rest = rest[3:].strip()
+        if rest and "trailing_prose" not in repairs:
+            repairs.append("trailing_prose")
+
+    repaired = "".join(out)
+    try:
+        value = json.loads(repaired)
+    except json.JSONDecodeError as exc:
+        raise JSONRepairError(f"JSON 修复失败: {exc}", repairs) from exc
+    return RepairResult(value, repaired, repairs)
+
+
+def _close_truncated_string(tail: str) -> str:
+    """Close a string value cut off mid-way, dropping a dangling backslash or partial ``\\u`` escape."""
+    match = _PARTIAL_ESCAPE_RE.search(tail)
+    if match is not None:
+        # 反斜杠连续奇数个时最后一个才是未完成的转义（偶数个是转义后的反斜杠本身）
+        through = tail[:match.start() + 1]
+        if (len(through) - len(through.rstrip("\\"))) % 2:
+            tail = tail[:match.start()]
+    return tail + '"'
+
+
+def _close_truncated_scalar(tail: str) -> str:
+    """Complete a cut-off literal (``tru`` → ``true``), cut a number back to its valid prefix, or drop the token."""
+    head = tail.rstrip(_SCALAR_CHARS)
+    token = tail[len(head):]
+    if not token:
+        return tail
+    for literal in _LITERALS:
+        if literal.startswith(token):
+            return head + literal
+    number = _NUMBER_PREFIX_RE.match(token)
+    # 无法补全的残片整体丢弃，之后按悬空的冒号 / 逗号处理
+    return (head + (number.group() if number else "")).rstrip()
+
+
+def _key_quote(tail: str, end: int) -> int:
+    """Index of the last unescaped quote before ``end``, i.e. where a trailing key starts."""
+    quote = tail.rfind('"', 0, end)
+    while quote > 0 and tail[quote - 1] == "\\":
+        quote = tail.rfind('"', 0, quote - 1)
+    return quote
+
+
+def _drop_dangling_key(tail: str, quote: int) -> str:
+    """Remove an object key that starts at ``quote`` and has no value yet; keep the text otherwise."""
+    before = tail[:quote].rstrip() if quote >= 0 else ""
+    if not before.endswith(("{", ",")):
+        return tail
+    return before
+
+
+def parse_json_object(raw: Optional[str]) -> RepairResult:
+    """Decode a JSON object, repairing it only if strict parsing fails."""
+    if raw is None or not str(raw).strip():
+        raise JSONRepairError("内容为空")
+
+    text = str(raw).strip()
+    try:
+        value = json.loads(text)
+        result = RepairResult(value, text, [])
+    except json.JSONDecodeError:
+        result = repair_json(text)
+
+    if not isinstance(result.value, dict):
+        raise JSONRepairError("JSON 顶层不是对象", result.repairs)
+    return result
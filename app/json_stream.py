@@ -0,0 +1,151 @@
+"""
+Incremental parsing of a streamed top-level JSON object.
+"""
+from __future__ import annotations
+
+import json
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, List, Optional, Tuple
+
+
+# 字符串外只关心结构性字符；字符串内只关心引号与转义
+_STRUCTURAL_RE = re.compile(r'[{}\[\]",:]')
+_STRING_SPECIAL_RE = re.compile(r'["\\]')
+
+
+class IncrementalJSONObjectParser:
+    """Reports each top-level member of a JSON object as soon as its value is complete.
+
+    Text before the opening ``{`` (code fences, prose) is skipped. Members
+    whose value cannot be decoded on its own are silently skipped; the full
+    text is still available via ``text`` for a final, more forgiving parse.
+    Chunks are kept as fed and each is scanned once; only a completed
+    member's text is joined to decode it.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        # 每块在全文中的起始偏移，用于按全文区间取回成员文本
+        self._starts: List[int] = []
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        # 转义符落在上一块末尾，本块首字符属于该转义
+        self._escape_pending = False
+        self._started = False
+        self.finished = False
+        # 当前顶层成员的状态（全文偏移）
+        self._key_span: Optional[Tuple[int, int]] = None
+        self._string_start = 0
+        self._value_start: Optional[int] = None
+        self._value_emitted = False
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+            self._starts = [0]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return the ``(key, value)`` members completed by it."""
+        if not chunk:
+            return []
+
+        base = self._length
+        self._chunks.append(chunk)
+        self._starts.append(base)
+        self._length += len(chunk)
+        completed: List[Tuple[str, Any]] = []
+        if self.finished:
+            return completed
+
+        pos = 0
+        if not self._started:
+            start = chunk.find("{")
+            if start < 0:
+                return completed
+            self._started = True
+            self._depth = 1
+            pos = start + 1
+        elif self._escape_pending:
+            self._escape_pending = False
+            pos = 1
+
+        length = len(chunk)
+        while pos < length:
+            if self._in_string:
+                match = _STRING_SPECIAL_RE.search(chunk, pos)
+                if match is None:
+                    break
+                idx = match.start()
+                if chunk[idx] == "\\":
+                    if idx + 1 >= length:
+                        # 转义符落在块末尾，跳过下一块的首字符
+                        self._escape_pending = True
+                        break
+                    pos = idx + 2
+                    continue
+                self._in_string = False
+                pos = idx + 1
+                if self._depth == 1 and self._value_start is None:
+                    self._key_span = (self._string_start, base + pos)
+                continue
+
+            match = _STRUCTURAL_RE.search(chunk, pos)
+            if match is None:
+                break
+            idx = match.start()
+            ch = chunk[idx]
+            pos = idx + 1
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = base + idx
+            elif ch == ":":
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = base + pos
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None and not self._value_emitted:
+                    # 对象/数组类型的值刚好闭合，立即上报
+                    self._emit(base + pos, completed)
+                    self._value_emitted = True
+                elif self._depth == 0:
+                    if self._value_start is not None and not self._value_emitted:
+                        self._emit(base + idx, completed)
+                    self.finished = True
+                    break
+            elif ch == ",":
+                if self._depth == 1:
+                    if self._value_start is not None and not self._value_emitted:
+                        self._emit(base + idx, completed)
+                    self._key_span = None
+                    self._value_start = None
+                    self._value_emitted = False
+
+        return completed
+
+    def _slice(self, start: int, end: int) -> str:
+        """Text of ``[start, end)`` in the full input, joining only the chunks it spans."""
+        first = bisect_right(self._starts, start) - 1
+        last = bisect_left(self._starts, end)
+        offset = self._starts[first]
+        if last - first == 1:
+            return self._chunks[first][start - offset:end - offset]
+        return "".join(self._chunks[first:last])[start - offset:end - offset]
+
+    def _emit(self, value_end: int, completed: List[Tuple[str, Any]]) -> None:
+        if self._key_span is None or self._value_start is None:
+            return
+        try:
+            key = json.loads(self._slice(*self._key_span))
+            value = json.loads(self._slice(self._value_start, value_end))
+        except ValueError:
+            return
+        if isinstance(key, str):
+            completed.append((key, value))
@@ -0,0 +1,416 @@
+"""
+Latency-aware routing of LLM calls across several provider endpoints, with
+health tracking, ejection, background probing and failover.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from .admission import QueueCallback, admission, is_throttle_error
+from .clients import client_manager
+from .config import config
+from .logging_config import get_logger
+from .metrics import LLM_ENDPOINT_CALLS, LLM_ENDPOINT_EJECTED, LLM_FAILOVERS
+
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# 请求本身有误（而非端点故障）的状态码：换端点也不会成功，不计入端点健康度
+_REQUEST_ERROR_STATUSES = (400, 413, 422)
+# 探测时视为端点存活的状态码（部分兼容接口未实现 /models）
+_PROBE_ALIVE_STATUSES = (404, 405)
+_PROBE_TIMEOUT = 5.0
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    for candidate in (exc, getattr(exc, "response", None)):
+        if candidate is None:
+            continue
+        for attr in ("status_code", "code", "status"):
+            value = getattr(candidate, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_endpoint_failure(exc: BaseException) -> bool:
+    """Whether an error says the endpoint is unhealthy, so another endpoint may succeed."""
+    if isinstance(exc, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = _status_of(exc)
+    if status is None:
+        # OpenAI SDK 的连接 / 超时错误没有状态码
+        return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+    return status not in _REQUEST_ERROR_STATUSES
+
+
+class Endpoint:
+    """One upstream account: an OpenAI-compatible base URL + key, or a Gemini key.
+
+    ``models`` maps the application's model names to the names this
+    provider uses; ``"*"`` is the fallback. With a mapping and no match the
+    endpoint does not serve that model; without a mapping it serves every
+    model under its own name.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        client: Any,
+        models: Optional[Dict[str, str]] = None,
+        weight: float = 1.0,
+    ):
+        self.name = name
+        self.kind = kind
+        self.client = client
+        self.models = models
+        self.weight = max(weight, 0.01)
+
+    def model_for(self, model: str) -> Optional[str]:
+        if not self.models:
+            return model
+        return self.models.get(model) or self.models.get("*")
+
+
+class EndpointHealth:
+    """Rolling health of one endpoint: EWMA latency per call kind, error rate, 429s and ejection state."""
+
+    __slots__ = (
+        "name", "latency", "error_rate", "throttles", "consecutive_failures",
+        "ejected_until", "ejections", "in_flight", "probing",
+    )
+
+    def __init__(self, name: str):
+        self.name = name
+        # stream: 首 token 延迟；complete: 整体响应延迟
+        self.latency: Dict[str, float] = {}
+        self.error_rate = 0.0
+        self.throttles = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.in_flight = 0
+        self.probing = False
+
+    def is_ejected(self, now: float) -> bool:
+        return self.probing or self.ejected_until > now
+
+    def record_success(self, kind: str, latency: float, alpha: float) -> None:
+        previous = self.latency.get(kind)
+        self.latency[kind] = latency if previous is None else previous + alpha * (latency - previous)
+        self.error_rate -= alpha * self.error_rate
+        self.consecutive_failures = 0
+        if self.ejections or self.ejected_until:
+            logger.info("LLM 端点恢复: endpoint=%s", self.name)
+            LLM_ENDPOINT_EJECTED.set(0, self.name)
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def record_failure(self, throttled: bool, alpha: float) -> None:
+        self.error_rate += alpha * (1.0 - self.error_rate)
+        self.consecutive_failures += 1
+        if throttled:
+            self.throttles += 1
+        if self.consecutive_failures >= config.llm_router_eject_after:
+            self.eject()
+
+    def eject(self) -> None:
+        """Take the endpoint out of rotation, backing off exponentially on repeated ejections."""
+        self.ejections += 1
+        duration = min(
+            config.llm_router_max_eject_seconds,
+            config.llm_router_eject_seconds * 2 ** (self.ejections - 1),
+        )
+        self.ejected_until = time.monotonic() + duration
+        LLM_ENDPOINT_EJECTED.set(1, self.name)
+        logger.warning(
+            "LLM 端点已剔除: endpoint=%s 连续失败=%s 错误率=%.2f 429=%s 剔除 %.1fs",
+            self.name,
+            self.consecutive_failures,
+            self.error_rate,
+            self.throttles,
+            duration,
+        )
+
+    def expected_latency(self, kind: str, prior: float) -> float:
+        return self.latency.get(kind, prior)
+
+
+class LLMRouter:
+    """Sends each LLM call to the best healthy endpoint and fails over before the first token.
+
+    Endpoints come from ``LLM_ENDPOINTS``; without it the single client of
+    ``client_manager`` (``API_KEY``/``BASE_URL``) is the only endpoint, so
+    behaviour is unchanged. Endpoints are ranked by EWMA latency for the
+    call kind, inflated by recent error rate and current load and divided
+    by weight; endpoints without data are assumed as fast as the best known
+    one so they get tried. Consecutive failures eject an endpoint for an
+    exponentially growing period; a background task probes ejected
+    endpoints and reinstates them once they answer. Each attempt holds an
+    admission slot on its own endpoint's lanes.
+    """
+
+    ERROR_PENALTY = 4.0
+    LOAD_PENALTY = 0.25
+    DEFAULT_LATENCY = 1.0
+
+    def __init__(self, endpoint_settings: Dict[str, dict]):
+        self.endpoint_settings = endpoint_settings
+        self._endpoints: Optional[List[Endpoint]] = None
+        self._health: Dict[str, EndpointHealth] = {}
+        self._probe_task: Optional["asyncio.Task[None]"] = None
+
+    # ---- endpoints ----
+
+    def _build_endpoints(self) -> List[Endpoint]:
+        endpoints: List[Endpoint] = []
+        # 多端点时由路由器负责故障转移，关闭 SDK 自身的重试以便尽快切换
+        max_retries = 0 if len(self.endpoint_settings) > 1 else None
+        for name, settings in self.endpoint_settings.items():
+            if not isinstance(settings, dict) or not settings.get("api_key"):
+                logger.warning("LLM 端点配置无效，已忽略: %s", name)
+                continue
+            kind = str(settings.get("kind") or "openai").lower()
+            try:
+                if kind == "gemini":
+                    client = client_manager.create_gemini_client(settings["api_key"])
+                else:
+                    kind = "openai"
+                    client = client_manager.create_openai_client(
+                        settings["api_key"], settings.get("base_url") or "", max_retries=max_retries
+                    )
+            except Exception as exc:
+                logger.warning("LLM 端点初始化失败，已忽略: %s (%s)", name, exc)
+                continue
+            models = settings.get("models") if isinstance(settings.get("models"), dict) else None
+            endpoints.append(Endpoint(name, kind, client, models, float(settings.get("weight") or 1.0)))
+        logger.info("LLM 路由端点: %s", ", ".join(f"{e.name}({e.kind})" for e in endpoints) or "无")
+        return endpoints
+
+    def endpoints(self) -> List[Endpoint]:
+        if not self.endpoint_settings:
+            if not client_manager.is_ready():
+                return []
+            kind = "gemini" if client_manager.use_gemini else "openai"
+            return [Endpoint(client_manager.provider_name, kind, client_manager.get_client())]
+        if self._endpoints is None:
+            self._endpoints = self._build_endpoints()
+        return self._endpoints
+
+    def is_ready(self) -> bool:
+        return bool(self.endpoints())
+
+    def bind_transport(self) -> None:
+        """Rebuild configured endpoint clients so they use the current shared connection pool."""
+        if self.endpoint_settings:
+            self._endpoints = None
+
+    def health(self, endpoint: Endpoint) -> EndpointHealth:
+        health = self._health.get(endpoint.name)
+        if health is None:
+            health = self._health[endpoint.name] = EndpointHealth(endpoint.name)
+        return health
+
+    def candidates(self, model: str, kind: str) -> List[Endpoint]:
+        """Endpoints able to serve ``model``, best first; ejected ones only if nothing else is left."""
+        now = time.monotonic()
+        serving = [endpoint for endpoint in self.endpoints() if endpoint.model_for(model)]
+        known = [
+            self.health(endpoint).latency[kind]
+            for endpoint in serving
+            if kind in self.health(endpoint).latency
+        ]
+        prior = min(known) if known else self.DEFAULT_LATENCY
+
+        def score(endpoint: Endpoint) -> float:
+            health = self.health(endpoint)
+            return (
+                health.expected_latency(kind, prior)
+                * (1.0 + self.ERROR_PENALTY * health.error_rate)
+                * (1.0 + self.LOAD_PENALTY * health.in_flight)
+                / endpoint.weight
+            )
+
+        healthy = sorted((e for e in serving if not self.health(e).is_ejected(now)), key=score)
+        if healthy:
+            return healthy[: max(1, config.llm_router_max_attempts)]
+        # 全部被剔除时仍尝试最早到期的端点，而不是直接失败
+        return sorted(serving, key=lambda e: self.health(e).ejected_until)[:1]
+
+    # ---- calls ----
+
+    def _record_failure(self, endpoint: Endpoint, exc: BaseException) -> None:
+        throttled = is_throttle_error(exc)
+        LLM_ENDPOINT_CALLS.inc(endpoint.name, "throttled" if throttled else "error")
+        self.health(endpoint).record_failure(throttled, config.llm_router_ewma_alpha)
+
+    def _record_success(self, endpoint: Endpoint, kind: str, latency: float) -> None:
+        LLM_ENDPOINT_CALLS.inc(endpoint.name, "ok")
+        self.health(endpoint).record_success(kind, latency, config.llm_router_ewma_alpha)
+
+    def _no_endpoint(self, model: str) -> RuntimeError:
+        return RuntimeError(f"没有可用于模型 {model} 的 LLM 端点")
+
+    async def run(
+        self,
+        model: str,
+        call: Callable[[Endpoint, str], Awaitable[T]],
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
+    ) -> T:
+        """Run a non-streaming call on the best endpoint, trying the next one on endpoint failures."""
+        candidates = self.candidates(model, "complete")
+        if not candidates:
+            raise self._no_endpoint(model)
+        for index, endpoint in enumerate(candidates):
+            provider_model = endpoint.model_for(model) or model
+            health = self.health(endpoint)
+            health.in_flight += 1
+            try:
+                async with admission.slot(endpoint.name, provider_model, priority, on_queued) as ticket:
+                    result = await call(endpoint, provider_model)
+                self._record_success(endpoint, "complete", ticket.latency)
+                return result
+            except Exception as exc:
+                if not is_endpoint_failure(exc):
+                    raise
+                self._record_failure(endpoint, exc)
+                if index + 1 >= len(candidates):
+                    raise
+                LLM_FAILOVERS.inc(endpoint.name)
+                logger.warning(
+                    "LLM 端点调用失败，切换到 %s: endpoint=%s model=%s error=%s",
+                    candidates[index + 1].name,
+                    endpoint.name,
+                    provider_model,
+                    exc,
+                )
+            finally:
+                health.in_flight -= 1
+        raise self._no_endpoint(model)
+
+    async def stream(
+        self,
+        model: str,
+        open_stream: Callable[[Endpoint, str], AsyncIterator[str]],
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
+    ) -> AsyncGenerator[str, None]:
+        """Yield deltas from the best endpoint; until the first delta arrives, failures move to the next one."""
+        candidates = self.candidates(model, "stream")
+        if not candidates:
+            raise self._no_endpoint(model)
+        for index, endpoint in enumerate(candidates):
+            provider_model = endpoint.model_for(model) or model
+            health = self.health(endpoint)
+            started = False
+            health.in_flight += 1
+            try:
+                async with admission.slot(endpoint.name, provider_model, priority, on_queued) as ticket:
+                    async for delta in open_stream(endpoint, provider_model):
+                        if not started:
+                            started = True
+                            ticket.mark_first_token()
+                            self._record_success(endpoint, "stream", ticket.latency)
+                        yield delta
+                if not started:
+                    self._record_success(endpoint, "stream", ticket.latency)
+                return
+            except Exception as exc:
+                if not is_endpoint_failure(exc):
+                    raise
+                self._record_failure(endpoint, exc)
+                # 已向下游输出内容后不能再换端点，否则会重复或拼接两份输出
+                if started or index + 1 >= len(candidates):
+                    raise
+                LLM_FAILOVERS.inc(endpoint.name)
+                logger.warning(
+                    "LLM 端点首 token 前失败，切换到 %s: endpoint=%s model=%s error=%s",
+                    candidates[index + 1].name,
+                    endpoint.name,
+                    provider_model,
+                    exc,
+                )
+            finally:
+                health.in_flight -= 1
+        raise self._no_endpoint(model)
+
+    # ---- probing ----
+
+    def start(self) -> None:
+        """Start background probing of ejected endpoints (only with several configured endpoints)."""
+        if len(self.endpoint_settings) > 1 and config.llm_router_probe_interval > 0 and self._probe_task is None:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(config.llm_router_probe_interval)
+            now = time.monotonic()
+            due = [
+                endpoint
+                for endpoint in self.endpoints()
+                # 剔除已到期、尚未被探测或真实请求确认的端点
+                if self.health(endpoint).ejected_until and not self.health(endpoint).is_ejected(now)
+            ]
+            if due:
+                await asyncio.gather(*(self._probe(endpoint) for endpoint in due))
+
+    async def _probe(self, endpoint: Endpoint) -> None:
+        """Check an endpoint whose ejection has expired before real traffic reaches it."""
+        health = self.health(endpoint)
+        health.probing = True
+        try:
+            if endpoint.kind == "gemini":
+                aio = getattr(endpoint.client, "aio", None)
+                if aio is None:
+                    # 无异步接口时不主动探测，到期后由真实请求试探
+                    return
+                await asyncio.wait_for(aio.models.get(model=endpoint.model_for("*") or "gemini-2.0-flash"), _PROBE_TIMEOUT)
+            else:
+                await asyncio.wait_for(endpoint.client.models.list(), _PROBE_TIMEOUT)
+        except Exception as exc:
+            if _status_of(exc) not in _PROBE_ALIVE_STATUSES:
+                logger.info("LLM 端点探测失败: endpoint=%s error=%s", endpoint.name, exc)
+                health.eject()
+                return
+        finally:
+            health.probing = False
+        logger.info("LLM 端点探测成功，重新加入路由: endpoint=%s", endpoint.name)
+        # 保留剔除次数：真实请求成功前再次失败仍按更长时间剔除
+        health.consecutive_failures = 0
+        health.ejected_until = 0.0
+        LLM_ENDPOINT_EJECTED.set(0, endpoint.name)
+
+    def stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            endpoint.name: {
+                "kind": endpoint.kind,
+                "latency": dict(self.health(endpoint).latency),
+                "error_rate": round(self.health(endpoint).error_rate, 3),
+                "throttles": self.health(endpoint).throttles,
+                "in_flight": self.health(endpoint).in_flight,
+                "ejected": self.health(endpoint).is_ejected(now),
+            }
+            for endpoint in self.endpoints()
+        }
+
+
+# Global LLM router
+llm_router = LLMRouter(config.llm_endpoints)
@@ -1,15 +1,27 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 DEFAULT_LOG_LEVEL = "INFO"
 DEFAULT_LOG_FILE = "logs/app.log"
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_FIELD_CHARS = 8192
+
+# 当前请求的 ID；在请求入口绑定，随 asyncio 任务的上下文传递到流水线中的所有日志
+request_id_var: ContextVar[Optional[str]] = ContextVar("baize_request_id", default=None)
 
 
 def _resolve_log_level(level: Optional[str]) -> int:
@@ -18,7 +30,96 @@ def _resolve_log_level(level: Optional[str]) -> int:
     return getattr(logging, level, logging.INFO)
 
 
-def _build_formatter() -> logging.Formatter:
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _clip(value: Any, limit: int) -> Any:
+    if limit > 0 and isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}…(+{len(value) - limit} chars)"
+    return value
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, message and exc."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = record.stack_info
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without ever blocking the caller.
+
+    The message is interpolated here, with oversized string arguments and
+    the final message clipped to ``max_field_chars``, because arguments may
+    change after the call returns. When the queue is full the record is
+    dropped and the number of drops is reported with the next record.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]", max_field_chars: int):
+        super().__init__(log_queue)
+        self.max_field_chars = max_field_chars
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(_clip(arg, self.max_field_chars) for arg in record.args)
+        message = _clip(record.getMessage(), self.max_field_chars)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        record.msg = record.message = message
+        record.args = None
+        record.exc_info = None
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.dropped:
+                notice = logging.LogRecord(
+                    __name__, logging.WARNING, __file__, 0,
+                    f"日志队列已满，已丢弃 {self.dropped} 条日志", None, None,
+                )
+                notice.request_id = None
+                self.queue.put_nowait(notice)
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DebugSampler(logging.Filter):
+    """Keep only a fraction of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+def _build_formatter(json_lines: bool = False) -> logging.Formatter:
+    if json_lines:
+        return JSONLinesFormatter()
     return logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
 
 
@@ -32,11 +133,18 @@ def setup_logging():
     """
     配置全局日志记录器，支持控制台和可选文件日志，避免多次初始化。
 
+    根记录器只挂一个非阻塞的队列处理器，控制台与文件输出（含滚动）在
+    后台监听线程中完成，磁盘抖动不会阻塞事件循环。
+
     环境变量:
         LOG_LEVEL: 全局日志级别，默认 INFO。
         LOG_FILE:  文件日志路径，默认 logs/app.log；为空则关闭文件日志。
         LOG_MAX_BYTES: 单个日志文件最大字节数（滚动），默认 5_000_000。
         LOG_BACKUP_COUNT: 滚动文件保留数量，默认 3。
+        LOG_JSON: 是否输出 JSON Lines（含 request_id），默认 false。
+        LOG_QUEUE_SIZE: 日志队列容量，队列满时丢弃并计数，默认 10000。
+        LOG_MAX_FIELD_CHARS: 单条日志消息及字符串参数的最大字符数，默认 8192（0 为不截断）。
+        LOG_DEBUG_SAMPLE_RATE: DEBUG 日志采样比例（0~1），默认 1。
     """
     root_logger = logging.getLogger()
 
@@ -46,12 +154,14 @@ def setup_logging():
     log_level = _resolve_log_level(os.environ.get("LOG_LEVEL"))
     root_logger.setLevel(log_level)
 
-    formatter = _build_formatter()
+    json_lines = os.environ.get("LOG_JSON", "").strip().lower() in ("1", "true", "yes", "on")
+    formatter = _build_formatter(json_lines)
+    handlers = []
 
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
     console_handler.setLevel(log_level)
-    root_logger.addHandler(console_handler)
+    handlers.append(console_handler)
 
     log_file = os.environ.get("LOG_FILE", DEFAULT_LOG_FILE).strip()
     if log_file:
@@ -63,9 +173,26 @@ def setup_logging():
         )
         file_handler.setFormatter(formatter)
         file_handler.setLevel(log_level)
-        root_logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(
+        maxsize=int(_env_number("LOG_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+    )
+    queue_handler = NonBlockingQueueHandler(
+        log_queue, max_field_chars=int(_env_number("LOG_MAX_FIELD_CHARS", DEFAULT_MAX_FIELD_CHARS))
+    )
+    sample_rate = _env_number("LOG_DEBUG_SAMPLE_RATE", 1.0)
+    if sample_rate < 1.0:
+        queue_handler.addFilter(DebugSampler(sample_rate))
+    root_logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 退出时排空队列，避免丢失最后的日志
+    atexit.register(listener.stop)
 
     root_logger._baize_logging_configured = True  # type: ignore[attr-defined]
+    root_logger._baize_log_listener = listener  # type: ignore[attr-defined]
     return root_logger
 
 
@@ -86,4 +213,4 @@ def get_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
     if not getattr(logger, "_baize_logger_tagged", False):
         logger._baize_logger_tagged = True  # type: ignore[attr-defined]
-    return logger
\ No newline at end of file
+    return logger
@@ -1,11 +1,34 @@
 """
 Main FastAPI application entry point.
 """
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from .routers import generation_router, ui_router
+from .clients import client_manager
+from .llm_router import llm_router
+from .metrics import loop_lag_monitor
+from .routers import generation_router, metrics_router, ui_router
+from .tracing import RequestContextMiddleware
+from .transport import http_transport
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream connection pools and start loop-lag sampling and endpoint probing on startup; undo them on shutdown."""
+    await http_transport.startup()
+    client_manager.bind_transport()
+    llm_router.bind_transport()
+    loop_lag_monitor.start()
+    llm_router.start()
+    try:
+        yield
+    finally:
+        await llm_router.stop()
+        await loop_lag_monitor.stop()
+        await http_transport.shutdown()
 
 
 def create_app() -> FastAPI:
@@ -15,6 +38,7 @@ def create_app() -> FastAPI:
         title="AI Animation Backend",
         version="2.0.0",
         description="LangGraph-powered animation generation with code and page planning",
+        lifespan=lifespan,
     )
     
     # CORS middleware
@@ -22,15 +46,20 @@ def create_app() -> FastAPI:
         CORSMiddleware,
         allow_origins=["*"],
         allow_methods=["GET", "POST"],
-        allow_headers=["Content-Type", "Authorization"],
+        allow_headers=["Content-Type", "Authorization", "X-Request-ID"],
+        expose_headers=["X-Request-ID"],
     )
     
+    # 在读取请求体之前记录到达时间并绑定请求 ID，供耗时追踪与日志使用
+    app.add_middleware(RequestContextMiddleware)
+    
     # Static files
     app.mount("/static", StaticFiles(directory="static"), name="static")
     
     # Include routers
     app.include_router(generation_router)
     app.include_router(ui_router)
+    app.include_router(metrics_router)
     
     return app
 
@@ -0,0 +1,282 @@
+"""
+In-process metrics registry with Prometheus text exposition.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import config
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒级延迟分桶：覆盖毫秒级缓存命中到数十秒的整页生成
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+TOKEN_RATE_BUCKETS = (5.0, 10.0, 20.0, 40.0, 60.0, 80.0, 120.0, 160.0, 240.0, 320.0)
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _configured_models() -> frozenset:
+    names = {
+        config.model,
+        config.animation_model,
+        config.code_planning_model,
+        config.page_planning_model,
+        config.science_planner_model,
+        config.science_generation_model,
+        config.history_summary_model,
+    }
+    names.update(config.llm_prices)
+    for settings in config.llm_endpoints.values():
+        models = settings.get("models") if isinstance(settings, dict) else None
+        if isinstance(models, dict):
+            names.update(models)
+            names.update(value for value in models.values() if isinstance(value, str))
+    names.discard("*")
+    names.discard("")
+    return frozenset(names)
+
+
+_MODEL_LABELS = _configured_models()
+
+
+def model_label(model: Optional[str]) -> str:
+    """Value for a ``model`` label: configured model names as-is, anything else (from requests) as ``other``."""
+    return model if model in _MODEL_LABELS else "other"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _check(self, labels: Tuple[str, ...]) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(_Metric):
+    """Monotonic counter; label values are passed positionally."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        values = self._values
+        if labels not in values:
+            self._check(labels)
+            values[labels] = 0.0
+        values[labels] += amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        if labels not in self._values:
+            self._check(labels)
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; buckets are cumulated only when rendered."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合: [各桶计数..., +Inf 计数, sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            self._check(labels)
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return int(series[-1]) if series else 0
+
+    def samples(self) -> Iterable[str]:
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, hits in zip((*self.buckets, math.inf), series):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {_format_value(cumulative)}"
+            suffix = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{suffix} {_format_value(series[-2])}"
+            yield f"{self.name}_count{suffix} {_format_value(series[-1])}"
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in Prometheus text format.
+
+    All recording happens on the event-loop thread, so updates are plain
+    in-place arithmetic with no locks; the cost per observation is a dict
+    lookup and, for histograms, one bisect.
+    """
+
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self._name(name), documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self._name(name), documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(self._name(name), documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Samples event-loop scheduling delay by timing a periodic sleep."""
+
+    def __init__(self, histogram: Histogram, interval: float):
+        self.histogram = histogram
+        self.interval = interval
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            self.histogram.observe(max(0.0, lag))
+
+
+# Global metrics registry
+metrics = MetricsRegistry(namespace="baize")
+
+REQUESTS = metrics.counter("requests_total", "Generation requests received.")
+REQUESTS_IN_FLIGHT = metrics.gauge("requests_in_flight", "Generation requests currently streaming.")
+ERRORS = metrics.counter("errors_total", "Pipeline errors by stage.", ("stage",))
+CACHE_LOOKUPS = metrics.counter("cache_lookups_total", "Cache lookups by cache and result.", ("cache", "result"))
+JSON_REPAIRS = metrics.counter("json_repairs_total", "Planner JSON repairs applied, by kind.", ("repair",))
+
+PLANNER_SECONDS = metrics.histogram("planner_seconds", "Planner LLM call latency.", ("stage",))
+SEARCH_QUERY_SECONDS = metrics.histogram("search_query_seconds", "Latency of each search query.", ("outcome",))
+GENERATION_TTFT_SECONDS = metrics.histogram(
+    "generation_ttft_seconds", "Generation time to first token, including admission wait.", ("model",)
+)
+GENERATION_SECONDS = metrics.histogram("generation_seconds", "Total generation stream duration.", ("model",))
+GENERATION_TOKENS_PER_SECOND = metrics.histogram(
+    "generation_tokens_per_second",
+    "Generation decode rate after the first token (estimated tokens).",
+    ("model",),
+    buckets=TOKEN_RATE_BUCKETS,
+)
+LLM_CALLS = metrics.counter("llm_calls_total", "Completed LLM calls.", ("model", "stage"))
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "LLM tokens by kind (prompt, completion, cached prompt).", ("model", "stage", "kind")
+)
+LLM_COST = metrics.counter("llm_cost_total", "Estimated LLM cost from the configured price table.", ("model",))
+LLM_ENDPOINT_CALLS = metrics.counter(
+    "llm_endpoint_calls_total", "LLM attempts per routed endpoint and outcome.", ("endpoint", "outcome")
+)
+LLM_FAILOVERS = metrics.counter("llm_failovers_total", "Attempts moved to another endpoint, by failed endpoint.", ("endpoint",))
+LLM_ENDPOINT_EJECTED = metrics.gauge("llm_endpoint_ejected", "Whether an endpoint is ejected from routing.", ("endpoint",))
+LOOP_LAG_SECONDS = metrics.histogram("event_loop_lag_seconds", "Event-loop scheduling delay.", buckets=LOOP_LAG_BUCKETS)
+
+loop_lag_monitor = LoopLagMonitor(LOOP_LAG_SECONDS, interval=config.metrics_loop_lag_interval)
@@ -3,10 +3,12 @@
 from .prompts import (
     SCIENCE_PLANNER_PROMPT,
     SCIENCE_PAGE_GENERATION_PROMPT,
+    HISTORY_SUMMARY_PROMPT,
 )
 
 __all__ = [
     "SCIENCE_PLANNER_PROMPT",
     "SCIENCE_PAGE_GENERATION_PROMPT",
+    "HISTORY_SUMMARY_PROMPT",
 ]
 
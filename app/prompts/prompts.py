@@ -67,3 +67,14 @@ SCIENCE_PAGE_GENERATION_PROMPT = """你是一名交互式科普网页创作专
 """
 
 
+
+
+HISTORY_SUMMARY_PROMPT = """你负责压缩科普网页创作对话的历史记录。
+输入为 JSON：previous_summary 为此前的摘要（可能为空），messages 为需要并入摘要的新对话轮次。
+
+请输出一段新的摘要，要求：
+- 保留用户提出过的主题、修改要求与偏好（受众、风格、配色、必须包含的内容等）
+- 保留已生成网页的标题与 artifact_id，便于后续引用
+- 删除寒暄与重复信息，不要编造内容
+- 使用简体中文纯文本，不超过 300 字，不要输出 JSON 或 Markdown
+"""
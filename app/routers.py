@@ -1,13 +1,16 @@
 """FastAPI routers for planning and generation endpoints."""
-import json
 from datetime import datetime
-from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 
+from .artifacts import artifact_store, compact_events
 from .config import config
+from .metrics import CONTENT_TYPE, metrics
 from .schemas import ScienceEducationRequest
 from .services import ScienceEducationService
+from .sse import FlushPolicy, SSEEncoder
+from .tracing import Trace
 
 
 # Templates
@@ -16,18 +19,27 @@ templates = Jinja2Templates(directory="templates")
 # Routers
 generation_router = APIRouter(prefix="", tags=["generation"])
 ui_router = APIRouter(prefix="", tags=["ui"])
+metrics_router = APIRouter(prefix="", tags=["metrics"])
 
 
 @generation_router.post("/generate")
-async def generate_science_page(request: ScienceEducationRequest):
+async def generate_science_page(request: ScienceEducationRequest, http_request: Request):
     """流式生成科普教育网页。"""
 
-    async def event_stream():
-        async for event in ScienceEducationService.stream_science_page(request):
-            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-        yield 'data: {"event": "[DONE]"}\n\n'
+    # 从请求到达（读取请求体之前）开始计时，请求体解析与校验记为 parse
+    trace = Trace(
+        getattr(http_request.state, "request_id", None),
+        started_at=getattr(http_request.state, "received_at", None),
+    )
+    trace.root.child("parse", start=trace.root.start).finish()
+    encoder = SSEEncoder(FlushPolicy.resolve(request.flush_policy))
+
+    def event_stream():
+        events = ScienceEducationService.stream_science_page(request, trace)
+        return encoder.encode(compact_events(events, request.detail))
 
     headers = {
+        "X-Request-ID": trace.request_id,
         "Cache-Control": "no-store",
         "Content-Type": "text/event-stream; charset=utf-8",
         "X-Accel-Buffering": "no",
@@ -37,6 +49,24 @@ async def generate_science_page(request: ScienceEducationRequest):
     return StreamingResponse(event_stream(), headers=headers, media_type="text/event-stream")
 
 
+@generation_router.get("/artifacts/{artifact_id}", response_class=HTMLResponse)
+async def get_artifact(artifact_id: str):
+    """按 ID 获取已生成的网页。"""
+    html = artifact_store.get(artifact_id)
+    if html is None:
+        raise HTTPException(status_code=404, detail="生成结果不存在或已过期")
+    # 内容寻址：同一 ID 的内容不会变化
+    return HTMLResponse(html, headers={"Cache-Control": "private, max-age=86400, immutable"})
+
+
+@metrics_router.get("/metrics")
+async def get_metrics():
+    """以 Prometheus 文本格式导出进程内指标。"""
+    if not config.metrics_enabled:
+        raise HTTPException(status_code=404, detail="指标未启用")
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+
 @ui_router.get("/", response_class=HTMLResponse)
 async def read_index(request: Request):
     """Render the main UI page."""
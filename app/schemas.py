@@ -54,6 +54,17 @@ class ScienceEducationRequest(BaseModel):
     topic: str
     model: Optional[str] = None
     history: Optional[List[dict]] = None
+    # 服务端会话 ID：携带时只需发送本轮主题，历史由服务端维护（优先于 history）；
+    # 空字符串表示新建会话，缺省为无状态请求
+    session_id: Optional[str] = None
+    # 是否将较早的对话轮次滚动摘要（默认取 HISTORY_SUMMARY_ENABLED）
+    summarize_history: Optional[bool] = None
+    # 准入队列优先级：interactive（默认）或 batch
+    priority: Optional[str] = None
+    # SSE 合帧策略：latency（低延迟，默认）或 throughput（大帧、低开销）
+    flush_policy: Optional[str] = None
+    # 事件详细程度：compact（默认，最终事件仅含 artifact 引用）、verbose 或 full（含原始检索载荷）
+    detail: Optional[str] = None
 
 
 class AgentState(BaseModel):
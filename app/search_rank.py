@@ -0,0 +1,218 @@
+"""
+Cross-query deduplication and relevance ranking of search results.
+"""
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from .cache import MinHashIndex, jaccard
+from .config import config
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+# 不影响页面内容的跟踪参数
+_TRACKING_PARAMS = {"fbclid", "gclid", "spm", "from", "ref", "share", "share_source", "timestamp"}
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u9fff]+")
+
+# 近似去重只比较摘要开头：镜像 / 转载的开头即已相同，也限制 shingle 数量
+_DEDUPE_PREFIX_CHARS = 300
+# 条目不多时直接两两比较精确 Jaccard，比构建 MinHash 签名便宜得多
+_EXACT_DEDUPE_MAX_ITEMS = 50
+
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+
+
+def canonical_url(url: Optional[str]) -> str:
+    """Normalize a URL so mirrors of the same page compare equal."""
+    if not url or not isinstance(url, str):
+        return ""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = urlencode(sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in _TRACKING_PARAMS
+    ))
+    path = parts.path.rstrip("/") or "/"
+    # 协议与片段不影响内容，统一忽略
+    return urlunsplit(("", host, path, query, ""))
+
+
+def lexical_tokens(text: str) -> List[str]:
+    """Words for ASCII, character bigrams for CJK runs."""
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if len(run) == 1 or run[0].isascii():
+            tokens.append(run)
+        else:
+            tokens.extend([run[i:i + 2] for i in range(len(run) - 1)])
+    return tokens
+
+
+def _item_parts(item: Dict[str, Any]) -> Tuple[str, str, str]:
+    highlights = item.get("highlights")
+    if isinstance(highlights, list):
+        highlights = " ".join(h for h in highlights if isinstance(h, str))
+    elif not isinstance(highlights, str):
+        highlights = ""
+    return item.get("title") or "", item.get("summary") or "", highlights
+
+
+def _item_text(item: Dict[str, Any]) -> str:
+    return " ".join(part for part in _item_parts(item) if part)
+
+
+def bm25_scores(query: str, documents: List[str]) -> List[float]:
+    """Okapi BM25 score of each document for query, with IDF over the given documents.
+
+    Repeated query terms weigh proportionally more.
+    """
+    return _bm25(Counter(lexical_tokens(query)), [Counter(lexical_tokens(doc)) for doc in documents])
+
+
+def _bm25(query_terms: Counter, doc_terms: List[Counter]) -> List[float]:
+    if not query_terms or not doc_terms:
+        return [0.0] * len(doc_terms)
+
+    total = len(doc_terms)
+    avg_len = sum(sum(terms.values()) for terms in doc_terms) / total or 1.0
+    doc_freq = {term: sum(1 for terms in doc_terms if term in terms) for term in query_terms}
+
+    scores: List[float] = []
+    for terms in doc_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term, weight in query_terms.items():
+            tf = terms.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (total - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += weight * idf * tf * (_BM25_K1 + 1) / (tf + _BM25_K1 * (1 - _BM25_B + _BM25_B * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+def _analyze(item: Dict[str, Any]) -> Tuple[FrozenSet[str], List[str]]:
+    """Tokenize an item once: shingles of its summary opening (for dedup) and all its tokens (for BM25)."""
+    title, summary, highlights = _item_parts(item)
+    title_tokens = lexical_tokens(title)
+    # 摘要在去重前缀处切开分别分词，两段拼起来即 BM25 用的全文词元（只丢掉跨切点的一个 bigram）
+    head = lexical_tokens(summary[:_DEDUPE_PREFIX_CHARS])
+    # 相邻词元成对比较（中文即字符 trigram），单个 bigram 在同主题文本间重合太多
+    shingled = head if summary else title_tokens
+    signature = frozenset([f"{a} {b}" for a, b in zip(shingled, shingled[1:])] or shingled)
+    return signature, title_tokens + head + lexical_tokens(summary[_DEDUPE_PREFIX_CHARS:]) + lexical_tokens(highlights)
+
+
+def _item_size(item: Dict[str, Any]) -> int:
+    return len(_item_text(item)) + len(item.get("source_url") or "")
+
+
+def rank_search_results(
+    topic: str,
+    search_results: Optional[List[dict]],
+    top_n: Optional[int] = None,
+    max_chars: Optional[int] = None,
+) -> List[dict]:
+    """Merge per-query blocks into deduplicated flat items ranked by relevance to ``topic``.
+
+    When nothing usable is left, the (raw-stripped) blocks are returned so
+    the planner can still see that search was attempted and failed.
+    """
+    top_n = config.search_rank_top_n if top_n is None else top_n
+    max_chars = config.search_rank_max_chars if max_chars is None else max_chars
+
+    # 1. 规范化 URL 去重：同一页面保留摘要最长的一条
+    by_url: Dict[str, Dict[str, Any]] = {}
+    unkeyed: List[Dict[str, Any]] = []
+    queries: List[str] = []
+    raw_count = 0
+    for block in search_results or []:
+        if not isinstance(block, dict):
+            continue
+        if block.get("query"):
+            queries.append(block["query"])
+        for item in block.get("results") or []:
+            if not isinstance(item, dict):
+                continue
+            raw_count += 1
+            flat = {key: value for key, value in item.items() if key != "raw"}
+            flat.setdefault("query", block.get("query"))
+            url = canonical_url(item.get("source_url"))
+            if not url:
+                unkeyed.append(flat)
+                continue
+            existing = by_url.get(url)
+            if existing is None or len(flat.get("summary") or "") > len(existing.get("summary") or ""):
+                by_url[url] = flat
+    candidates = list(by_url.values()) + unkeyed
+    url_unique = len(candidates)
+
+    # 2. 近似摘要去重（镜像站、转载）：比较摘要开头的相邻词元对；条目多时改用 MinHash/LSH 找候选。
+    #    每条只分词一次，词元同时用于去重与下面的 BM25
+    threshold = config.search_dedupe_similarity
+    index = MinHashIndex() if len(candidates) > _EXACT_DEDUPE_MAX_ITEMS else None
+    kept_signatures: List[FrozenSet[str]] = []
+    unique: List[Dict[str, Any]] = []
+    unique_tokens: List[List[str]] = []
+    for position, item in enumerate(candidates):
+        signature, tokens = _analyze(item)
+        if signature:
+            if index is not None:
+                if index.query("search", signature, threshold) is not None:
+                    continue
+                index.add(str(position), "search", signature)
+            elif any(jaccard(signature, kept) >= threshold for kept in kept_signatures):
+                continue
+            kept_signatures.append(signature)
+        unique.append(item)
+        unique_tokens.append(tokens)
+
+    if not unique:
+        return [
+            {key: value for key, value in block.items() if key != "raw"}
+            for block in search_results or []
+            if isinstance(block, dict)
+        ]
+
+    # 3. BM25 相关性排序（主题为主，检索词为辅），在数量与字符预算内取前 N 条
+    scores = _bm25(
+        Counter(lexical_tokens(" ".join([topic, topic, *queries]))),
+        [Counter(tokens) for tokens in unique_tokens],
+    )
+    ranked = sorted(zip(scores, range(len(unique))), key=lambda pair: (-pair[0], pair[1]))
+
+    selected: List[Dict[str, Any]] = []
+    used = 0
+    for _, position in ranked:
+        if top_n and len(selected) >= top_n:
+            break
+        item = unique[position]
+        size = _item_size(item)
+        if max_chars and selected and used + size > max_chars:
+            continue
+        selected.append(item)
+        used += size
+
+    logger.info(
+        "检索结果整理: 原始 %s 条 → URL 去重后 %s → 近似去重后 %s → 保留 %s 条（约 %s 字符）",
+        raw_count,
+        url_unique,
+        len(unique),
+        len(selected),
+        used,
+    )
+    return selected
@@ -1,18 +1,73 @@
 """Service layer for orchestrating agents and workflows."""
-import json
-import re
-from typing import Any, AsyncGenerator, Dict, List, Optional
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
 
 from fastapi import HTTPException
 
+from .admission import QueueCallback
+from .artifacts import artifact_store
+from .cache import page_cache, planner_cache
+from .coalescing import generation_flights
+from .history import history_compactor
+from .config import config
+from .json_repair import JSONRepairError, parse_json_object
+from .json_stream import IncrementalJSONObjectParser
+from .search_rank import rank_search_results
 from .logging_config import get_logger
+from .metrics import CACHE_LOOKUPS, ERRORS, JSON_REPAIRS, PLANNER_SECONDS, REQUESTS, REQUESTS_IN_FLIGHT
 from .schemas import AgentState, ScienceEducationRequest
+from .sessions import compact_history, session_store
 from .agents import SciencePlannerAgent, SciencePageGenerator
 from .tools import TailiySearchTool
+from .tracing import Span, Trace, activate, current_span, span
+from .usage import UsageLedger, recording
 
 
 logger = get_logger(__name__)
 
+# 流水线任务结束标记
+_PIPELINE_END = object()
+
+
+# 解析失败时日志中保留的原始输出长度
+_RAW_LOG_LIMIT = 500
+
+
+def _parse_planner_output(raw: Optional[str]) -> Dict[str, Any]:
+    """Decode the planner blueprint, repairing malformed JSON in a single pass."""
+    if raw is None or not str(raw).strip():
+        raise ValueError("策划代理返回空响应")
+
+    try:
+        with span("parse") as parse_span:
+            result = parse_json_object(raw)
+            if result.repairs:
+                parse_span.annotate(repairs=result.repairs)
+    except JSONRepairError as exc:
+        raw_str = str(raw)
+        logger.error(
+            "策划代理返回的内容无法解析为 JSON: %s repairs=%s raw(%s chars)=%s",
+            exc,
+            exc.repairs,
+            len(raw_str),
+            raw_str[:_RAW_LOG_LIMIT],
+        )
+        raise ValueError("策划代理返回内容无法解析为 JSON") from exc
+
+    if result.repairs:
+        logger.info("策划蓝图 JSON 已修复: %s", ",".join(result.repairs))
+        for repair in result.repairs:
+            JSON_REPAIRS.inc(repair)
+    return result.value
+
+
+def _clean_queries(queries: Any) -> List[str]:
+    """Keep non-empty string search queries, stripped."""
+    if not isinstance(queries, list):
+        return []
+    return [q.strip() for q in queries if isinstance(q, str) and q.strip()]
+
 
 class ScienceEducationService:
     """Service for executing the science education generation workflow."""
@@ -21,210 +76,435 @@ class ScienceEducationService:
     async def _run_planner(
         state: AgentState,
         search_results: Optional[List[dict]] = None,
+        priority: Optional[str] = None,
+        on_queued: Optional[QueueCallback] = None,
+        on_member: Optional[Callable[[str, Any], None]] = None,
     ) -> Dict[str, Any]:
-        """Call planner agent and update state with latest blueprint."""
-        planner_raw = await SciencePlannerAgent.plan(
-            topic=state.topic or "",
-            search_results=search_results,
-            history=state.messages,
-            model=state.model,
-        )
+        """Call planner agent and update state with latest blueprint.
+
+        When ``on_member`` is given the planner is streamed and each top-level
+        blueprint field is reported as soon as it has been fully generated.
+        """
+        stage = "refined" if search_results else "initial"
+        with span("planner", stage=stage) as planner_span:
+            # 精炼蓝图取决于本主题的检索结果：按检索结果摘要值分区，且只做精确主题匹配
+            similar = stage == "initial"
+            cache_namespace = planner_cache.namespace_for(stage, state.model, state.messages, search_results)
+            cached = planner_cache.get(cache_namespace, state.topic or "", similar=similar)
+            CACHE_LOOKUPS.inc("planner", "miss" if cached is None else "hit")
+            planner_span.annotate(cached=cached is not None)
+            if cached is not None:
+                logger.info(
+                    "策划蓝图缓存命中(%s): topic=%s matched=%s similarity=%.2f",
+                    cached["match"],
+                    state.topic,
+                    cached["topic"],
+                    cached["similarity"],
+                )
+                ScienceEducationService._apply_planner_result(state, cached["raw"], cached["parsed"])
+                return {
+                    "raw": cached["raw"],
+                    "parsed": cached["parsed"],
+                }
 
-        def _sanitize_loose_quotes(text: str) -> str:
-            """Escape un-delimited quotes within JSON string values."""
-            chars: List[str] = []
-            in_string = False
-            i = 0
-            length = len(text)
-
-            while i < length:
-                ch = text[i]
-                if in_string:
-                    if ch == "\\":
-                        # Preserve escape sequences
-                        chars.append(ch)
-                        i += 1
-                        if i < length:
-                            chars.append(text[i])
-                    elif ch == '"':
-                        # Look ahead to determine if this quote ends the string value
-                        j = i + 1
-                        while j < length and text[j] in " \t\r\n":
-                            j += 1
-                        if j >= length or text[j] in ",}]":
-                            chars.append('"')
-                            in_string = False
-                        else:
-                            chars.extend(["\\", '"'])
-                    else:
-                        chars.append(ch)
+            started = time.perf_counter()
+            with span("llm"):
+                if on_member is None:
+                    planner_raw = await SciencePlannerAgent.plan(
+                        topic=state.topic or "",
+                        search_results=search_results,
+                        history=state.messages,
+                        model=state.model,
+                        priority=priority,
+                        on_queued=on_queued,
+                    )
                 else:
-                    chars.append(ch)
-                    if ch == '"':
-                        in_string = True
-                i += 1
-
-            return "".join(chars)
-
-        def _parse_planner_output(raw: str) -> Dict[str, Any]:
-            if raw is None or not str(raw).strip():
-                raise ValueError("策划代理返回空响应")
-
-            raw_str = str(raw).strip()
-
-            def _strip_code_fence(text: str) -> str:
-                if text.startswith("```"):
-                    # Remove leading/trailing code fences if present
-                    stripped = re.sub(r"^```(?:json)?\s*", "", text)
-                    stripped = re.sub(r"\s*```$", "", stripped)
-                    return stripped.strip()
-                return text
-
-            raw_candidate = _strip_code_fence(raw_str)
-
-            try:
-                return json.loads(raw_candidate)
-            except json.JSONDecodeError:
-                sanitized = _sanitize_loose_quotes(raw_candidate)
-                if sanitized != raw_candidate:
-                    try:
-                        return json.loads(sanitized)
-                    except json.JSONDecodeError:
-                        pass
-
-                match = re.search(r"\{[\s\S]*\}$", raw_candidate)
-                if match:
-                    try:
-                        candidate = match.group(0)
-                        try:
-                            return json.loads(candidate)
-                        except json.JSONDecodeError:
-                            sanitized_inner = _sanitize_loose_quotes(candidate)
-                            if sanitized_inner != candidate:
-                                return json.loads(sanitized_inner)
-                    except json.JSONDecodeError:
-                        pass
-
-                logger.error("策划代理返回的内容无法解析为 JSON: %s", raw_str)
-                raise ValueError("策划代理返回内容无法解析为 JSON")
-
-        planner_parsed = _parse_planner_output(planner_raw)
+                    parser = IncrementalJSONObjectParser()
+                    async for delta in SciencePlannerAgent.stream_plan(
+                        topic=state.topic or "",
+                        search_results=search_results,
+                        history=state.messages,
+                        model=state.model,
+                        priority=priority,
+                        on_queued=on_queued,
+                    ):
+                        for key, value in parser.feed(delta):
+                            on_member(key, value)
+                    planner_raw = parser.text.strip()
+                    if not planner_raw:
+                        raise ValueError("策划代理返回空响应")
+            PLANNER_SECONDS.observe(time.perf_counter() - started, stage)
+
+            planner_parsed = _parse_planner_output(planner_raw)
+            planner_cache.set(cache_namespace, state.topic or "", planner_raw, planner_parsed, similar=similar)
+            ScienceEducationService._apply_planner_result(state, planner_raw, planner_parsed)
+
+            return {
+                "raw": planner_raw,
+                "parsed": planner_parsed,
+            }
 
+    @staticmethod
+    def _apply_planner_result(state: AgentState, planner_raw: str, planner_parsed: Dict[str, Any]) -> None:
+        """Update state with a parsed planner blueprint."""
         state.need_search = bool(planner_parsed.get("need_search"))
-        state.search_queries = [
-            q.strip()
-            for q in planner_parsed.get("search_queries", [])
-            if isinstance(q, str) and q.strip()
-        ]
+        state.search_queries = _clean_queries(planner_parsed.get("search_queries"))
         state.prompt_blueprint = planner_parsed
         state.planner_output_raw = planner_raw
         state.step = "planner_complete"
 
-        return {
-            "raw": planner_raw,
-            "parsed": planner_parsed,
-        }
-
     @staticmethod
     async def stream_science_page(
         request: ScienceEducationRequest,
+        trace: Optional[Trace] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Stream planner/search/generation events."""
+        """Stream planner/search/generation events for a request, tracking its session.
+
+        The request's span tree is sent as a ``timing`` event just before
+        ``done`` and logged once the stream ends, however it ends.
+        """
+        trace = trace or Trace()
+        ledger = UsageLedger()
+        REQUESTS.inc()
+        REQUESTS_IN_FLIGHT.inc()
+        done_event: Optional[Dict[str, Any]] = None
+        completed = False
+        try:
+            async for event in ScienceEducationService._stream_session(request, trace, ledger):
+                if event.get("event") == "done":
+                    done_event = event
+                    continue
+                yield event
+            completed = True
+            trace.root.finish()
+            if config.trace_timing_event:
+                yield {"event": "timing", **trace.to_dict()}
+            if done_event is not None:
+                yield done_event
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            if not completed:
+                trace.root.annotate(aborted=True)
+            trace.root.finish()
+            trace.log()
+            if ledger.calls:
+                # 按请求记录一行用量，便于按主题 / 阶段统计 token 消耗
+                usage = ledger.summary()
+                logger.info(
+                    "Token 用量: request_id=%s topic=%s calls=%s prompt=%s completion=%s cached=%s cost=%s by_stage=%s",
+                    trace.request_id,
+                    (request.topic or "").strip(),
+                    usage["calls"],
+                    usage["prompt_tokens"],
+                    usage["completion_tokens"],
+                    usage["cached_tokens"],
+                    usage["cost"],
+                    {stage: (t["prompt_tokens"], t["completion_tokens"]) for stage, t in usage["by_stage"].items()},
+                )
+
+    @staticmethod
+    async def _stream_session(
+        request: ScienceEducationRequest,
+        trace: Trace,
+        ledger: UsageLedger,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Resolve the conversation history, then stream the request's events."""
         if not request.topic or not request.topic.strip():
             yield {"event": "error", "message": "主题不能为空"}
             return
 
+        history_span = trace.root.child("history")
+        session = None
+        if request.session_id is not None:
+            # 会话模式（客户端显式携带 session_id，空字符串为新建）：历史保存在服务端，客户端只发送本轮主题
+            # 未携带时保持无状态，不创建会话，避免无关调用挤占会话 LRU
+            session = session_store.resolve(request.session_id)
+            yield {"event": "session", "session_id": session.id}
+
+        with recording(ledger):
+            if session is not None:
+                request.history = await history_compactor.compact_session(
+                    session,
+                    priority=request.priority,
+                    enabled=request.summarize_history,
+                )
+            else:
+                request.history = await history_compactor.compact(
+                    compact_history(request.history),
+                    priority=request.priority,
+                    enabled=request.summarize_history,
+                )
+        history_span.finish(messages=len(request.history))
+
+        async for event in ScienceEducationService._stream_events(request, trace, ledger):
+            if event.get("final"):
+                # 用量只计本请求实际发起的调用：缓存回放与合并请求为 0
+                usage = ledger.summary()
+                if session is not None:
+                    usage["session"] = session_store.record_usage(session, ledger.totals())
+                    if event.get("html"):
+                        session_store.record_turn(session, request.topic.strip(), event["html"], event.get("artifact"))
+                event = {**event, "usage": usage}
+            yield event
+
+    @staticmethod
+    async def _stream_events(
+        request: ScienceEducationRequest,
+        trace: Trace,
+        ledger: UsageLedger,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream pipeline events, replaying cached pages when possible."""
+        cache_span = trace.root.child("page_cache")
+        cache_key = page_cache.key_for(request.topic, request.model, request.history)
+        cached_events = await page_cache.get(cache_key)
+        CACHE_LOOKUPS.inc("page", "miss" if cached_events is None else "hit")
+        cache_span.finish(hit=cached_events is not None)
+        if cached_events is not None:
+            logger.info("整页缓存命中: topic=%s", request.topic.strip())
+            for event in cached_events:
+                if event.get("final") and event.get("html"):
+                    # 缓存可能比 artifact 存储活得更久，回放时重新登记
+                    artifact_store.put(event["html"], event.get("artifact"))
+                yield {**event, "cached": True}
+            yield {"event": "done"}
+            return
+
+        pipeline_span = trace.root.child("pipeline", coalesced=True)
+
+        def _source() -> AsyncGenerator[Dict[str, Any], None]:
+            # 只有实际运行流水线的请求会走到这里，合并的后到者只记录等待时间
+            pipeline_span.annotate(coalesced=False)
+            return ScienceEducationService._stream_and_record(request, cache_key, pipeline_span, ledger)
+
+        if config.coalesce_enabled:
+            # 相同请求共享同一条流水线，后到者先回放已产生的事件再跟随实时增量
+            events = generation_flights.stream(cache_key, _source)
+        else:
+            events = _source()
+
+        async for event in events:
+            yield event
+        pipeline_span.finish()
+
+    @staticmethod
+    async def _stream_and_record(
+        request: ScienceEducationRequest,
+        cache_key: str,
+        parent_span: Optional[Span] = None,
+        ledger: Optional[UsageLedger] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream pipeline events and store the replayable ones in the page cache."""
+        # 仅记录可回放的阶段事件；增量 delta 已包含在最终 html 中
+        recorded_events: List[Dict[str, Any]] = []
+        async for event in ScienceEducationService._stream_pipeline(request, parent_span, ledger):
+            event_name = event.get("event")
+            if event_name in ("planner", "search") or (
+                event_name == "generation" and event.get("final")
+            ):
+                recorded_events.append(event)
+            elif event_name == "search_reset":
+                # 被丢弃的提前检索不进入缓存，回放时无需再重置
+                recorded_events = [e for e in recorded_events if e.get("event") != "search"]
+            elif event_name == "done" and any(
+                e.get("final") and e.get("html") for e in recorded_events
+            ):
+                await page_cache.set(cache_key, recorded_events)
+            yield event
+
+    @staticmethod
+    async def _stream_pipeline(
+        request: ScienceEducationRequest,
+        parent_span: Optional[Span] = None,
+        ledger: Optional[UsageLedger] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Run the pipeline in a task and stream the events it emits."""
+        queue: "asyncio.Queue[Any]" = asyncio.Queue()
+
+        async def _runner() -> None:
+            try:
+                with activate(parent_span), recording(ledger):
+                    await ScienceEducationService._run_pipeline(request, queue.put_nowait)
+            finally:
+                queue.put_nowait(_PIPELINE_END)
+
+        task = asyncio.create_task(_runner())
+        try:
+            while True:
+                event = await queue.get()
+                if event is _PIPELINE_END:
+                    break
+                yield event
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+    @staticmethod
+    async def _run_pipeline(
+        request: ScienceEducationRequest,
+        emit: Callable[[Dict[str, Any]], None],
+    ) -> None:
+        """Run the planner → search → generation pipeline, emitting SSE events."""
         state = AgentState(
             topic=request.topic.strip(),
             messages=request.history or [],
             model=request.model,
         )
 
+        def _queue_reporter(stage: str) -> QueueCallback:
+            return lambda position: emit({"event": "queue", "stage": stage, "position": position})
+
+        pipeline_span = current_span()
+        accumulated_search_results: List[dict] = []
+        search_task: Optional["asyncio.Task[None]"] = None
+        early_queries: List[str] = []
+        partial_blueprint: Dict[str, Any] = {}
+
+        async def _search(queries: List[str]) -> None:
+            # 检索可能在策划解码途中启动，显式挂到流水线下而不是当前的策划 span
+            with span("search", parent=pipeline_span, queries=len(queries)):
+                async for result in TailiySearchTool.search_many(queries):
+                    state.search_attempts += 1
+                    accumulated_search_results.append(result)
+                    emit({
+                        "event": "search",
+                        "query": result.get("query"),
+                        "result": result,
+                    })
+
+        def _discard_early_search(queries: List[str]) -> None:
+            # 提前检索的结果可能已推送给客户端，通知其清空检索面板，之后只会收到 queries 的结果
+            search_task.cancel()
+            accumulated_search_results.clear()
+            emit({"event": "search_reset", "queries": queries})
+
+        def _member_reporter(step: str) -> Callable[[str, Any], None]:
+            def _report(key: str, value: Any) -> None:
+                nonlocal search_task
+                emit({"event": "planner_partial", "step": step, "key": key, "value": value})
+                if step != "initial":
+                    return
+                partial_blueprint[key] = value
+                # search_queries 一闭合就启动检索，与策划剩余部分的解码重叠
+                if key == "search_queries" and search_task is None and partial_blueprint.get("need_search", True):
+                    queries = _clean_queries(value)[:3]
+                    if queries:
+                        early_queries.extend(queries)
+                        search_task = asyncio.create_task(_search(queries))
+            return _report
+
         try:
-            planner_result = await ScienceEducationService._run_planner(state)
-        except Exception as exc:
-            logger.exception("策划代理执行失败: %s", exc)
-            yield {"event": "error", "message": f"策划代理执行失败: {exc}"}
-            return
+            try:
+                planner_result = await ScienceEducationService._run_planner(
+                    state,
+                    priority=request.priority,
+                    on_queued=_queue_reporter("planner"),
+                    on_member=_member_reporter("initial"),
+                )
+            except Exception as exc:
+                logger.exception("策划代理执行失败: %s", exc)
+                ERRORS.inc("planner")
+                emit({"event": "error", "message": f"策划代理执行失败: {exc}"})
+                return
 
-        yield {
-            "event": "planner",
-            "step": "initial",
-            "parsed": planner_result["parsed"],
-            "raw": planner_result["raw"],
-        }
+            emit({
+                "event": "planner",
+                "step": "initial",
+                "parsed": planner_result["parsed"],
+                "raw": planner_result["raw"],
+            })
+
+            if state.need_search and state.search_queries:
+                queries = state.search_queries[:3]
+                if search_task is None or early_queries != queries:
+                    if search_task is not None:
+                        _discard_early_search(queries)
+                    search_task = asyncio.create_task(_search(queries))
+                await search_task
+                # 检索结果按完成顺序推送；写入提示词前恢复查询顺序，相同输入得到相同的提示词
+                order = {query: index for index, query in enumerate(queries)}
+                accumulated_search_results.sort(key=lambda result: order.get(result.get("query"), len(order)))
+            elif search_task is not None:
+                # 最终蓝图不需要检索，丢弃提前启动的检索
+                _discard_early_search([])
+        finally:
+            if search_task is not None and not search_task.done():
+                search_task.cancel()
 
-        accumulated_search_results: List[dict] = []
         final_planner = planner_result["parsed"]
 
+        context_results = accumulated_search_results
         if state.need_search and state.search_queries:
-            for query in state.search_queries[:3]:
-                state.search_attempts += 1
-                result = await TailiySearchTool.search(query)
-                accumulated_search_results.append(result)
-                yield {
-                    "event": "search",
-                    "query": query,
-                    "result": result,
-                }
-
             state.search_results = accumulated_search_results
+            if config.search_rank_enabled:
+                with span("rank"):
+                    context_results = rank_search_results(state.topic or "", accumulated_search_results)
 
             try:
                 planner_result = await ScienceEducationService._run_planner(
                     state,
-                    search_results=accumulated_search_results,
+                    search_results=context_results,
+                    priority=request.priority,
+                    on_queued=_queue_reporter("planner"),
+                    on_member=_member_reporter("refined"),
                 )
             except Exception as exc:
                 logger.exception("带检索的策划执行失败: %s", exc)
-                yield {"event": "error", "message": f"策划代理执行失败: {exc}"}
+                ERRORS.inc("planner")
+                emit({"event": "error", "message": f"策划代理执行失败: {exc}"})
                 return
 
             final_planner = planner_result["parsed"]
             final_planner["need_search"] = False
 
-            yield {
+            emit({
                 "event": "planner",
                 "step": "refined",
                 "parsed": final_planner,
                 "raw": planner_result["raw"],
-            }
+            })
 
-        accumulated_html_parts: List[str] = []
         try:
-            async for gen_event in SciencePageGenerator.stream_generate(
-                topic=state.topic or "",
-                planner_payload=final_planner,
-                search_results=accumulated_search_results,
-                history=state.messages,
-                model=state.model,
-            ):
-                event_type = gen_event.get("type")
-                content = gen_event.get("content") if isinstance(gen_event, dict) else None
-
-                if event_type == "delta" and content:
-                    accumulated_html_parts.append(content)
-                    yield {
-                        "event": "generation",
-                        "delta": content,
-                    }
-                elif event_type == "final":
-                    html = content or "".join(accumulated_html_parts)
-                    state.generated_html = html
-                    yield {
-                        "event": "generation",
-                        "html": html,
-                        "planner_output": final_planner,
-                        "planner_output_raw": state.planner_output_raw,
-                        "search_results": accumulated_search_results,
-                        "final": True,
-                    }
+            with span("generation"):
+                async for gen_event in SciencePageGenerator.stream_generate(
+                    topic=state.topic or "",
+                    planner_payload=final_planner,
+                    search_results=context_results,
+                    history=state.messages,
+                    model=state.model,
+                    priority=request.priority,
+                    on_queued=_queue_reporter("generation"),
+                ):
+                    event_type = gen_event.get("type")
+                    content = gen_event.get("content") if isinstance(gen_event, dict) else None
+
+                    if event_type == "delta" and content:
+                        emit({
+                            "event": "generation",
+                            "delta": content,
+                        })
+                    elif event_type == "final":
+                        # 生成代理已增量提取 HTML，这里不再另存一份
+                        html = content or ""
+                        state.generated_html = html
+                        with span("artifact"):
+                            artifact = artifact_store.put(html) if html else None
+                        emit({
+                            "event": "generation",
+                            "html": html,
+                            "artifact": artifact,
+                            "planner_output": final_planner,
+                            "planner_output_raw": state.planner_output_raw,
+                            "search_results": accumulated_search_results,
+                            "final": True,
+                        })
         except Exception as exc:
             logger.exception("网页生成失败: %s", exc)
-            yield {"event": "error", "message": f"网页生成失败: {exc}"}
+            ERRORS.inc("generation")
+            emit({"event": "error", "message": f"网页生成失败: {exc}"})
             return
 
-        yield {"event": "done"}
+        emit({"event": "done"})
 
     @staticmethod
     async def generate_science_page(
@@ -0,0 +1,134 @@
+"""
+Server-side conversation sessions with compact history.
+"""
+from __future__ import annotations
+
+import re
+import secrets
+import time
+from typing import Any, Dict, List, Optional
+
+from .artifacts import artifact_store
+from .cache import LRUCache
+from .config import config
+from .logging_config import get_logger
+from .usage import empty_totals, merge_totals
+
+
+logger = get_logger(__name__)
+
+_TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+# 只在页面开头查找 <title>，避免扫描整页
+_TITLE_SCAN_CHARS = 4096
+# 超过该长度且形似 HTML 的助手消息会被替换为引用
+_INLINE_PAGE_CHARS = 1000
+
+
+def _page_title(html: str, topic: Optional[str] = None) -> str:
+    match = _TITLE_RE.search(html, 0, _TITLE_SCAN_CHARS)
+    return " ".join(match.group(1).split()) if match else (topic or "")
+
+
+def page_reference(html: str, artifact: Optional[Dict[str, Any]] = None, topic: Optional[str] = None) -> Dict[str, Any]:
+    """Replace a generated page with a short assistant turn that points at its stored artifact."""
+    artifact = artifact_store.put(html, artifact)
+    title = _page_title(html, topic)
+    content = f"[已生成科普网页《{title}》，artifact_id={artifact['id']}，{artifact['length']} 字节；完整 HTML 已省略]"
+    return {"role": "assistant", "content": content, "artifact_id": artifact["id"]}
+
+
+def compact_history(history: Optional[List[dict]]) -> List[dict]:
+    """Copy client-sent history, replacing full HTML pages from earlier turns with a short note.
+
+    The pages come from the client, so they are never put into the artifact
+    store (which is served from this origin); the note carries no artifact id.
+    """
+    compacted: List[dict] = []
+    for message in history or []:
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+        if (
+            message.get("role") == "assistant"
+            and isinstance(content, str)
+            and len(content) > _INLINE_PAGE_CHARS
+            and "<html" in content[:_TITLE_SCAN_CHARS].lower()
+        ):
+            title = _page_title(content)
+            compacted.append({
+                "role": "assistant",
+                "content": f"[已生成科普网页《{title}》，{len(content.encode('utf-8'))} 字节；完整 HTML 已省略]",
+            })
+        else:
+            compacted.append(message)
+    return compacted
+
+
+class Session:
+    """One conversation: a rolling summary, the compact turns after it and cumulative token usage.
+
+    ``offset`` is the absolute index of ``turns[0]`` in the conversation;
+    ``summary`` covers every turn before it (empty when none were folded).
+    """
+
+    __slots__ = ("id", "turns", "offset", "summary", "usage", "created_at", "updated_at")
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.turns: List[dict] = []
+        self.offset = 0
+        self.summary = ""
+        self.usage: Dict[str, Any] = empty_totals()
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+
+class SessionStore:
+    """Bounded in-memory session store (LRU + idle TTL)."""
+
+    def __init__(self, max_sessions: int, ttl: float, max_turns: int):
+        self.max_turns = max(2, max_turns)
+        self._sessions = LRUCache(max_entries=max_sessions, ttl=ttl)
+
+    def resolve(self, session_id: Optional[str]) -> Session:
+        """Return the session for ``session_id``, or a new one if it is missing or expired."""
+        if session_id:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                return session
+            logger.info("会话不存在或已过期，创建新会话: session_id=%s", session_id[:8])
+
+        session = Session(secrets.token_urlsafe(16))
+        self._sessions.set(session.id, session)
+        return session
+
+    def record_turn(self, session: Session, topic: str, html: str, artifact: Optional[Dict[str, Any]]) -> None:
+        """Append a user topic and the compact reference to the page generated for it."""
+        session.turns.append({"role": "user", "content": topic})
+        session.turns.append(page_reference(html, artifact, topic))
+        if len(session.turns) > self.max_turns:
+            # 正常情况下旧轮次已由 HistoryCompactor 并入会话摘要；摘要关闭或失败时才会走到这里
+            dropped = len(session.turns) - self.max_turns
+            del session.turns[:dropped]
+            session.offset += dropped
+            logger.warning(
+                "会话历史超过上限，丢弃最早 %s 条未摘要的消息: session_id=%s",
+                dropped,
+                session.id[:8],
+            )
+        session.updated_at = time.time()
+        # 重新写入以刷新空闲过期时间
+        self._sessions.set(session.id, session)
+
+    def record_usage(self, session: Session, totals: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a request's token totals to the session and return the session's running totals."""
+        merge_totals(session.usage, totals)
+        return dict(session.usage)
+
+
+# Global session store
+session_store = SessionStore(
+    max_sessions=config.session_max_entries,
+    ttl=config.session_ttl,
+    max_turns=config.session_max_turns,
+)
@@ -0,0 +1,152 @@
+"""
+Server-Sent Events framing with delta coalescing.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional, Union
+
+from .config import config
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+# 预编码帧：流结束标记与生成增量的固定前后缀
+DONE_FRAME = b'data: {"event": "[DONE]"}\n\n'
+_DELTA_PREFIX = b'data: {"event": "generation", "delta": '
+_FRAME_SUFFIX = b"}\n\n"
+
+Event = Union[Dict[str, Any], bytes]
+
+
+class FlushPolicy:
+    """How long / how much delta text may be held back before a frame is written."""
+
+    __slots__ = ("name", "window", "max_chars")
+
+    def __init__(self, name: str, window: float, max_chars: int):
+        self.name = name
+        self.window = max(0.0, window)
+        self.max_chars = max(1, max_chars)
+
+    @classmethod
+    def resolve(cls, name: Optional[str] = None) -> "FlushPolicy":
+        """Return the configured policy for ``name``, falling back to the default."""
+        key = (name or config.sse_flush_policy).strip().lower()
+        settings = config.sse_flush_policies.get(key)
+        if settings is None:
+            if name:
+                logger.warning("未知的 SSE 合帧策略: %s，使用默认策略 %s", name, config.sse_flush_policy)
+            key = config.sse_flush_policy
+            settings = config.sse_flush_policies.get(key) or config.sse_flush_policies["latency"]
+        return cls(key, settings["window"], settings["max_chars"])
+
+
+def encode_event(event: Dict[str, Any]) -> bytes:
+    """Encode one event as a ``data:`` frame."""
+    return b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+def encode_delta(text: str) -> bytes:
+    """Encode a generation delta without building an event dict."""
+    return _DELTA_PREFIX + json.dumps(text, ensure_ascii=False).encode("utf-8") + _FRAME_SUFFIX
+
+
+def _is_delta(event: Dict[str, Any]) -> bool:
+    return event.get("event") == "generation" and len(event) == 2 and isinstance(event.get("delta"), str)
+
+
+class SSEEncoder:
+    """Turns an event stream into SSE bytes, merging consecutive generation deltas.
+
+    Deltas are held for at most ``policy.window`` seconds or until
+    ``policy.max_chars`` characters are pending, then written as one
+    ``generation`` delta frame. Any other event flushes pending deltas first
+    and is written immediately, so event order and semantics are unchanged.
+    ``bytes`` events are treated as already-encoded frames and passed through.
+    """
+
+    def __init__(self, policy: Optional[FlushPolicy] = None):
+        self.policy = policy or FlushPolicy.resolve()
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._deadline = 0.0
+        self.frames = 0
+        self.events = 0
+
+    def _take_pending(self) -> bytes:
+        if not self._pending:
+            return b""
+        text = self._pending[0] if len(self._pending) == 1 else "".join(self._pending)
+        self._pending = []
+        self._pending_chars = 0
+        self.frames += 1
+        return encode_delta(text)
+
+    def _push(self, event: Event) -> Optional[bytes]:
+        """Buffer an event; return bytes to write now, if any."""
+        self.events += 1
+        if isinstance(event, bytes):
+            self.frames += 1
+            return self._take_pending() + event
+
+        if _is_delta(event):
+            if not self._pending:
+                self._deadline = time.monotonic() + self.policy.window
+            self._pending.append(event["delta"])
+            self._pending_chars += len(event["delta"])
+            if self._pending_chars >= self.policy.max_chars or self.policy.window == 0:
+                return self._take_pending()
+            return None
+
+        self.frames += 1
+        return self._take_pending() + encode_event(event)
+
+    async def encode(self, events: AsyncIterator[Event]) -> AsyncGenerator[bytes, None]:
+        """Yield SSE bytes for ``events``, ending with the ``[DONE]`` frame."""
+        iterator = events.__aiter__()
+        next_event: Optional["asyncio.Future[Event]"] = None
+        try:
+            while True:
+                if next_event is None and not self._pending:
+                    # 没有待写缓冲时无需计时，直接等待上游，免去每个增量一次 Task 的开销
+                    try:
+                        event = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    if next_event is None:
+                        next_event = asyncio.ensure_future(iterator.__anext__())
+                    # 用 wait 而非 wait_for：窗口到期时只写出缓冲，不取消上游的 anext
+                    timeout = max(0.0, self._deadline - time.monotonic()) if self._pending else None
+                    done, _ = await asyncio.wait((next_event,), timeout=timeout)
+                    if not done:
+                        yield self._take_pending()
+                        continue
+
+                    finished, next_event = next_event, None
+                    try:
+                        event = finished.result()
+                    except StopAsyncIteration:
+                        break
+
+                data = self._push(event)
+                if data:
+                    yield data
+        finally:
+            if next_event is not None and not next_event.done():
+                next_event.cancel()
+                try:
+                    await next_event
+                except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                    pass
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        yield self._take_pending() + DONE_FRAME
+        self.frames += 1
+        logger.debug("SSE 输出完成: policy=%s events=%s frames=%s", self.policy.name, self.events, self.frames)
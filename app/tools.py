@@ -3,12 +3,18 @@ Utility tools for planner agents, including Tailiy web search integration.
 """
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence
 
 import httpx
 
+from .cache import search_cache
 from .config import config
 from .logging_config import get_logger
+from .metrics import CACHE_LOOKUPS, ERRORS, SEARCH_QUERY_SECONDS
+from .tracing import span
+from .transport import http_transport
 
 
 logger = get_logger(__name__)
@@ -19,6 +25,9 @@ class TailiySearchTool:
 
     DEFAULT_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
 
+    # 后台刷新任务，按缓存键去重并持有引用防止被回收
+    _refresh_tasks: Dict[str, "asyncio.Task[None]"] = {}
+
     @classmethod
     async def search(
         cls,
@@ -36,6 +45,113 @@ class TailiySearchTool:
                 "results": [],
             }
 
+        url = config.tailiy_api_url.strip()
+        if not url.startswith(("http://", "https://")):
+            logger.error("Tailiy API URL 缺少协议或格式错误: %s", config.tailiy_api_url)
+            return {
+                "query": query,
+                "error": "Tailiy API URL 配置错误，缺少协议",
+                "results": [],
+            }
+
+        cache_key = search_cache.key_for(query, max_results)
+        cached = await search_cache.get(cache_key)
+        CACHE_LOOKUPS.inc("search", "miss" if cached is None else "hit")
+        if cached is not None:
+            result, fresh = cached
+            if not fresh:
+                cls._schedule_refresh(cache_key, url, query, max_results)
+            return {**result, "query": query}
+
+        result = await cls._fetch(url, query, max_results)
+        await search_cache.set(cache_key, result)
+        return result
+
+    @classmethod
+    async def search_many(
+        cls,
+        queries: Sequence[str],
+        max_results: int = 5,
+        concurrency: Optional[int] = None,
+        query_timeout: Optional[float] = None,
+        stage_budget: Optional[float] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Run searches concurrently and yield each result as soon as it completes.
+
+        Queries that exceed ``query_timeout`` yield an error result; once
+        ``stage_budget`` is spent the remaining queries are cancelled and
+        dropped so the pipeline can continue with what has arrived.
+        """
+        concurrency = concurrency or config.search_concurrency
+        query_timeout = query_timeout or config.search_query_timeout
+        stage_budget = stage_budget or config.search_stage_budget
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def _run(query: str) -> Dict[str, Any]:
+            async with semaphore:
+                started = time.perf_counter()
+                with span("query", query=query) as query_span:
+                    try:
+                        result = await asyncio.wait_for(cls.search(query, max_results), timeout=query_timeout)
+                        outcome = "error" if result.get("error") else "ok"
+                    except asyncio.TimeoutError:
+                        logger.warning("Tailiy 检索超时: query=%s timeout=%ss", query, query_timeout)
+                        result = {"query": query, "error": f"检索超时（{query_timeout:g}s）", "results": []}
+                        outcome = "timeout"
+                    query_span.annotate(outcome=outcome)
+                SEARCH_QUERY_SECONDS.observe(time.perf_counter() - started, outcome)
+                if outcome != "ok":
+                    ERRORS.inc("search")
+                return result
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + stage_budget
+        pending = {asyncio.create_task(_run(query)) for query in queries}
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    logger.warning("检索阶段超出预算 %ss，放弃 %s 个未完成查询", stage_budget, len(pending))
+                    break
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @classmethod
+    def _schedule_refresh(cls, cache_key: str, url: str, query: str, max_results: int) -> None:
+        """Refresh a stale cache entry in the background (stale-while-revalidate)."""
+        if cache_key in cls._refresh_tasks:
+            return
+
+        async def _refresh() -> None:
+            try:
+                result = await cls._fetch(url, query, max_results)
+                if result.get("error"):
+                    logger.warning("检索缓存后台刷新失败: query=%s error=%s", query, result["error"])
+                    search_cache.defer_refresh(cache_key)
+                else:
+                    await search_cache.set(cache_key, result)
+            except Exception as exc:
+                logger.exception("检索缓存后台刷新异常: %s", exc)
+                search_cache.defer_refresh(cache_key)
+            finally:
+                cls._refresh_tasks.pop(cache_key, None)
+
+        cls._refresh_tasks[cache_key] = asyncio.create_task(_refresh())
+
+    @classmethod
+    async def _fetch(
+        cls,
+        url: str,
+        query: str,
+        max_results: int,
+    ) -> Dict[str, Any]:
+        """Call the Tailiy API and normalize its response."""
         payload = {
             "query": query.strip(),
             "max_results": max_results,
@@ -48,35 +164,27 @@ class TailiySearchTool:
             "Accept": "application/json",
         }
 
-        url = config.tailiy_api_url.strip()
-        if not url.startswith(("http://", "https://")):
-            logger.error("Tailiy API URL 缺少协议或格式错误: %s", config.tailiy_api_url)
+        client = http_transport.get_client("search")
+        try:
+            response = await client.post(
+                url,
+                json=payload,
+                headers=headers,
+                timeout=cls.DEFAULT_TIMEOUT,
+            )
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
             return {
                 "query": query,
-                "error": "Tailiy API URL 配置错误，缺少协议",
+                "error": f"Tailiy API 响应异常: {exc.response.status_code}",
+                "results": [],
+            }
+        except httpx.RequestError as exc:
+            return {
+                "query": query,
+                "error": f"Tailiy API 请求失败: {exc}",
                 "results": [],
             }
-
-        async with httpx.AsyncClient(timeout=cls.DEFAULT_TIMEOUT) as client:
-            try:
-                response = await client.post(
-                    url,
-                    json=payload,
-                    headers=headers,
-                )
-                response.raise_for_status()
-            except httpx.HTTPStatusError as exc:
-                return {
-                    "query": query,
-                    "error": f"Tailiy API 响应异常: {exc.response.status_code}",
-                    "results": [],
-                }
-            except httpx.RequestError as exc:
-                return {
-                    "query": query,
-                    "error": f"Tailiy API 请求失败: {exc}",
-                    "results": [],
-                }
 
         try:
             payload = response.json()
@@ -0,0 +1,181 @@
+"""
+Per-request span trees with monotonic timings.
+"""
+from __future__ import annotations
+
+import json
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from .logging_config import get_logger, request_id_var
+
+
+logger = get_logger(__name__)
+
+# 当前活动 span；只在协程 / 任务内设置，异步生成器跨 yield 的阶段使用 start_span()/finish()
+_active_span: ContextVar[Optional["Span"]] = ContextVar("baize_active_span", default=None)
+
+_REQUEST_ID_MAX_CHARS = 64
+# 外部传入的请求 ID 只保留安全字符，避免注入日志或响应头
+_REQUEST_ID_RE = re.compile(r"[^A-Za-z0-9._:-]")
+
+
+def normalize_request_id(value: Optional[str]) -> str:
+    """Sanitize a client-supplied request ID, generating one if nothing usable remains."""
+    cleaned = _REQUEST_ID_RE.sub("", value or "")[:_REQUEST_ID_MAX_CHARS]
+    return cleaned or secrets.token_hex(8)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 1)
+
+
+class Span:
+    """A timed step; children are attached in start order."""
+
+    __slots__ = ("name", "start", "end", "attrs", "children")
+
+    def __init__(self, name: str, start: Optional[float] = None, **attrs: Any):
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+        self.attrs: Dict[str, Any] = attrs
+        self.children: List[Span] = []
+
+    def child(self, name: str, start: Optional[float] = None, **attrs: Any) -> "Span":
+        """Start a child span without making it the active one."""
+        span = Span(name, start, **attrs)
+        self.children.append(span)
+        return span
+
+    def annotate(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self, end: Optional[float] = None, **attrs: Any) -> None:
+        if attrs:
+            self.attrs.update(attrs)
+        if self.end is None:
+            self.end = time.perf_counter() if end is None else end
+
+    def to_dict(self, origin: float, now: float) -> Dict[str, Any]:
+        node: Dict[str, Any] = {
+            "name": self.name,
+            "start_ms": _ms(self.start - origin),
+            "duration_ms": _ms((self.end if self.end is not None else now) - self.start),
+        }
+        if self.end is None:
+            node["open"] = True
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [child.to_dict(origin, now) for child in self.children]
+        return node
+
+
+class Trace:
+    """Span tree for one request, identified by ``request_id``."""
+
+    def __init__(self, request_id: Optional[str] = None, started_at: Optional[float] = None):
+        self.request_id = normalize_request_id(request_id or request_id_var.get())
+        self.root = Span("request", started_at)
+        self._logged = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.perf_counter()
+        end = self.root.end if self.root.end is not None else now
+        return {
+            "request_id": self.request_id,
+            "total_ms": _ms(end - self.root.start),
+            "spans": self.root.to_dict(self.root.start, now),
+        }
+
+    def log(self) -> None:
+        """Write the span tree as one structured log line (once per trace)."""
+        if self._logged:
+            return
+        self._logged = True
+        payload = self.to_dict()
+        logger.info(
+            "请求耗时: request_id=%s total_ms=%s trace=%s",
+            self.request_id,
+            payload["total_ms"],
+            json.dumps(payload["spans"], ensure_ascii=False, separators=(",", ":"), default=str),
+        )
+
+
+def current_span() -> Optional[Span]:
+    return _active_span.get()
+
+
+def start_span(name: str, start: Optional[float] = None, **attrs: Any) -> Span:
+    """Start a child of the active span without activating it; detached outside a trace."""
+    parent = _active_span.get()
+    if parent is None:
+        return Span(name, start, **attrs)
+    return parent.child(name, start, **attrs)
+
+
+@contextmanager
+def activate(span: Optional[Span]) -> Iterator[Optional[Span]]:
+    """Make ``span`` the parent of spans opened in this context (and tasks created from it)."""
+    token = _active_span.set(span)
+    try:
+        yield span
+    finally:
+        _active_span.reset(token)
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attrs: Any) -> Iterator[Span]:
+    """Time a block as a child of ``parent`` or the active span.
+
+    Outside a trace the yielded span is detached and nothing is recorded.
+    Do not hold this across ``yield`` in an async generator; use
+    ``start_span`` and ``Span.finish`` there instead.
+    """
+    parent = parent or _active_span.get()
+    if parent is None:
+        yield Span(name, **attrs)
+        return
+    child = parent.child(name, **attrs)
+    token = _active_span.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.annotate(error=type(exc).__name__)
+        raise
+    finally:
+        child.finish()
+        _active_span.reset(token)
+
+
+class RequestContextMiddleware:
+    """ASGI middleware stamping each HTTP request with its arrival time and request ID.
+
+    Runs before the body is read. The request ID (``X-Request-ID`` or a
+    generated one) is bound in the request task's context, so every log
+    record emitted while serving the request, including from tasks it
+    spawns, carries it.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] == "http":
+            state = scope.setdefault("state", {})
+            state["received_at"] = time.perf_counter()
+            header = next((value for name, value in scope.get("headers", ()) if name == b"x-request-id"), b"")
+            state["request_id"] = normalize_request_id(header.decode("latin-1"))
+            # 流式响应在 app 返回前已全部发送完毕，返回后即可解绑
+            token = request_id_var.set(state["request_id"])
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                request_id_var.reset(token)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,98 @@
+"""
+Shared, pooled HTTP transport for upstream APIs (LLM providers, Tailiy search).
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+import httpx
+
+from .cassettes import MODES as CASSETTE_MODES, CassetteTransport
+from .config import config
+from .logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+class HTTPTransport:
+    """Application-lifespan pool of keep-alive ``httpx.AsyncClient`` objects, one per upstream."""
+
+    DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+    def __init__(self, upstreams: Dict[str, dict]):
+        self.upstreams = upstreams
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get_client(self, upstream: str) -> httpx.AsyncClient:
+        """Return the pooled client for an upstream, creating it on first use."""
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = self._build_client(upstream)
+            self._clients[upstream] = client
+        return client
+
+    def _build_client(self, upstream: str) -> httpx.AsyncClient:
+        settings = self.upstreams.get(upstream, {})
+        limits = httpx.Limits(
+            max_connections=settings.get("max_connections", 100),
+            max_keepalive_connections=settings.get("max_keepalive_connections", 20),
+            keepalive_expiry=settings.get("keepalive_expiry", 30.0),
+        )
+
+        http2 = bool(settings.get("http2"))
+        if http2 and not _HTTP2_AVAILABLE:
+            logger.warning("上游 %s 已启用 HTTP/2，但未安装 h2，回退到 HTTP/1.1（pip install httpx[http2]）", upstream)
+            http2 = False
+
+        logger.info(
+            "创建 HTTP 连接池: upstream=%s max_connections=%s keepalive=%s expiry=%ss http2=%s",
+            upstream,
+            limits.max_connections,
+            limits.max_keepalive_connections,
+            limits.keepalive_expiry,
+            http2,
+        )
+        transport = None
+        if config.cassette_mode not in CASSETTE_MODES:
+            logger.warning("未知的 CASSETTE_MODE=%s，已忽略", config.cassette_mode)
+        elif config.cassette_mode != "off":
+            logger.info(
+                "上游 %s 使用磁带: mode=%s dir=%s speed=%s",
+                upstream,
+                config.cassette_mode,
+                config.cassette_dir,
+                config.cassette_speed,
+            )
+            transport = CassetteTransport(
+                httpx.AsyncHTTPTransport(limits=limits, http2=http2),
+                upstream,
+                mode=config.cassette_mode,
+                directory=config.cassette_dir,
+                speed=config.cassette_speed,
+            )
+        return httpx.AsyncClient(limits=limits, timeout=self.DEFAULT_TIMEOUT, http2=http2, transport=transport)
+
+    async def startup(self) -> None:
+        """Open pools for every configured upstream."""
+        for upstream in self.upstreams:
+            self.get_client(upstream)
+
+    async def shutdown(self) -> None:
+        """Close all pooled connections."""
+        clients, self._clients = self._clients, {}
+        for upstream, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as exc:
+                logger.warning("关闭 HTTP 连接池失败: upstream=%s error=%s", upstream, exc)
+
+
+# Global transport
+http_transport = HTTPTransport(config.http_upstreams)
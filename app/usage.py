@@ -0,0 +1,180 @@
+"""
+Token usage and cost accounting for LLM calls.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from .config import config
+from .context import estimate_tokens
+from .logging_config import get_logger
+from .metrics import LLM_CALLS, LLM_COST, LLM_TOKENS, model_label
+
+
+logger = get_logger(__name__)
+
+# 当前请求的用量账本；在流水线任务内激活，由代理层在每次模型调用结束时记账
+_active_ledger: ContextVar[Optional["UsageLedger"]] = ContextVar("baize_usage_ledger", default=None)
+
+_TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+class TokenUsage:
+    """Token counts of one call; ``cached_tokens`` is the cached part of ``prompt_tokens``."""
+
+    __slots__ = ("prompt_tokens", "completion_tokens", "cached_tokens", "estimated")
+
+    def __init__(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, estimated: bool = False):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = min(cached_tokens, prompt_tokens)
+        self.estimated = estimated
+
+
+def from_openai(usage: Any) -> Optional[TokenUsage]:
+    """Read an OpenAI-compatible ``usage`` object (or dict)."""
+    if usage is None:
+        return None
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached is None:
+        # DeepSeek 等兼容接口使用独立字段报告缓存命中
+        cached = _field(usage, "prompt_cache_hit_tokens")
+    return TokenUsage(
+        int(_field(usage, "prompt_tokens") or 0),
+        int(_field(usage, "completion_tokens") or 0),
+        int(cached or 0),
+    )
+
+
+def from_gemini(metadata: Any) -> Optional[TokenUsage]:
+    """Read Gemini ``usage_metadata``; thinking tokens are billed as output."""
+    if metadata is None or _field(metadata, "prompt_token_count") is None:
+        return None
+    return TokenUsage(
+        int(_field(metadata, "prompt_token_count") or 0),
+        int(_field(metadata, "candidates_token_count") or 0) + int(_field(metadata, "thoughts_token_count") or 0),
+        int(_field(metadata, "cached_content_token_count") or 0),
+    )
+
+
+def estimate_usage(prompt: Union[str, List[dict]], completion: str) -> TokenUsage:
+    """Estimate usage locally when the provider reports none."""
+    if isinstance(prompt, list):
+        prompt = "\n".join(str(message.get("content") or "") for message in prompt)
+    return TokenUsage(estimate_tokens(prompt), estimate_tokens(completion), estimated=True)
+
+
+def price_for(model: str) -> Optional[Dict[str, float]]:
+    prices = config.llm_prices
+    return prices.get(model) or prices.get("*")
+
+
+def estimate_cost(model: str, usage: TokenUsage) -> Optional[float]:
+    """Cost of a call from the per-million-token price table, or None if the model is unpriced."""
+    price = price_for(model)
+    if not price:
+        return None
+    prompt_price = float(price.get("prompt", 0.0))
+    cached_price = float(price.get("cached_prompt", prompt_price))
+    completion_price = float(price.get("completion", 0.0))
+    uncached = usage.prompt_tokens - usage.cached_tokens
+    return (
+        uncached * prompt_price
+        + usage.cached_tokens * cached_price
+        + usage.completion_tokens * completion_price
+    ) / 1_000_000
+
+
+def empty_totals() -> Dict[str, Any]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost": None}
+
+
+def merge_totals(totals: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """Add ``other`` into ``totals`` in place; cost stays None until some call is priced."""
+    totals["calls"] += other["calls"]
+    for field in _TOKEN_FIELDS:
+        totals[field] += other[field]
+    if other["cost"] is not None:
+        totals["cost"] = (totals["cost"] or 0.0) + other["cost"]
+    return totals
+
+
+class UsageLedger:
+    """Token usage of the LLM calls made for one request."""
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+
+    def add(self, stage: str, model: str, usage: TokenUsage, cost: Optional[float]) -> None:
+        entry: Dict[str, Any] = {
+            "stage": stage,
+            "model": model,
+            "calls": 1,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": usage.cached_tokens,
+            "cost": cost,
+        }
+        if usage.estimated:
+            entry["estimated"] = True
+        self.calls.append(entry)
+
+    def totals(self) -> Dict[str, Any]:
+        totals = empty_totals()
+        for call in self.calls:
+            merge_totals(totals, call)
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals for the request, broken down by stage and by model."""
+        by_stage: Dict[str, Dict[str, Any]] = {}
+        by_model: Dict[str, Dict[str, Any]] = {}
+        for call in self.calls:
+            merge_totals(by_stage.setdefault(call["stage"], empty_totals()), call)
+            merge_totals(by_model.setdefault(call["model"], empty_totals()), call)
+        summary = {
+            **self.totals(),
+            "currency": config.llm_price_currency,
+            "by_stage": by_stage,
+            "by_model": by_model,
+        }
+        if any(call.get("estimated") for call in self.calls):
+            summary["estimated"] = True
+        return summary
+
+
+@contextmanager
+def recording(ledger: Optional[UsageLedger]) -> Iterator[Optional[UsageLedger]]:
+    """Charge LLM calls made in this context (and tasks created from it) to ``ledger``."""
+    token = _active_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _active_ledger.reset(token)
+
+
+def record_usage(stage: str, model: str, usage: TokenUsage) -> None:
+    """Account one finished call: process-wide counters plus the active request ledger."""
+    cost = estimate_cost(model, usage)
+    label = model_label(model)
+    LLM_CALLS.inc(label, stage)
+    LLM_TOKENS.inc(label, stage, "prompt", amount=usage.prompt_tokens)
+    LLM_TOKENS.inc(label, stage, "completion", amount=usage.completion_tokens)
+    if usage.cached_tokens:
+        LLM_TOKENS.inc(label, stage, "cached", amount=usage.cached_tokens)
+    if cost is not None:
+        LLM_COST.inc(label, amount=cost)
+
+    ledger = _active_ledger.get()
+    if ledger is not None:
+        ledger.add(stage, model, usage, cost)
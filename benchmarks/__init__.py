@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks for the CPU hot paths of the pipeline.
+"""
@@ -0,0 +1,327 @@
+"""
+Micro-benchmarks for the CPU work the pipeline does on the event loop per request.
+
+Usage:
+    python -m benchmarks.bench_hot_paths [--filter TEXT] [--save] [--compare] [--threshold 0.25]
+
+Cases cover planner JSON repair and parsing on clean and malformed
+blueprints, HTML extraction from 10-200 KB model outputs (whole and
+streamed), prompt payload serialization, search result ranking, the
+streaming planner parser and per-delta SSE encoding. Each case is timed as
+the median of several calibrated repeats, in CPU time of the benchmark thread.
+
+``--save`` writes the results to ``benchmarks/baseline.json`` (or
+``--baseline PATH``). ``--compare`` measures again and flags every case
+slower than the baseline by more than ``--threshold`` (relative), exiting
+non-zero if any regressed. Baselines are only comparable on the same
+machine and Python version; both are recorded in the file.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# 基准只测量计算本身：关闭 INFO 日志与文件日志，避免控制台输出混入计时
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_FILE", "")
+
+from benchmarks.bench_json_repair import load_corpus  # noqa: E402
+
+from app.agents import _normalize_model_output  # noqa: E402
+from app.context import build_user_prompt  # noqa: E402
+from app.html_stream import IncrementalHTMLExtractor  # noqa: E402
+from app.json_repair import parse_json_object  # noqa: E402
+from app.json_stream import IncrementalJSONObjectParser  # noqa: E402
+from app.search_rank import rank_search_results  # noqa: E402
+from app.services import _parse_planner_output  # noqa: E402
+from app.sse import FlushPolicy, SSEEncoder, encode_delta, encode_event  # noqa: E402
+
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# 流式增量的典型大小（字符）
+DELTA_CHARS = 24
+# 只计本线程的 CPU 时间，不受宿主机争用与其他线程（如日志线程）影响
+_clock = time.thread_time
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def _chunks(text: str, size: int) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _malformed(text: str) -> str:
+    """Damage a clean blueprint the way models do: fence, inner quotes, trailing commas, cut-off tail."""
+    damaged = text.replace("“", '"').replace("”", '"')
+    damaged = damaged.replace("血月之谜", '"血月"之谜').replace('"瑞利散射",', '"瑞利"散射"",')
+    damaged = damaged.replace("]\n    }", "],\n    }")
+    return f"```json\n{damaged[: int(len(damaged) * 0.9)]}"
+
+
+def _html_output(kilobytes: int) -> str:
+    section = (
+        '<section class="card"><h2>月食的成因</h2><p>当地球运行到太阳与月球之间，'
+        "地球的影子落在月面上，这就是月食。</p></section>\n"
+    )
+    body = section * max(1, kilobytes * 1024 // len(section.encode("utf-8")))
+    return (
+        "好的，下面是完整的网页代码：\n```html\n<!DOCTYPE html>\n<html lang=\"zh-CN\">\n"
+        f"<head><meta charset=\"utf-8\"><title>月食</title></head>\n<body>\n{body}</body>\n</html>\n```\n"
+        "以上页面可直接在浏览器中打开。"
+    )
+
+
+_SUMMARY_PHRASES = (
+    "月全食时月亮呈暗红色", "地球大气对阳光的折射与散射", "地球影子分为本影和半影", "月食只发生在满月",
+    "月球轨道与黄道面有约五度的夹角", "古代天文学家据此预测交食", "日地月三者几乎排成一条直线",
+    "半影月食时月面亮度变化不明显", "一年中最多可能发生三次月食", "观测月食不需要任何防护设备",
+)
+
+
+def _summary(rng: random.Random, chars: int) -> str:
+    """Non-repeating summary text of about ``chars`` characters built from shuffled phrases."""
+    parts: List[str] = []
+    size = 0
+    while size < chars:
+        phrase = f"{rng.choice(_SUMMARY_PHRASES)}（{rng.randrange(10000)}），"
+        parts.append(phrase)
+        size += len(phrase)
+    return "".join(parts)[:chars]
+
+
+def _search_results(queries: int = 3, per_query: int = 5, summary_chars: int = 600) -> List[dict]:
+    """Search blocks shaped like Tailiy responses: distinct summaries of ``summary_chars`` characters,
+    with a few URLs repeated across queries and one mirrored summary, as real result sets have."""
+    rng = random.Random(summary_chars)
+    blocks = []
+    mirrored = ""
+    for q in range(queries):
+        query = f"月食 查询 {q}"
+        results = []
+        for i in range(per_query):
+            summary = _summary(rng, summary_chars)
+            if q == 0 and i == 0:
+                mirrored = summary
+            elif q == 1 and i == 0:
+                summary = mirrored
+            item = {
+                "title": f"月食知识 {q}-{i}",
+                # 每个查询的最后一条与上一查询重复
+                "url": f"https://example.com/moon/{q - 1 if q and i == per_query - 1 else q}/{i}",
+                "summary": summary,
+                "content": [_summary(rng, 80), _summary(rng, 80)],
+            }
+            results.append({
+                "title": item["title"],
+                "summary": item["summary"],
+                "highlights": item["content"],
+                "source_url": item["url"],
+                "raw": item,
+            })
+        blocks.append({"query": query, "results": results, "raw": {"results": [r["raw"] for r in results]}})
+    return blocks
+
+
+def build_cases() -> List[Case]:
+    cases: List[Case] = []
+    corpus = dict(load_corpus())
+    blueprint_text = corpus["full_blueprint"]
+    blueprint = json.loads(blueprint_text)
+    planner_samples = {
+        "clean": blueprint_text,
+        "malformed": _malformed(blueprint_text),
+        "small_inner_quotes": corpus["inner_quotes"],
+        "small_truncated": corpus["truncated"],
+    }
+
+    for name, text in planner_samples.items():
+        cases.append((f"json_repair/{name}", lambda text=text: parse_json_object(text)))
+    for name, text in planner_samples.items():
+        cases.append((f"planner_parse/{name}", lambda text=text: _parse_planner_output(text)))
+
+    deltas = _chunks(blueprint_text, DELTA_CHARS)
+
+    def stream_planner() -> None:
+        parser = IncrementalJSONObjectParser()
+        for delta in deltas:
+            parser.feed(delta)
+
+    cases.append(("planner_stream/full_blueprint", stream_planner))
+
+    for kilobytes in (10, 50, 200):
+        output = _html_output(kilobytes)
+        cases.append((f"normalize_output/{kilobytes}kb", lambda output=output: _normalize_model_output(output)))
+    streamed = _chunks(_html_output(200), DELTA_CHARS)
+
+    def stream_html() -> None:
+        extractor = IncrementalHTMLExtractor()
+        for delta in streamed:
+            extractor.feed(delta)
+        extractor.result()
+
+    cases.append(("html_stream/200kb", stream_html))
+
+    search_results = _search_results()
+    ranked = rank_search_results("月食", search_results)
+    planner_payload = {"topic": "月食"}
+    generation_payload = {
+        "topic": "月食",
+        "blueprint": blueprint["page_blueprint"],
+        "json_prompt": blueprint["json_prompt"],
+        "knowledge_outline": blueprint["knowledge_outline"],
+    }
+    cases.append(("user_prompt/planner", lambda: build_user_prompt("planner", planner_payload, search_results)))
+    cases.append(("user_prompt/generation", lambda: build_user_prompt("generation", generation_payload, ranked)))
+    cases.append(("search_rank/3x5", lambda: rank_search_results("月食", search_results)))
+    long_results = _search_results(summary_chars=1000)
+    cases.append(("search_rank/3x5_1000chars", lambda: rank_search_results("月食", long_results)))
+
+    delta_text = "<p>月食发生在满月。</p>"
+    event = {"event": "planner_partial", "step": "final", "key": "knowledge_outline", "value": blueprint["knowledge_outline"]}
+    cases.append(("sse/encode_delta", lambda: encode_delta(delta_text)))
+    cases.append(("sse/encode_event", lambda: encode_event(event)))
+
+    html_deltas = [{"event": "generation", "delta": chunk} for chunk in streamed[:1000]]
+    policy = FlushPolicy.resolve("latency")
+
+    def coalesce_deltas() -> None:
+        # 只计 SSEEncoder 对每个增量的缓冲与合帧开销（不含事件循环调度）
+        encoder = SSEEncoder(policy)
+        for item in html_deltas:
+            encoder._push(item)
+        encoder._take_pending()
+
+    cases.append(("sse/coalesce_1000_deltas", coalesce_deltas))
+    return cases
+
+
+def calibrate(fn: Callable[[], object], min_time: float) -> int:
+    """Number of calls per timed sample so that one sample takes at least ``min_time``."""
+    fn()
+    number = 1
+    while True:
+        elapsed = _sample(fn, number) * number
+        if elapsed >= min_time:
+            return number
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+
+def _sample(fn: Callable[[], object], number: int) -> float:
+    start = _clock()
+    for _ in range(number):
+        fn()
+    return (_clock() - start) / number
+
+
+def run(cases: List[Case], repeat: int, min_time: float) -> Dict[str, float]:
+    """Median seconds per call of each case over ``repeat`` samples.
+
+    Time is the CPU time of this thread (``time.thread_time``): on shared or
+    virtualized hosts steal time and other processes made wall-clock
+    results of the same build differ by up to 2x. Samples are taken
+    round-robin across cases, so a slow phase of the host lasting a few
+    seconds costs every case one sample instead of skewing a single case.
+    The garbage collector is paused while sampling (as ``timeit`` does).
+    """
+    numbers = [calibrate(fn, min_time) for _, fn in cases]
+    samples: List[List[float]] = [[] for _ in cases]
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for index, (_, fn) in enumerate(cases):
+                samples[index].append(_sample(fn, numbers[index]))
+            gc.collect()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    results: Dict[str, float] = {}
+    print(f"{'case':<34}{'us/call':>12}")
+    for (name, _), case_samples in zip(cases, samples):
+        results[name] = statistics.median(case_samples)
+        print(f"{name:<34}{results[name] * 1e6:>12.2f}")
+    return results
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def save_baseline(path: Path, results: Dict[str, float]) -> None:
+    payload = {"environment": environment(), "seconds_per_call": results}
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    print(f"\nbaseline written to {path}")
+
+
+def compare(path: Path, results: Dict[str, float], threshold: float) -> List[str]:
+    """Print the change against the baseline; return the cases that regressed beyond ``threshold``."""
+    baseline = json.loads(path.read_text(encoding="utf-8"))
+    reference: Dict[str, float] = baseline.get("seconds_per_call", {})
+    recorded = baseline.get("environment", {})
+    current = environment()
+    if any(recorded.get(key) != current[key] for key in ("python", "implementation", "machine")):
+        print(f"\nwarning: baseline recorded on {recorded}, running on {current}")
+
+    print(f"\n{'case':<34}{'baseline':>12}{'current':>12}{'change':>10}")
+    regressions: List[str] = []
+    for name, seconds in results.items():
+        base: Optional[float] = reference.get(name)
+        if not base:
+            print(f"{name:<34}{'-':>12}{seconds * 1e6:>12.2f}{'new':>10}")
+            continue
+        change = seconds / base - 1.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<34}{base * 1e6:>12.2f}{seconds * 1e6:>12.2f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=11, help="timed repeats per case (the median is reported)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per timed repeat")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    mode.add_argument("--compare", action="store_true", help="compare against the baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    cases = [case for case in build_cases() if args.filter in case[0]]
+    results = run(cases, args.repeat, args.min_time)
+
+    if args.save:
+        if args.filter and args.baseline.exists():
+            # 只跑部分用例时合并到已有基线，保留其余用例
+            merged = json.loads(args.baseline.read_text(encoding="utf-8")).get("seconds_per_call", {})
+            results = {**merged, **results}
+        save_baseline(args.baseline, results)
+    elif args.compare:
+        regressions = compare(args.baseline, results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark for the planner JSON repair engine.
+
+Usage:
+    python benchmarks/bench_json_repair.py [--iterations N] [--scale]
+
+Runs every sample in ``benchmarks/corpus/planner`` through
+``parse_json_object`` and reports time per call and the repairs applied.
+``--scale`` additionally repeats a malformed blueprint at growing sizes to
+check that cost per byte stays flat (i.e. the repair pass is linear).
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.json_repair import parse_json_object  # noqa: E402
+
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus" / "planner"
+
+
+def _time_call(fn: Callable[[], object], iterations: int) -> float:
+    """Best-of-3 mean seconds per call."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best
+
+
+def load_corpus() -> List[Tuple[str, str]]:
+    return [(path.stem, path.read_text(encoding="utf-8")) for path in sorted(CORPUS_DIR.glob("*.txt"))]
+
+
+def bench_corpus(iterations: int) -> None:
+    print(f"{'sample':<20}{'bytes':>8}{'us/call':>12}  repairs")
+    for name, text in load_corpus():
+        repairs = parse_json_object(text).repairs
+        seconds = _time_call(lambda: parse_json_object(text), iterations)
+        print(f"{name:<20}{len(text.encode('utf-8')):>8}{seconds * 1e6:>12.1f}  {','.join(repairs) or '-'}")
+
+
+def _scaled_sample(copies: int) -> str:
+    item = (
+        '{"title": "什么是"血月"", "summary": "月全食时月面呈暗红色，俗称"血月"。\n'
+        '原因是地球大气的"瑞利散射"。", "key_points": ["地球影子", "大气折射",], "citations": []}'
+    )
+    outline = ",\n    ".join([item] * copies)
+    return f'```json\n{{\n  "need_search": false,\n  "knowledge_outline": [\n    {outline},\n  ],\n  "json_prompt": {{"audience": "小学'
+
+
+def bench_scale(iterations: int) -> None:
+    print()
+    print(f"{'copies':<10}{'bytes':>10}{'us/call':>12}{'ns/byte':>10}")
+    for copies in (1, 4, 16, 64, 256):
+        text = _scaled_sample(copies)
+        parse_json_object(text)
+        runs = max(1, iterations // copies)
+        seconds = _time_call(lambda: parse_json_object(text), runs)
+        size = len(text.encode("utf-8"))
+        print(f"{copies:<10}{size:>10}{seconds * 1e6:>12.1f}{seconds * 1e9 / size:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--scale", action="store_true", help="also check cost per byte at growing input sizes")
+    args = parser.parse_args()
+
+    bench_corpus(args.iterations)
+    if args.scale:
+        bench_scale(args.iterations)
+
+
+if __name__ == "__main__":
+    main()
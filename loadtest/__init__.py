@@ -0,0 +1,3 @@
+"""
+Offline load-test harness: fake LLM / search upstreams and an SSE load driver.
+"""
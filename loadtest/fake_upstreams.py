@@ -0,0 +1,242 @@
+"""
+Fake OpenAI-compatible and Tailiy upstreams for offline load tests.
+
+Usage:
+    python -m loadtest.fake_upstreams [--port 9100] [--ttft-ms 300] [--tokens-per-sec 80] ...
+
+Serves ``POST /v1/chat/completions`` (streaming and non-streaming) and
+``POST /search``. The planner gets a canned blueprint that asks for a web
+search on the first call and a final blueprint once search results are in
+the prompt; every other call gets a canned HTML page. Latency to the first
+token and per search are drawn from a log-normal distribution around the
+configured median, and tokens are paced at the configured rate.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+PLAN_SEARCH = {
+    "need_search": True,
+    "search_queries": ["原理", "观测方法", "常见误区"],
+    "knowledge_outline": [],
+    "page_blueprint": {"hero": {"headline": "负载测试"}},
+    "json_prompt": {},
+}
+PLAN_FINAL = {
+    "need_search": False,
+    "search_queries": [],
+    "knowledge_outline": [
+        {"title": f"要点 {i}", "summary": "用于负载测试的固定知识点摘要。" * 3, "key_points": ["甲", "乙", "丙"], "citations": []}
+        for i in range(1, 5)
+    ],
+    "page_blueprint": {
+        "hero": {"headline": "负载测试", "subheadline": "固定蓝图"},
+        "sections": [{"id": f"s{i}", "title": f"第 {i} 节", "layout": "cards"} for i in range(1, 5)],
+    },
+    "json_prompt": {"audience": "中学生", "tone": "生动"},
+}
+SUMMARY_TEXT = "用户此前询问了若干科学主题，助手均生成了对应的科普网页。"
+
+
+def _html_page(kilobytes: int) -> str:
+    section = "<section><h2>小节标题</h2><p>这是一段用于负载测试的固定网页内容，模拟真实生成的科普段落。</p></section>\n"
+    body = section * max(1, kilobytes * 1024 // len(section.encode("utf-8")))
+    return f"```html\n<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>负载测试</title></head>\n<body>\n{body}</body></html>\n```"
+
+
+@dataclass
+class Profile:
+    """Latency and size knobs of the fake upstreams."""
+
+    ttft_ms: float = 300.0
+    jitter: float = 0.5
+    tokens_per_sec: float = 80.0
+    chars_per_token: int = 4
+    search_ms: float = 150.0
+    page_kb: int = 8
+    error_rate: float = 0.0
+
+    def sample_delay(self, median_ms: float) -> float:
+        """Seconds drawn from a log-normal distribution with the given median."""
+        if median_ms <= 0:
+            return 0.0
+        return random.lognormvariate(0.0, self.jitter) * median_ms / 1000.0 if self.jitter > 0 else median_ms / 1000.0
+
+    def decode_seconds(self, text: str) -> float:
+        """Time to stream ``text`` at the configured token rate."""
+        if self.tokens_per_sec <= 0:
+            return 0.0
+        return len(text) / max(1, self.chars_per_token) / self.tokens_per_sec
+
+
+def _completion_text(messages: List[Dict[str, Any]], page: str) -> str:
+    system = str(messages[0].get("content") or "") if messages else ""
+    user = str(messages[-1].get("content") or "") if messages else ""
+    if "策展人" in system:
+        try:
+            payload = json.loads(user)
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        # 用户提示词总带有 search_results 字段，非空时才是检索后的第二轮策划
+        if payload.get("search_results"):
+            return json.dumps(PLAN_FINAL, ensure_ascii=False)
+        topic = str(payload.get("topic") or "")
+        queries = [f"{topic} {query}".strip() for query in PLAN_SEARCH["search_queries"]]
+        return json.dumps({**PLAN_SEARCH, "search_queries": queries}, ensure_ascii=False)
+    if "摘要" in system and "previous_summary" in user:
+        return SUMMARY_TEXT
+    return page
+
+
+def _usage(messages: List[Dict[str, Any]], text: str) -> Dict[str, int]:
+    prompt = sum(len(str(message.get("content") or "")) for message in messages) // 2
+    completion = len(text) // 2
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def create_app(profile: Profile) -> FastAPI:
+    app = FastAPI(title="Baize fake upstreams")
+    page = _html_page(profile.page_kb)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if profile.error_rate and random.random() < profile.error_rate:
+            return JSONResponse(
+                {"error": {"message": "rate limited (fake)", "type": "rate_limit_error"}},
+                status_code=429,
+            )
+        messages = body.get("messages") or []
+        model = body.get("model") or "fake-model"
+        text = _completion_text(messages, page)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(profile.sample_delay(profile.ttft_ms) + profile.decode_seconds(text))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": _usage(messages, text),
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def stream() -> AsyncIterator[bytes]:
+            def frame(choices: List[Dict[str, Any]], **extra: Any) -> bytes:
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": choices,
+                    **extra,
+                }
+                return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+            await asyncio.sleep(profile.sample_delay(profile.ttft_ms))
+            interval = 1.0 / profile.tokens_per_sec if profile.tokens_per_sec > 0 else 0.0
+            step = max(1, profile.chars_per_token)
+            # 按绝对时间排程，避免 sleep 误差累积导致实际速率偏低
+            started = time.perf_counter()
+            for index, offset in enumerate(range(0, len(text), step)):
+                delay = started + index * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield frame([{"index": 0, "delta": {"content": text[offset:offset + step]}, "finish_reason": None}])
+            yield frame([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                yield frame([], usage=_usage(messages, text))
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/search")
+    async def search(request: Request):
+        body = await request.json()
+        query = str(body.get("query") or "")
+        max_results = int(body.get("max_results") or 5)
+        await asyncio.sleep(profile.sample_delay(profile.search_ms))
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"{query} - 结果 {i}",
+                    "url": f"https://example.com/{uuid.uuid4().hex[:8]}/{i}",
+                    "summary": f"关于「{query}」的第 {i} 条检索摘要，用于负载测试。" * 4,
+                    "content": f"「{query}」相关的正文片段 {i}。",
+                }
+                for i in range(1, max_results + 1)
+            ],
+        }
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Profile()
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms, help="median LLM time to first token")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="log-normal sigma of upstream latencies (0 = fixed)")
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec, help="LLM streaming rate per call")
+    parser.add_argument("--chars-per-token", type=int, default=defaults.chars_per_token, help="characters per streamed chunk")
+    parser.add_argument("--search-ms", type=float, default=defaults.search_ms, help="median latency per search query")
+    parser.add_argument("--page-kb", type=int, default=defaults.page_kb, help="size of the generated HTML page")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="fraction of LLM calls answered with 429")
+
+
+def profile_from_args(args: argparse.Namespace) -> Profile:
+    return Profile(
+        ttft_ms=args.ttft_ms,
+        jitter=args.jitter,
+        tokens_per_sec=args.tokens_per_sec,
+        chars_per_token=args.chars_per_token,
+        search_ms=args.search_ms,
+        page_kb=args.page_kb,
+        error_rate=args.error_rate,
+    )
+
+
+def profile_to_argv(profile: Profile) -> List[str]:
+    return [
+        "--ttft-ms", str(profile.ttft_ms),
+        "--jitter", str(profile.jitter),
+        "--tokens-per-sec", str(profile.tokens_per_sec),
+        "--chars-per-token", str(profile.chars_per_token),
+        "--search-ms", str(profile.search_ms),
+        "--page-kb", str(profile.page_kb),
+        "--error-rate", str(profile.error_rate),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Offline end-to-end load test of ``POST /generate``.
+
+Usage:
+    python -m loadtest.run [--concurrency 8] [--requests 64] [--json report.json] [gates...]
+
+Starts the fake upstreams (``loadtest.fake_upstreams``) and the real app
+under uvicorn as subprocesses, pointing the app's OpenAI base URL and
+Tailiy URL at the fakes, then drives N concurrent SSE clients. Reports
+requests/sec, time to first byte, time to first generation delta, the gap
+between generation frames (as the client sees them, i.e. after SSE
+coalescing), event-loop lag scraped from ``/metrics`` and the app's RSS.
+
+Every request uses a distinct topic and the page / planner / search caches
+are off unless ``--cache`` is given, so each request runs the full
+pipeline. Gates (``--min-rps``, ``--max-*-p99-ms``) make the process exit
+non-zero when a threshold is missed.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+
+from .fake_upstreams import add_profile_arguments, profile_from_args, profile_to_argv
+
+
+ROOT = Path(__file__).resolve().parent.parent
+LOOP_LAG_METRIC = "baize_event_loop_lag_seconds"
+_BUCKET_RE = re.compile(rf'^{LOOP_LAG_METRIC}_bucket{{le="([^"]+)"}} (\S+)$')
+
+
+@dataclass
+class RequestResult:
+    ok: bool = False
+    status: int = 0
+    error: Optional[str] = None
+    ttfb: Optional[float] = None
+    first_delta: Optional[float] = None
+    total: Optional[float] = None
+    frames: int = 0
+    gaps: List[float] = field(default_factory=list)
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile; None for an empty sample."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value * 1000.0, 1)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of ``pid`` from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        return None
+    return None
+
+
+def parse_loop_lag(text: str) -> Dict[str, Any]:
+    """Cumulative loop-lag histogram (buckets, sum, count) from a /metrics scrape."""
+    buckets: Dict[float, float] = {}
+    total = count = 0.0
+    for line in text.splitlines():
+        match = _BUCKET_RE.match(line)
+        if match:
+            bound = float("inf") if match.group(1) == "+Inf" else float(match.group(1))
+            buckets[bound] = float(match.group(2))
+        elif line.startswith(f"{LOOP_LAG_METRIC}_sum "):
+            total = float(line.split()[1])
+        elif line.startswith(f"{LOOP_LAG_METRIC}_count "):
+            count = float(line.split()[1])
+    return {"buckets": buckets, "sum": total, "count": count}
+
+
+def loop_lag_delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """Mean and bucket-bound p99 of the loop lag observed between two scrapes."""
+    count = after["count"] - before["count"]
+    if count <= 0:
+        return {"samples": 0, "mean_ms": None, "p99_ms": None}
+    bounds = sorted(after["buckets"])
+    p99 = next(
+        (bound for bound in bounds if after["buckets"][bound] - before["buckets"].get(bound, 0.0) >= 0.99 * count),
+        float("inf"),
+    )
+    finite = [bound for bound in bounds if bound != float("inf")]
+    report: Dict[str, Any] = {
+        "samples": int(count),
+        "mean_ms": _ms((after["sum"] - before["sum"]) / count),
+        # 分桶上界：真实 p99 不超过该值；超出最大分桶时取最大分桶并标记
+        "p99_ms": _ms(p99 if p99 != float("inf") else (finite[-1] if finite else None)),
+    }
+    if p99 == float("inf"):
+        report["p99_over_range"] = True
+    return report
+
+
+async def run_request(client: httpx.AsyncClient, index: int, run_id: str, flush_policy: Optional[str]) -> RequestResult:
+    result = RequestResult()
+    payload: Dict[str, Any] = {"topic": f"负载测试主题 {run_id}-{index}"}
+    if flush_policy:
+        payload["flush_policy"] = flush_policy
+    started = time.perf_counter()
+    last_frame: Optional[float] = None
+    try:
+        async with client.stream("POST", "/generate", json=payload) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                result.error = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                now = time.perf_counter()
+                if result.ttfb is None:
+                    result.ttfb = now - started
+                event = json.loads(line[5:])
+                kind = event.get("event")
+                if kind == "generation" and "delta" in event:
+                    result.frames += 1
+                    if last_frame is None:
+                        result.first_delta = now - started
+                    else:
+                        result.gaps.append(now - last_frame)
+                    last_frame = now
+                elif kind == "error":
+                    result.error = str(event.get("message"))
+                elif kind == "done":
+                    result.ok = result.error is None
+    except httpx.HTTPError as exc:
+        result.error = f"{type(exc).__name__}: {exc}"
+    result.total = time.perf_counter() - started
+    if not result.ok and result.error is None:
+        result.error = "stream ended without done"
+    return result
+
+
+async def drive(base_url: str, concurrency: int, total: int, flush_policy: Optional[str], timeout: float) -> List[RequestResult]:
+    """Run ``total`` requests with at most ``concurrency`` in flight."""
+    run_id = os.urandom(3).hex()
+    counter = iter(range(total))
+    results: List[RequestResult] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits, trust_env=False) as client:
+        async def worker() -> None:
+            for index in counter:
+                results.append(await run_request(client, index, run_id, flush_policy))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def sample_rss(pid: int, samples: List[float], stop: asyncio.Event, interval: float = 0.25) -> None:
+    while not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def scrape_loop_lag(base_url: str) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=10.0, trust_env=False) as client:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+        return parse_loop_lag(response.text)
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0, trust_env=False) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"process exited with code {process.returncode} before becoming ready: {url}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"timed out waiting for {url}")
+
+
+def app_environment(upstream_url: str, use_cache: bool, overrides: Sequence[str], cache_dir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "API_KEY": "sk-loadtest",
+        "BASE_URL": f"{upstream_url}/v1",
+        "MODEL": "loadtest-model",
+        "TAILIY_API_URL": f"{upstream_url}/search",
+        "TAILIY_API_KEY": "loadtest",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": "",
+        "METRICS_ENABLED": "true",
+        "PAGE_CACHE_DIR": os.path.join(cache_dir, "pages"),
+        "SEARCH_CACHE_DIR": os.path.join(cache_dir, "search"),
+        "NO_PROXY": "127.0.0.1,localhost",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if not use_cache:
+        env.update({"PAGE_CACHE_ENABLED": "false", "PLANNER_CACHE_ENABLED": "false", "SEARCH_CACHE_ENABLED": "false"})
+    for item in overrides:
+        name, _, value = item.partition("=")
+        env[name.strip()] = value
+    return env
+
+
+def summarize(results: List[RequestResult], elapsed: float, rss: List[float], loop_lag: Dict[str, Any]) -> Dict[str, Any]:
+    ok = [r for r in results if r.ok]
+    gaps = [gap for r in ok for gap in r.gaps]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            errors[r.error or "unknown"] = errors.get(r.error or "unknown", 0) + 1
+
+    def dist(values: List[float]) -> Dict[str, Optional[float]]:
+        return {"p50_ms": _ms(percentile(values, 50)), "p99_ms": _ms(percentile(values, 99)), "max_ms": _ms(max(values) if values else None)}
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        "ttfb": dist([r.ttfb for r in ok if r.ttfb is not None]),
+        "first_delta": dist([r.first_delta for r in ok if r.first_delta is not None]),
+        "total": dist([r.total for r in ok if r.total is not None]),
+        "frame_gap": {**dist(gaps), "frames_per_request": round(len(gaps) / len(ok) + 1, 1) if ok else None},
+        "loop_lag": loop_lag,
+        "rss_mb": {
+            "start": round(rss[0], 1) if rss else None,
+            "peak": round(max(rss), 1) if rss else None,
+            "end": round(rss[-1], 1) if rss else None,
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"requests     {report['ok']}/{report['requests']} ok in {report['elapsed_s']}s  ->  {report['rps']} req/s")
+    for name in ("ttfb", "first_delta", "total", "frame_gap"):
+        stats = report[name]
+        print(f"{name:<13}p50 {stats['p50_ms']} ms   p99 {stats['p99_ms']} ms   max {stats['max_ms']} ms")
+    lag = report["loop_lag"]
+    bound = ">" if lag.get("p99_over_range") else "<="
+    print(f"loop lag     mean {lag['mean_ms']} ms   p99 {bound} {lag['p99_ms']} ms   ({lag['samples']} samples)")
+    rss = report["rss_mb"]
+    print(f"rss          start {rss['start']} MB   peak {rss['peak']} MB   end {rss['end']} MB")
+    for error, count in report["errors"].items():
+        print(f"error        {count} x {error}")
+
+
+def check_gates(report: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    """Return the gates the report fails."""
+    failures = []
+    if report["errors"] and not args.allow_errors:
+        failures.append(f"{report['requests'] - report['ok']} request(s) failed")
+    if args.min_rps is not None and (report["rps"] or 0) < args.min_rps:
+        failures.append(f"rps {report['rps']} < {args.min_rps}")
+    limits = (
+        ("ttfb", report["ttfb"]["p99_ms"], args.max_ttfb_p99_ms),
+        ("first_delta", report["first_delta"]["p99_ms"], args.max_first_delta_p99_ms),
+        ("frame_gap", report["frame_gap"]["p99_ms"], args.max_gap_p99_ms),
+        ("loop_lag", report["loop_lag"]["p99_ms"], args.max_loop_lag_p99_ms),
+    )
+    for name, value, limit in limits:
+        if name == "loop_lag" and report["loop_lag"].get("p99_over_range"):
+            value = float("inf")
+        if limit is not None and value is not None and value > limit:
+            failures.append(f"{name} p99 {value} ms > {limit} ms")
+    if args.max_rss_mb is not None and (report["rss_mb"]["peak"] or 0) > args.max_rss_mb:
+        failures.append(f"peak rss {report['rss_mb']['peak']} MB > {args.max_rss_mb} MB")
+    return failures
+
+
+def _spawn(argv: List[str], env: Dict[str, str], quiet: bool) -> subprocess.Popen:
+    output = subprocess.DEVNULL if quiet else None
+    return subprocess.Popen(argv, cwd=ROOT, env=env, stdout=output, stderr=output)
+
+
+def _stop(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    upstream_port = args.upstream_port or _free_port()
+    app_port = args.app_port or _free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    env = dict(os.environ, NO_PROXY="127.0.0.1,localhost")
+
+    upstream = app = None
+    with tempfile.TemporaryDirectory(prefix="baize-loadtest-") as cache_dir:
+        try:
+            upstream = _spawn(
+                [sys.executable, "-m", "loadtest.fake_upstreams", "--port", str(upstream_port),
+                 *profile_to_argv(profile_from_args(args))],
+                env,
+                quiet=not args.verbose,
+            )
+            app = _spawn(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                 "--log-level", "warning", "--no-access-log"],
+                app_environment(upstream_url, args.cache, args.env, cache_dir),
+                quiet=not args.verbose,
+            )
+            await wait_ready(f"{upstream_url}/health", upstream, args.startup_timeout)
+            await wait_ready(f"{app_url}/metrics", app, args.startup_timeout)
+
+            if args.warmup:
+                await drive(app_url, min(args.concurrency, args.warmup), args.warmup, args.flush_policy, args.timeout)
+
+            lag_before = await scrape_loop_lag(app_url)
+            rss: List[float] = []
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(sample_rss(app.pid, rss, stop))
+            started = time.perf_counter()
+            results = await drive(app_url, args.concurrency, args.requests, args.flush_policy, args.timeout)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+            lag_after = await scrape_loop_lag(app_url)
+        finally:
+            _stop(app)
+            _stop(upstream)
+
+    report = summarize(results, elapsed, rss, loop_lag_delta(lag_before, lag_after))
+    report["config"] = {
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "cache": args.cache,
+        "flush_policy": args.flush_policy,
+        "upstream": vars(profile_from_args(args)),
+        "env": list(args.env),
+    }
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    failures = check_gates(report, args)
+    for failure in failures:
+        print(f"FAIL         {failure}")
+    return 1 if failures else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=64, help="total measured requests")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests sent first")
+    parser.add_argument("--flush-policy", choices=("latency", "throughput"), default=None)
+    parser.add_argument("--cache", action="store_true", help="keep page / planner / search caches enabled")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra environment for the app")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--app-port", type=int, default=0)
+    parser.add_argument("--upstream-port", type=int, default=0)
+    parser.add_argument("--json", help="write the report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="show the app's and fakes' output")
+    gates = parser.add_argument_group("gates")
+    gates.add_argument("--min-rps", type=float)
+    gates.add_argument("--max-ttfb-p99-ms", type=float)
+    gates.add_argument("--max-first-delta-p99-ms", type=float)
+    gates.add_argument("--max-gap-p99-ms", type=float)
+    gates.add_argument("--max-loop-lag-p99-ms", type=float)
+    gates.add_argument("--max-rss-mb", type=float)
+    gates.add_argument("--allow-errors", action="store_true", help="do not fail on request errors")
+    add_profile_arguments(parser.add_argument_group("fake upstreams"))
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -57,7 +57,8 @@ document.addEventListener('DOMContentLoaded', () => {
         error: document.getElementById('agent-error-template'),
     };
 
-    let conversationHistory = [];
+    // 对话历史保存在服务端，客户端只保留会话 ID；空字符串表示请服务端新建会话
+    let sessionId = '';
     let accumulatedCode = '';
     let placeholderInterval;
 
@@ -70,8 +71,6 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (isInitial) switchToChatView();
 
-        // 将用户消息添加到历史记录中
-        conversationHistory.push({ role: 'user', content: topic });
         startGeneration(topic);
         input.value = '';
         if (isInitial) placeholderContainer?.classList?.remove('hidden');
@@ -90,6 +89,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
         let plannerBlock = null;
         let lastPlannerStep = null;
+        // 已显示的检索结果；服务端丢弃提前检索时（search_reset）一并移除
+        let searchEntries = [];
         let htmlBlock = null;
         let htmlHeaderInjected = false;
         let htmlBuffer = '';
@@ -102,14 +103,14 @@ document.addEventListener('DOMContentLoaded', () => {
                 plannerBlock = appendCodeBlock();
             }
             const header = `\n\n// ${title}\n`;
-            updateCodeBlock(plannerBlock, header + JSON.stringify(payload, null, 2) + '\n');
+            return updateCodeBlock(plannerBlock, header + JSON.stringify(payload, null, 2) + '\n');
         };
 
         try {
             const response = await fetch(`${config.apiBaseUrl}/generate`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ topic, history: conversationHistory }),
+                body: JSON.stringify({ topic, session_id: sessionId }),
             });
 
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
@@ -143,13 +144,19 @@ document.addEventListener('DOMContentLoaded', () => {
                     const eventType = payload.event;
                     if (!eventType) continue;
 
-                    if (eventType === 'planner') {
+                    if (eventType === 'session') {
+                        sessionId = payload.session_id || sessionId;
+                    } else if (eventType === 'planner') {
                         lastPlannerStep = payload.step || 'planner';
                         appendPlannerUpdate(`Planner (${lastPlannerStep})`, payload.parsed ?? payload);
                     } else if (eventType === 'search') {
-                        appendPlannerUpdate(`Search: ${payload.query || ''}`, payload.result ?? {});
+                        const entry = appendPlannerUpdate(`Search: ${payload.query || ''}`, payload.result ?? {});
+                        if (entry) searchEntries.push(entry);
+                    } else if (eventType === 'search_reset') {
+                        searchEntries.forEach((entry) => entry.remove());
+                        searchEntries = [];
                     } else if (eventType === 'generation') {
-                        const { delta, html, final } = payload;
+                        const { delta, html, final, artifact } = payload;
 
                         if (delta) {
                             if (!htmlBlock) {
@@ -168,7 +175,7 @@ document.addEventListener('DOMContentLoaded', () => {
                             if (agentThinkingMessage) agentThinkingMessage.remove();
                             if (plannerBlock) markCodeAsComplete(plannerBlock);
 
-                            let htmlContent = html || htmlBuffer;
+                            let htmlContent = html || await resolveStreamedHtml(htmlBuffer, artifact);
                             if (!htmlBlock) {
                                 htmlBlock = appendCodeBlock();
                             }
@@ -186,7 +193,6 @@ document.addEventListener('DOMContentLoaded', () => {
                             if (htmlContent && isHtmlContentValid(htmlContent)) {
                                 htmlBuffer = htmlContent;
                                 appendAnimationPlayer(htmlContent, topic);
-                                conversationHistory.push({ role: 'assistant', content: htmlContent });
                                 htmlReceived = true;
                             } else {
                                 console.warn('Invalid or empty HTML received.');
@@ -266,7 +272,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     function updateCodeBlock(codeBlockElement, text) {
         const codeElement = codeBlockElement.querySelector('code');
-        if (!text || !codeElement) return;
+        if (!text || !codeElement) return null;
         const span = document.createElement('span');
         span.textContent = text;
         codeElement.appendChild(span);
@@ -280,6 +286,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 });
             });
         }
+        return span;
     }
 
     function markCodeAsComplete(codeBlockElement) {
@@ -287,6 +294,35 @@ document.addEventListener('DOMContentLoaded', () => {
         codeBlockElement.querySelector('.code-details').removeAttribute('open');
     }
 
+    // 紧凑模式下最终事件不再重复携带 html：从已接收的增量中提取文档（与服务端规则一致），
+    // 字节长度与 artifact 不符时再按 artifact 地址拉取
+    function extractHtmlDocument(text) {
+        const lower = text.toLowerCase();
+        const start = lower.indexOf('<html');
+        const end = lower.lastIndexOf('</html>');
+        if (start !== -1 && end > start) {
+            return text.slice(start, end + '</html>'.length);
+        }
+        let stripped = text.trim();
+        if (stripped.startsWith('```')) {
+            stripped = stripped.replace(/^```(?:html|json|markdown)?\s*/i, '').replace(/\s*```$/, '').trim();
+        }
+        return stripped;
+    }
+
+    async function resolveStreamedHtml(streamedText, artifact) {
+        const extracted = extractHtmlDocument(streamedText || '');
+        if (!artifact) return extracted;
+        if (new TextEncoder().encode(extracted).length === artifact.length) return extracted;
+        try {
+            const response = await fetch(`${config.apiBaseUrl}${artifact.url}`);
+            if (response.ok) return await response.text();
+        } catch (err) {
+            console.warn('Failed to fetch artifact:', artifact.url, err);
+        }
+        return extracted;
+    }
+
     function appendAnimationPlayer(htmlContent, topic) {
         console.log('Appending animation player with topic:', topic);
         const node = templates.player.content.cloneNode(true);
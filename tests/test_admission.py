@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdaptiveLimit, AdmissionController
+
+
+class _Throttled(Exception):
+    status_code = 429
+
+
+def test_throttle_halves_limit_with_cooldown_and_floor(monkeypatch):
+    lane = AdaptiveLimit("model:p/m", max_limit=8, min_limit=2)
+    lane.record_throttle()
+    assert lane.capacity == 4
+    # 冷却期内的连续 429 只收缩一次
+    lane.record_throttle()
+    assert lane.capacity == 4
+
+    monkeypatch.setattr(AdaptiveLimit, "DECREASE_COOLDOWN", 0.0)
+    for _ in range(5):
+        lane.record_throttle()
+    assert lane.capacity == 2
+
+
+def test_success_increases_additively_up_to_max():
+    lane = AdaptiveLimit("model:p/m", max_limit=4)
+    lane.limit = 2.0
+    lane.record_success(0.1)
+    assert lane.limit == pytest.approx(2.5)
+    assert lane.capacity == 2
+    lane.record_success(0.1)
+    assert lane.capacity == 2
+    for _ in range(20):
+        lane.record_success(0.1)
+    assert lane.limit == 4.0
+
+
+def test_latency_spike_decreases_limit():
+    lane = AdaptiveLimit("model:p/m", max_limit=10)
+    lane.record_success(1.0)
+    lane.record_success(5.0)
+    assert lane.limit == pytest.approx(8.0)
+
+
+def test_non_adaptive_lane_keeps_its_limit():
+    lane = AdaptiveLimit("model:p/m", max_limit=3, adaptive=False)
+    lane.record_throttle()
+    lane.record_success(0.1)
+    assert lane.capacity == 3
+
+
+def test_slot_admits_by_priority_and_shrinks_on_429():
+    async def scenario():
+        controller = AdmissionController(True, provider_limit=4, model_limit=1)
+        order = []
+        release = asyncio.Event()
+
+        async def call(name, priority):
+            async with controller.slot("p", "m", priority):
+                order.append(name)
+                await release.wait()
+
+        holder = asyncio.create_task(call("holder", "interactive"))
+        await asyncio.sleep(0)
+        batch = asyncio.create_task(call("batch", "batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(call("interactive", "interactive"))
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 2
+        release.set()
+        await asyncio.gather(holder, batch, interactive)
+
+        with pytest.raises(_Throttled):
+            async with controller.slot("p", "m"):
+                raise _Throttled()
+        lanes = controller.stats()["lanes"]
+        return order, lanes
+
+    order, lanes = asyncio.run(scenario())
+    assert order == ["holder", "interactive", "batch"]
+    assert lanes["provider:p"]["limit"] == 2
+    assert lanes["model:p/m"]["in_flight"] == 0
+
+
+def test_idle_lanes_are_evicted_beyond_cap():
+    async def scenario():
+        controller = AdmissionController(True, provider_limit=4, model_limit=1, max_lanes=4)
+        for index in range(20):
+            async with controller.slot("p", f"m{index}"):
+                pass
+        return controller.stats()["lanes"]
+
+    lanes = asyncio.run(scenario())
+    assert len(lanes) <= 4
+    assert "model:p/m19" in lanes
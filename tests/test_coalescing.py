@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app.coalescing import SingleFlight
+
+
+def _producer(started, release, events=("a", "b", "c")):
+    async def factory():
+        started.set()
+        for event in events:
+            yield event
+            await release.wait()
+    return factory
+
+
+def test_late_subscriber_replays_then_follows():
+    async def scenario():
+        flights = SingleFlight()
+        started, release = asyncio.Event(), asyncio.Event()
+        factory = _producer(started, release)
+        first = flights.stream("k", factory)
+        assert await first.__anext__() == "a"
+        second = flights.stream("k", factory)
+        assert await second.__anext__() == "a"
+        assert len(flights) == 1
+        release.set()
+        rest_first = [event async for event in first]
+        rest_second = [event async for event in second]
+        return rest_first, rest_second, len(flights)
+
+    assert asyncio.run(scenario()) == (["b", "c"], ["b", "c"], 0)
+
+
+def test_producer_cancelled_only_when_last_subscriber_leaves():
+    async def scenario():
+        flights = SingleFlight()
+        started, release = asyncio.Event(), asyncio.Event()
+        factory = _producer(started, release)
+        first = flights.stream("k", factory)
+        second = flights.stream("k", factory)
+        await first.__anext__()
+        await second.__anext__()
+        flight, _ = flights.join("k", factory)
+
+        await first.aclose()
+        await asyncio.sleep(0)
+        assert not flight.task.done()
+        assert len(flights) == 1
+
+        await second.aclose()
+        with pytest.raises(asyncio.CancelledError):
+            await flight.task
+        assert len(flights) == 0
+
+        # 之后的相同请求启动新的流水线
+        third = flights.stream("k", factory)
+        assert await third.__anext__() == "a"
+        await third.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_producer_error_reaches_every_subscriber():
+    async def failing():
+        yield "a"
+        raise RuntimeError("上游失败")
+
+    async def consume(flights):
+        return [event async for event in flights.stream("k", failing)]
+
+    async def scenario():
+        flights = SingleFlight()
+        results = await asyncio.gather(consume(flights), consume(flights), return_exceptions=True)
+        return results, len(flights)
+
+    results, remaining = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert remaining == 0
@@ -0,0 +1,62 @@
+import random
+import re
+
+import pytest
+
+from app.html_stream import IncrementalHTMLExtractor
+
+
+def _reference(text):
+    match = re.search(r"<html[\s\S]*</html>", text.strip(), re.IGNORECASE)
+    return match.group(0) if match else None
+
+
+def _extract(chunks):
+    extractor = IncrementalHTMLExtractor()
+    for chunk in chunks:
+        extractor.feed(chunk)
+    return extractor
+
+
+PAGE = "```html\n<!DOCTYPE html>\n<html lang=\"zh\"><head><title>月食</title></head><body><p>月食</p></body></html>\n```"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 24, len(PAGE)])
+def test_tags_split_across_chunks(size):
+    chunks = [PAGE[i:i + size] for i in range(0, len(PAGE), size)]
+    extractor = _extract(chunks)
+    assert extractor.has_document
+    assert extractor.result() == _reference(PAGE)
+
+
+def test_last_closing_tag_wins_and_case_is_ignored():
+    text = "<HTML><body>1</body></HTML> 说明 <p>2</p></html>尾注"
+    chunks = [text[i:i + 4] for i in range(0, len(text), 4)]
+    assert _extract(chunks).result() == "<HTML><body>1</body></HTML> 说明 <p>2</p></html>"
+
+
+def test_fallback_strips_fences_without_document():
+    extractor = _extract(["```html\n<div>", "片段</div>\n", "```"])
+    assert not extractor.has_document
+    assert extractor.result() == "<div>片段</div>"
+
+
+def test_empty_response_raises():
+    with pytest.raises(ValueError):
+        _extract(["  ", "\n"]).result()
+
+
+def test_random_chunking_matches_regex():
+    rng = random.Random(7)
+    pieces = ["<html>", "</html>", "</HTML>", "<p>", "x", "l>", "\n", "```html\n", "<", ">", "ht", "ml", "</", "İ"]
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 12)))
+        chunks = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(1, 5)
+            chunks.append(text[pos:pos + size])
+            pos += size
+        expected = _reference(text)
+        if expected is not None:
+            assert _extract(chunks).result() == expected, text
@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app.json_repair import JSONRepairError, parse_json_object, repair_json
+
+
+CORPUS = Path(__file__).resolve().parent.parent / "benchmarks" / "corpus" / "planner"
+
+
+def test_clean_object_needs_no_repair():
+    result = parse_json_object('{"a": [1, 2], "b": null}')
+    assert result.value == {"a": [1, 2], "b": None}
+    assert result.repairs == []
+
+
+@pytest.mark.parametrize(
+    "raw, expected, repair",
+    [
+        ('```json\n{"a": 1}\n```', {"a": 1}, "code_fence"),
+        ('好的，蓝图如下：{"a": 1}', {"a": 1}, "leading_prose"),
+        ('{"a": 1} 以上。', {"a": 1}, "trailing_prose"),
+        ('{"a": [1, 2,], "b": 3,}', {"a": [1, 2], "b": 3}, "trailing_comma"),
+        ('{"a": "第一行\n第二行"}', {"a": "第一行\n第二行"}, "control_chars"),
+        ('{"a": "他说"你好"然后离开"}', {"a": '他说"你好"然后离开'}, "inner_quotes"),
+        ('{"a": "x"\n"b": "y"}', {"a": "x", "b": "y"}, "missing_comma"),
+    ],
+)
+def test_repairs(raw, expected, repair):
+    result = repair_json(raw)
+    assert result.value == expected
+    assert repair in result.repairs
+
+
+def test_fence_inside_string_is_kept():
+    assert repair_json('{"a": "```code```"}').value == {"a": "```code```"}
+    assert repair_json('{"a": "```code```"').value == {"a": "```code```"}
+    fenced = repair_json('```json\n{"a": "```x```", "b": 1}\n```')
+    assert fenced.value == {"a": "```x```", "b": 1}
+    assert fenced.repairs == ["code_fence"]
+
+
+def test_closing_fence_ends_truncated_value():
+    result = repair_json('```json\n{"a": 1\n```')
+    assert result.value == {"a": 1}
+    assert result.repairs == ["code_fence", "truncated"]
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ('{"a": "半截', {"a": "半截"}),
+        ('{"a": [1, {"b": 2', {"a": [1, {"b": 2}]}),
+        ('{"a": 1, "b"', {"a": 1}),
+        ('{"a": 1, "bc', {"a": 1}),
+        ('{"a": 1, "b":', {"a": 1, "b": None}),
+        ('{"a": 1,', {"a": 1}),
+        ('{"a": "x\\', {"a": "x"}),
+        ('{"a": "x\\\\', {"a": "x\\"}),
+        ('{"a": "x\\u00', {"a": "x"}),
+        ('{"a": tru', {"a": True}),
+        ('{"a": [1, fa', {"a": [1, False]}),
+        ('{"a": nu', {"a": None}),
+        ('{"a": 12', {"a": 12}),
+        ('{"a": 1.', {"a": 1}),
+        ('{"a": 1.5e', {"a": 1.5}),
+        ('{"a": -', {"a": None}),
+    ],
+)
+def test_truncated_output(raw, expected):
+    result = repair_json(raw)
+    assert result.value == expected
+    assert result.repairs[-1] == "truncated"
+
+
+def test_unrepairable_input_raises():
+    with pytest.raises(JSONRepairError):
+        parse_json_object("没有任何 JSON")
+    with pytest.raises(JSONRepairError):
+        parse_json_object("[1, 2]")
+    with pytest.raises(JSONRepairError):
+        parse_json_object("   ")
+
+
+@pytest.mark.parametrize("path", sorted(CORPUS.glob("*.txt")), ids=lambda path: path.stem)
+def test_planner_corpus(path):
+    text = path.read_text(encoding="utf-8")
+    result = parse_json_object(text)
+    assert isinstance(result.value, dict)
+    # 修复后的文本本身是合法 JSON，且与解码结果一致
+    assert json.loads(result.text) == result.value
@@ -0,0 +1,33 @@
+import pytest
+
+from app.json_stream import IncrementalJSONObjectParser
+
+
+TEXT = '```json\n{"need_search": true, "search_queries": ["月食 \\"原理\\"", "a]b"], "outline": {"x": [1, {"y": "}"}]}, "n": 3}\n```'
+
+
+def _feed(chunks):
+    parser = IncrementalJSONObjectParser()
+    members = [member for chunk in chunks for member in parser.feed(chunk)]
+    return parser, members
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(TEXT)])
+def test_members_reported_across_chunk_boundaries(size):
+    parser, members = _feed([TEXT[i:i + size] for i in range(0, len(TEXT), size)])
+    assert members == [
+        ("need_search", True),
+        ("search_queries", ['月食 "原理"', "a]b"]),
+        ("outline", {"x": [1, {"y": "}"}]}),
+        ("n", 3),
+    ]
+    assert parser.finished
+    assert parser.text == TEXT
+
+
+def test_member_reported_as_soon_as_value_closes():
+    parser = IncrementalJSONObjectParser()
+    assert parser.feed('{"queries": ["a", "b"') == []
+    assert parser.feed("]") == [("queries", ["a", "b"])]
+    assert parser.feed(', "tail": "未完') == []
+    assert not parser.finished
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from app.config import config
+from app.llm_router import Endpoint, LLMRouter, is_endpoint_failure
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def _router(*names):
+    router = LLMRouter({name: {} for name in names})
+    router._endpoints = [Endpoint(name, "openai", client=None) for name in names]
+    return router
+
+
+def _collect(router, open_stream):
+    async def run():
+        return [delta async for delta in router.stream("m", open_stream)]
+
+    return asyncio.run(run())
+
+
+def test_failure_classification():
+    assert is_endpoint_failure(_StatusError(503))
+    assert is_endpoint_failure(_StatusError(429))
+    assert is_endpoint_failure(ConnectionError())
+    assert not is_endpoint_failure(_StatusError(400))
+    assert not is_endpoint_failure(ValueError("bad"))
+
+
+def test_run_fails_over_to_next_endpoint():
+    router = _router("a", "b")
+    attempts = []
+
+    async def call(endpoint, model):
+        attempts.append(endpoint.name)
+        if endpoint.name == "a":
+            raise _StatusError(503)
+        return "ok"
+
+    assert asyncio.run(router.run("m", call)) == "ok"
+    assert attempts == ["a", "b"]
+    assert router.health(router.endpoints()[0]).consecutive_failures == 1
+
+
+def test_request_errors_do_not_fail_over():
+    router = _router("a", "b")
+    attempts = []
+
+    async def call(endpoint, model):
+        attempts.append(endpoint.name)
+        raise _StatusError(400)
+
+    with pytest.raises(_StatusError):
+        asyncio.run(router.run("m", call))
+    assert attempts == ["a"]
+    assert router.health(router.endpoints()[0]).consecutive_failures == 0
+
+
+def test_stream_fails_over_before_first_token():
+    router = _router("a", "b")
+
+    async def open_stream(endpoint, model):
+        if endpoint.name == "a":
+            raise _StatusError(502)
+        yield "你"
+        yield "好"
+
+    assert _collect(router, open_stream) == ["你", "好"]
+
+
+def test_stream_does_not_fail_over_after_first_token():
+    router = _router("a", "b")
+    attempts = []
+
+    async def open_stream(endpoint, model):
+        attempts.append(endpoint.name)
+        yield "半"
+        raise _StatusError(502)
+
+    with pytest.raises(_StatusError):
+        _collect(router, open_stream)
+    assert attempts == ["a"]
+
+
+def test_consecutive_failures_eject_endpoint(monkeypatch):
+    monkeypatch.setattr(config, "llm_router_eject_after", 2)
+    monkeypatch.setattr(config, "llm_router_eject_seconds", 60.0)
+    router = _router("a", "b")
+    # 权重让 a 在错误率惩罚下仍排在前面，直到被剔除
+    router._endpoints[0].weight = 100.0
+    attempts = []
+
+    async def call(endpoint, model):
+        attempts.append(endpoint.name)
+        if endpoint.name == "a":
+            raise _StatusError(503)
+        return endpoint.name
+
+    async def run():
+        return [await router.run("m", call) for _ in range(4)]
+
+    assert asyncio.run(run()) == ["b", "b", "b", "b"]
+    # 连续两次失败后 a 被剔除，之后的请求直接发往 b
+    assert attempts == ["a", "b", "a", "b", "b", "b"]
+    assert [endpoint.name for endpoint in router.candidates("m", "complete")] == ["b"]
+    assert router.stats()["a"]["ejected"]
+
+
+def test_all_ejected_still_tries_earliest_expiry(monkeypatch):
+    monkeypatch.setattr(config, "llm_router_eject_seconds", 60.0)
+    router = _router("a", "b")
+    a, b = router.endpoints()
+    router.health(b).eject()
+    router.health(a).eject()
+    assert [endpoint.name for endpoint in router.candidates("m", "stream")] == ["b"]
+
+
+def test_model_mapping_limits_candidates():
+    router = _router("a", "b")
+    router._endpoints[0].models = {"m": "provider-m"}
+    router._endpoints[1].models = {"other": "x"}
+    seen = []
+
+    async def call(endpoint, model):
+        seen.append((endpoint.name, model))
+        return model
+
+    assert asyncio.run(router.run("m", call)) == "provider-m"
+    assert seen == [("a", "provider-m")]
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+
+from app.sse import DONE_FRAME, FlushPolicy, SSEEncoder, encode_delta, encode_event
+
+
+def _delta(text):
+    return {"event": "generation", "delta": text}
+
+
+async def _events(items, pause=None):
+    for item in items:
+        if pause is not None and item == pause:
+            await asyncio.sleep(0.3)
+            continue
+        yield item
+
+
+def _encode(policy, items, pause=None):
+    async def run():
+        encoder = SSEEncoder(policy)
+        return [frame async for frame in encoder.encode(_events(items, pause))], encoder
+
+    return asyncio.run(run())
+
+
+def _payloads(frames):
+    payloads = []
+    for frame in frames:
+        for block in frame.decode("utf-8").split("\n\n"):
+            if block:
+                payloads.append(json.loads(block[len("data: "):]))
+    return payloads
+
+
+def test_encoders_match_json_framing():
+    assert encode_delta('a"b') == encode_event(_delta('a"b'))
+    assert encode_event({"event": "done"}) == b'data: {"event": "done"}\n\n'
+
+
+def test_zero_window_writes_each_delta_and_ends_with_done():
+    frames, encoder = _encode(FlushPolicy("immediate", 0.0, 1024), [_delta("a"), _delta("b")])
+    assert frames == [encode_delta("a"), encode_delta("b"), DONE_FRAME]
+    assert encoder.frames == 3
+
+
+def test_deltas_coalesce_and_other_events_flush_in_order():
+    items = [_delta("a"), _delta("b"), {"event": "timing"}, _delta("c")]
+    frames, encoder = _encode(FlushPolicy("slow", 10.0, 1024), items)
+    assert _payloads(frames) == [_delta("ab"), {"event": "timing"}, _delta("c"), {"event": "[DONE]"}]
+    assert frames[-1].endswith(DONE_FRAME)
+    assert encoder.events == 4
+
+
+def test_max_chars_flushes_immediately():
+    frames, _ = _encode(FlushPolicy("small", 10.0, 3), [_delta("ab"), _delta("cd"), _delta("e")])
+    assert frames[0] == encode_delta("abcd")
+    assert _payloads(frames[1:]) == [_delta("e"), {"event": "[DONE]"}]
+
+
+def test_deadline_flushes_while_upstream_is_slow():
+    async def run():
+        encoder = SSEEncoder(FlushPolicy("latency", 0.01, 1024))
+        received = []
+        started = time.monotonic()
+        async for frame in encoder.encode(_events([_delta("a"), "pause", _delta("b")], pause="pause")):
+            received.append((time.monotonic() - started, frame))
+        return received
+
+    received = asyncio.run(run())
+    # 窗口到期时先写出缓冲，而不是等到上游的下一个事件
+    assert received[0][1] == encode_delta("a")
+    assert received[0][0] < 0.2
+    assert _payloads([frame for _, frame in received[1:]]) == [_delta("b"), {"event": "[DONE]"}]
+
+
+def test_bytes_events_pass_through_after_pending_deltas():
+    frames, _ = _encode(FlushPolicy("slow", 10.0, 1024), [_delta("a"), b"data: {}\n\n"])
+    assert frames[0] == encode_delta("a") + b"data: {}\n\n"
+    assert frames[-1] == DONE_FRAME
+
+
+def test_upstream_closed_when_consumer_stops():
+    closed = []
+
+    async def upstream():
+        try:
+            while True:
+                yield _delta("x")
+                await asyncio.sleep(0)
+        finally:
+            closed.append(True)
+
+    async def run():
+        stream = SSEEncoder(FlushPolicy("immediate", 0.0, 1024)).encode(upstream())
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert closed == [True]